@@ -0,0 +1,108 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+def normalize_query(query):
+    """Lowercase, collapse whitespace and drop trailing punctuation so trivial variants match."""
+    query = re.sub(r"\s+", " ", query.strip().lower())
+    return query.rstrip("?!. ")
+
+
+class AnswerCache:
+    """
+    In-memory LRU cache of answers keyed by (index version, normalised query).
+
+    Lookups try an exact match first, then (if `similarity_threshold` is set and a query
+    embedding is supplied) the most similar cached query for the same index version.
+    Entries expire after `ttl` seconds; a new index version never sees older answers. Keys carry
+    no conversation state, so callers only cache answers to questions without chat history.
+    """
+
+    def __init__(self, max_entries=512, ttl=3600, similarity_threshold=0.95):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+        # (index_version, normalised query) -> (answer, unit query vector or None, created_at)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _unit(vector):
+        if vector is None:
+            return None
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else None
+
+    def _expired(self, created_at):
+        return self.ttl is not None and time.time() - created_at > self.ttl
+
+    def get(self, query, index_version, query_vector=None):
+        """
+        Return a cached answer for `query` against `index_version`, or None.
+
+        Args:
+            query (str): The user's question.
+            index_version (str): Identifies the vector store contents the answer was built from.
+            query_vector (list, optional): The query embedding, enabling semantic matches.
+        """
+        key = (index_version, normalize_query(query))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if not self._expired(entry[2]):
+                    self._entries.move_to_end(key)
+                    self.exact_hits += 1
+                    return entry[0]
+                del self._entries[key]
+
+            unit = self._unit(query_vector) if self.similarity_threshold is not None else None
+            if unit is not None:
+                best_key, best_score = None, self.similarity_threshold
+                for cached_key, (_, cached_vector, created_at) in self._entries.items():
+                    if cached_key[0] != index_version or cached_vector is None or self._expired(created_at):
+                        continue
+                    score = float(np.dot(unit, cached_vector))
+                    if score >= best_score:
+                        best_key, best_score = cached_key, score
+                if best_key is not None:
+                    self._entries.move_to_end(best_key)
+                    self.semantic_hits += 1
+                    return self._entries[best_key][0]
+
+            self.misses += 1
+            return None
+
+    def put(self, query, index_version, answer, query_vector=None):
+        key = (index_version, normalize_query(query))
+        with self._lock:
+            self._entries[key] = (answer, self._unit(query_vector), time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, index_version=None):
+        """Drop the answers built from `index_version`, or every answer if it is None."""
+        with self._lock:
+            if index_version is None:
+                self._entries.clear()
+                return
+            for key in [k for k in self._entries if k[0] == index_version]:
+                del self._entries[key]
+
+    def stats(self):
+        lookups = self.exact_hits + self.semantic_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "exact_hits": self.exact_hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "hit_rate": (self.exact_hits + self.semantic_hits) / lookups if lookups else 0.0,
+        }
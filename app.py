@@ -1,8 +1,15 @@
+import uuid
 import streamlit as st
 from rag_pipeline import RAGPipeline
 from session_manager import SessionManager
 from history_manager import HistoryManager
-import os
+from upload_store import store_upload
+from indexing_jobs import DONE, FAILED, CANCELLED
+from tracing import tracer
+import resources
+
+# Tracing, metrics endpoint and slow-request profiling are set up once per server process (RAG_* env vars)
+resources.get_resource(("tracing",), tracer.configure_from_env)
 
 # -------------------------------
 # Streamlit Page Configuration
@@ -314,34 +321,87 @@ uploaded_files = st.file_uploader(
 if uploaded_files:
     # --- START: Change 2 (Rename variable from pdf_paths to generic file_paths) ---
     file_paths = []
-    os.makedirs("data", exist_ok=True) 
-    
+
+    # Uploads are stored by content hash, so reruns never rewrite files that already exist
     for file in uploaded_files:
-        file_path = os.path.join("data", file.name)
-        with open(file_path, "wb") as f:
-            f.write(file.getbuffer())
-        file_paths.append(file_path)
+        file_paths.append(store_upload(file.name, file.getbuffer()))
 
     # --- Initialization Logic ---
-    pipeline_needs_reinit = (
-        "pipeline" not in st.session_state 
-        or st.session_state.pipeline is None
-    )
+    # --- START: Change 5 (Index in a background job; keep answering from the current index meanwhile) ---
+    indexing_jobs = resources.get_indexing_jobs()
+    pipeline = st.session_state.get("pipeline")
+    # Jobs are shared by sessions indexing the same documents; this session only gives up its own claim
+    if "indexing_owner" not in st.session_state:
+        st.session_state.indexing_owner = uuid.uuid4().hex
+    indexing_owner = st.session_state.indexing_owner
+
+    @st.fragment(run_every=1.0)
+    def show_indexing_progress(job_id):
+        """Polls the indexing job; a full rerun picks up the result once it has finished."""
+        job = indexing_jobs.get(job_id)
+        if job is None or job.finished:
+            st.rerun()
+        st.progress(min(max(job.progress, 0.0), 1.0), text=job.message)
+        if st.button("✖ Cancel indexing", key=f"cancel_{job_id}"):
+            if not indexing_jobs.cancel(job_id, owner=indexing_owner):
+                st.info("Another session is indexing the same documents, so indexing continues.")
+
+    if pipeline is None or pipeline.file_paths != file_paths:
+        job = indexing_jobs.get(st.session_state.get("indexing_job_id"))
+        if job is None or job.files != file_paths:
+            if job is not None:
+                indexing_jobs.cancel(job.id, owner=indexing_owner)
+            job = indexing_jobs.submit(file_paths, owner=indexing_owner)
+            st.session_state.indexing_job_id = job.id
+
+        result = indexing_jobs.take_result(job.id, owner=indexing_owner) if job.status == DONE else None
+        if job.status == DONE and result is None:
+            # The job already released its index (e.g. this session took it before a failed setup)
+            st.session_state.indexing_job_id = indexing_jobs.submit(file_paths, owner=indexing_owner).id
+            st.rerun()
+        if job.status == DONE:
+            vectorstore, keyword_index = result
+            if pipeline is None:
+                try:
+                    # Building the pipeline loads the LLM, which fails e.g. without GEMINI_API_KEY
+                    st.session_state.pipeline = RAGPipeline(
+                        st.session_state.active_session, file_paths,
+                        vectorstore=vectorstore, index_version=job.index_version, keyword_index=keyword_index,
+                    )
+                    st.session_state.history_manager = HistoryManager(st.session_state.active_session)
+                    st.session_state.chat_history = st.session_state.history_manager.load_history()
+                except Exception as e:
+                    st.error(f"Error initializing RAG Pipeline: {e}. ")
+                    st.stop()
+            else:
+                # Swap the new index in; questions keep working throughout
+                try:
+                    pipeline.swap_index(
+                        vectorstore, job.index_version, file_paths, job.replaced_index_version,
+                        keyword_index=keyword_index,
+                    )
+                except Exception as e:
+                    st.error(f"Error updating the RAG Pipeline: {e}. ")
+                    st.stop()
+            st.session_state.indexing_job_id = None
+        elif job.status in (FAILED, CANCELLED):
+            if job.status == FAILED:
+                st.error(f"Error indexing your documents: {job.error}")
+            else:
+                st.warning("Indexing was cancelled.")
+            if st.button("🔁 Retry indexing"):
+                st.session_state.indexing_job_id = indexing_jobs.submit(file_paths, owner=indexing_owner).id
+                st.rerun()
+            if pipeline is None:
+                st.stop()
+        else:
+            if pipeline is not None:
+                st.caption("Updating the knowledge base; answers use the previous documents until it is ready.")
+            show_indexing_progress(job.id)
+            if pipeline is None:
+                st.stop()
+    # --- END: Change 5 ---
 
-    if pipeline_needs_reinit:
-        # --- START: Change 4 (Update spinner text) ---
-        with st.spinner("Indexing documents... This may take a moment."):
-            try:
-                # --- START: Change 3 (Pass generic file_paths) ---
-                st.session_state.pipeline = RAGPipeline(st.session_state.active_session, file_paths)
-                # --- END: Change 3 ---
-                st.session_state.history_manager = HistoryManager(st.session_state.active_session)
-                st.session_state.chat_history = st.session_state.history_manager.load_history()
-            except Exception as e:
-                 st.error(f"Error initializing RAG Pipeline: {e}. ")
-                 st.stop()
-        # --- END: Change 4 ---
-    
     pipeline = st.session_state.pipeline
     history_manager = st.session_state.history_manager
 
@@ -389,21 +449,25 @@ if uploaded_files:
         if user_query != st.session_state.get("last_user_query", None):
             st.session_state.last_user_query = user_query
             
-            # The message below will be added to history and displayed via rerun
-            
-            # Process the AI response
-            # --- START: Change 4 (Update spinner text) ---
-            with st.spinner("Thinking... Retrieving knowledge from your documents..."):
-            # --- END: Change 4 ---
-                try:
-                    answer = pipeline.ask(user_query) 
-                except Exception as e:
-                    answer = f"**Error:** Could not get an answer from the your uploaded document. ({e})"
-                    st.error(answer)
-                
-            # 3. Update and Persist History
-            history_manager.save_turn("user", user_query)
-            history_manager.save_turn("assistant", answer)
+            # Show the question right away and stream the answer into the assistant column
+            col1, col2 = st.columns([7, 3])
+            with col1:
+                with st.chat_message("user"):
+                    st.markdown(user_query)
+
+            col1, col2 = st.columns([3, 7])
+            with col2:
+                with st.chat_message("assistant"):
+                    try:
+                        answer = st.write_stream(pipeline.ask_stream(user_query))
+                    except Exception as e:
+                        st.error(f"**Error:** Could not get an answer from the your uploaded document. ({e})")
+                        # Keep the failed turn out of the session history and allow asking it again
+                        st.session_state.last_user_query = None
+                        st.stop()
+
+            # 3. Update and Persist History (only once the stream has completed)
+            history_manager.save_turns([("user", user_query), ("assistant", answer)])
 
             st.session_state.chat_history.append({"role": "user", "content": user_query})
             st.session_state.chat_history.append({"role": "assistant", "content": answer})
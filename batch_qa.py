@@ -0,0 +1,254 @@
+"""
+Headless batch question answering over a document set.
+
+Reads questions as JSONL ({"id": ..., "question": ...} per line), embeds them in one batch,
+searches the FAISS index once for all of them, builds each distinct context and prompt once and
+answers the distinct prompts with a bounded number of concurrent, rate-limited LLM calls. Results
+are written as JSONL ({"id", "question", "answer", "sources", "error", "latency_ms"}) in input order.
+No chat session or history file is involved.
+
+Usage (from the repository root):
+    python batch_qa.py --files data/AskDocsAI.txt --questions questions.jsonl --out answers.jsonl
+    python batch_qa.py --files data/AskDocsAI.txt --questions q.jsonl --out a.jsonl --llm llama_cpp
+    python batch_qa.py --files data/*.pdf --questions q.jsonl --out a.jsonl --concurrency 8 --rpm 120
+"""
+import argparse
+import contextvars
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import faiss
+import numpy as np
+from langchain_community.embeddings import HuggingFaceEmbeddings
+
+import resources
+from context_builder import ContextBuilder
+from llm_backends import BACKENDS
+from prompts import build_document_prompt
+from rag_pipeline import reciprocal_rank_fusion
+from rate_limiter import TokenBucket
+from tracing import tracer
+from vectorstore_manager import VectorStoreManager
+
+
+def read_questions(path):
+    """Questions from a JSONL file; a line without an "id" gets its line number."""
+    questions = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            questions.append({"id": record.get("id", line_number), "question": record["question"]})
+    return questions
+
+
+def embed_queries(embeddings, texts):
+    """
+    Query vectors for `texts`, as `embeddings.embed_query` computes them.
+
+    HuggingFaceEmbeddings (the model RAGPipeline uses) embeds a query exactly like a document, so
+    its queries are embedded in one batch. Other models may add a query instruction or use
+    separate encode settings for queries, so they embed each query with embed_query.
+    """
+    if type(embeddings).embed_query is HuggingFaceEmbeddings.embed_query:
+        return embeddings.embed_documents(texts)
+    return [embeddings.embed_query(text) for text in texts]
+
+
+def write_results(path, results):
+    with open(path, "w", encoding="utf-8") as f:
+        for result in results:
+            f.write(json.dumps(result, ensure_ascii=False) + "\n")
+
+
+class BatchQA:
+    """
+    Answers many questions against one document set without a chat session.
+
+    Retrieval mirrors RAGPipeline (vector, keyword or hybrid with reciprocal-rank fusion) but
+    runs for the whole batch at once; questions that retrieve the same chunks share one packed
+    context, and identical prompts share one LLM call.
+    """
+
+    def __init__(self, file_paths=None, llm=None, vectorstore=None, keyword_index=None, retrieval_mode="hybrid",
+                 retrieval_k=8, fetch_k=20, rrf_k=60, context_token_budget=1000, concurrency=4,
+                 requests_per_minute=None):
+        """
+        Args:
+            file_paths (list, optional): Documents to index; not needed when `vectorstore` is given.
+            llm (LLMBackend, optional): Defaults to the shared configured backend.
+            vectorstore (FAISS, optional): Prebuilt index to answer from.
+            keyword_index (KeywordIndex, optional): BM25 index over the same chunks, for hybrid retrieval.
+            retrieval_mode (str): "vector", "keyword" or "hybrid".
+            retrieval_k (int): Chunks retrieved per question.
+            fetch_k (int): Candidates taken from each retriever before fusion in hybrid mode.
+            rrf_k (int): Rank constant of reciprocal-rank fusion.
+            context_token_budget (int): Token budget of each packed context.
+            concurrency (int): Maximum LLM calls in flight.
+            requests_per_minute (float, optional): Rate limit for LLM calls; None for no limit.
+        """
+        if vectorstore is None:
+            manager = VectorStoreManager()
+            vectorstore = manager.load_or_create_vectorstore(file_paths)
+            keyword_index = manager.keyword_index
+        self.vectorstore = vectorstore
+        self.keyword_index = keyword_index
+        self.llm = llm if llm is not None else resources.get_llm()
+        self.retrieval_mode = retrieval_mode if keyword_index is not None else "vector"
+        self.retrieval_k = retrieval_k
+        self.fetch_k = fetch_k
+        self.rrf_k = rrf_k
+        self.context_builder = ContextBuilder(context_token_budget)
+        self.concurrency = concurrency
+        self.rate_limiter = TokenBucket.per_minute(requests_per_minute) if requests_per_minute else None
+        self.last_stats = {}
+
+    def _embed(self, texts):
+        with tracer.span("batch.embed", queries=len(texts)):
+            vectors = np.asarray(embed_queries(self.vectorstore.embedding_function, texts), dtype=np.float32)
+            if self.vectorstore._normalize_L2:
+                faiss.normalize_L2(vectors)
+            return vectors
+
+    def _vector_search(self, vectors, k):
+        """One FAISS search for all query vectors; returns a list of docstore ids per query."""
+        with tracer.span("batch.search.vector", queries=len(vectors), k=k):
+            _, positions = self.vectorstore.index.search(vectors, k)
+        id_map = self.vectorstore.index_to_docstore_id
+        # FAISS pads rows with -1 when the index holds fewer than k vectors
+        return [[id_map[int(i)] for i in row if i != -1] for row in positions]
+
+    def _keyword_search(self, texts, k):
+        with tracer.span("batch.search.keyword", queries=len(texts), k=k):
+            return [[doc_id for doc_id, _ in self.keyword_index.search(text, k)] for text in texts]
+
+    def retrieve(self, texts):
+        """
+        Retrieves chunks for every question in one pass.
+
+        Returns:
+            list: Docstore ids of the `retrieval_k` most relevant chunks, per question.
+        """
+        k = self.retrieval_k
+        if self.retrieval_mode == "keyword":
+            return self._keyword_search(texts, k)
+        if self.retrieval_mode == "vector":
+            return self._vector_search(self._embed(texts), k)
+
+        fetch_k = max(self.fetch_k, k)
+        vector_ids = self._vector_search(self._embed(texts), fetch_k)
+        keyword_ids = self._keyword_search(texts, fetch_k)
+        return [
+            reciprocal_rank_fusion([vector, keyword], self.rrf_k)[:k]
+            for vector, keyword in zip(vector_ids, keyword_ids)
+        ]
+
+    @staticmethod
+    def _sources(docs):
+        sources = []
+        for doc in docs:
+            source = {"source": doc.metadata.get("source"), "page": doc.metadata.get("page")}
+            if source not in sources:
+                sources.append(source)
+        return sources
+
+    def _answer(self, prompt):
+        """One rate-limited LLM call; returns (answer, error, latency_ms)."""
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire()
+        start = time.perf_counter()
+        answer, error = None, None
+        try:
+            with tracer.span("llm", mode="batch"):
+                answer = self.llm.get_response(prompt)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        return answer, error, (time.perf_counter() - start) * 1000
+
+    def run(self, questions):
+        """
+        Answers a batch of questions.
+
+        Args:
+            questions (list): Dicts with "id" and "question".
+
+        Returns:
+            list: One result dict per question, in input order. Summary counts of the run are
+                stored in `self.last_stats`.
+        """
+        start = time.perf_counter()
+        with tracer.request("batch_qa.run", questions=len(questions)):
+            texts = [q["question"] for q in questions]
+            retrieved = self.retrieve(texts) if questions else []
+
+            # Questions retrieving the same chunks share a context; identical prompts share an answer
+            contexts, prompts, prompt_of = {}, {}, []
+            with tracer.span("batch.prompts"):
+                for text, doc_ids in zip(texts, retrieved):
+                    key = tuple(doc_ids)
+                    if key not in contexts:
+                        docs = [self.vectorstore.docstore.search(doc_id) for doc_id in doc_ids]
+                        contexts[key] = (self.context_builder.build(docs)[0], self._sources(docs))
+                    prompt = build_document_prompt(contexts[key][0], text)
+                    prompts.setdefault(prompt, len(prompts))
+                    prompt_of.append(prompt)
+
+            with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="batch-qa") as pool:
+                # Each call runs in a copy of this context, so its span nests under the request
+                futures = {
+                    prompt: pool.submit(contextvars.copy_context().run, self._answer, prompt) for prompt in prompts
+                }
+                answers = {prompt: future.result() for prompt, future in futures.items()}
+
+        results = []
+        for question, doc_ids, prompt in zip(questions, retrieved, prompt_of):
+            answer, error, latency_ms = answers[prompt]
+            results.append({
+                "id": question["id"],
+                "question": question["question"],
+                "answer": answer,
+                "sources": contexts[tuple(doc_ids)][1],
+                "error": error,
+                "latency_ms": round(latency_ms, 1),
+            })
+        self.last_stats = {
+            "questions": len(questions),
+            "unique_contexts": len(contexts),
+            "llm_calls": len(prompts),
+            "errors": sum(result["error"] is not None for result in results),
+            "seconds": round(time.perf_counter() - start, 3),
+        }
+        print(f"[INFO] Batch QA: {self.last_stats}")
+        return results
+
+    def run_file(self, questions_path, out_path):
+        """Answers the questions in a JSONL file and writes the results to `out_path`."""
+        results = self.run(read_questions(questions_path))
+        write_results(out_path, results)
+        print(f"[INFO] Wrote {len(results)} answers to {out_path}")
+        return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", nargs="+", required=True, help="Documents to answer from")
+    parser.add_argument("--questions", required=True, help="JSONL file of {\"id\", \"question\"} records")
+    parser.add_argument("--out", required=True, help="JSONL file to write the answers to")
+    parser.add_argument("--retrieval-mode", choices=("vector", "keyword", "hybrid"), default="hybrid")
+    parser.add_argument("--k", type=int, default=8, help="Chunks retrieved per question")
+    parser.add_argument("--concurrency", type=int, default=4, help="Maximum LLM calls in flight")
+    parser.add_argument("--rpm", type=float, help="Maximum LLM requests per minute")
+    parser.add_argument("--llm", choices=sorted(BACKENDS), help="LLM backend (default: LLM_BACKEND or gemini)")
+    args = parser.parse_args()
+
+    batch = BatchQA(
+        args.files, llm=resources.get_llm(args.llm), retrieval_mode=args.retrieval_mode, retrieval_k=args.k,
+        concurrency=args.concurrency, requests_per_minute=args.rpm,
+    )
+    batch.run_file(args.questions, args.out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Recall-vs-latency report for the approximate index types, measured against exact Flat search.
+
+Usage (from the repository root):
+    python -m benchmarks.ann_report --vectors 200000 --dim 384
+    python -m benchmarks.ann_report --index faiss_cache/indexes/<fingerprint>/kb_index.faiss
+"""
+import argparse
+import json
+import tempfile
+import time
+
+import faiss
+import numpy as np
+
+from vectorstore_manager import VectorStoreManager
+
+
+def synthetic_vectors(n, dim, clusters=256, seed=0):
+    """Gaussian clusters, which resemble sentence embeddings better than uniform noise."""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim)).astype(np.float32)
+    labels = rng.integers(0, clusters, size=n)
+    return centers[labels] + 0.3 * rng.normal(size=(n, dim)).astype(np.float32)
+
+
+def load_vectors(path):
+    index = faiss.read_index(path)
+    if isinstance(index, faiss.IndexIVF):
+        index.make_direct_map()
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def evaluate(index, queries, ground_truth, k):
+    start = time.perf_counter()
+    _, found = index.search(queries, k)
+    latency_ms = (time.perf_counter() - start) * 1000 / len(queries)
+    hits = sum(len(set(row) & set(truth)) for row, truth in zip(found, ground_truth))
+    return hits / (len(queries) * k), latency_ms
+
+
+def run_report(vectors, queries, k):
+    n, dim = vectors.shape
+    flat = faiss.IndexFlatL2(dim)
+    flat.add(vectors)
+    _, ground_truth = flat.search(queries, k)
+    recall, latency = evaluate(flat, queries, ground_truth, k)
+    rows = [{"spec": "Flat", "param": None, "build_seconds": 0.0, "recall": recall, "latency_ms": latency}]
+
+    manager = VectorStoreManager(cache_dir=tempfile.mkdtemp())
+    for index_type, param, values in (
+        ("hnsw", "efSearch", (16, 32, 64, 128, 256)),
+        ("ivf_flat", "nprobe", (1, 4, 16, 64)),
+        ("ivf_pq", "nprobe", (1, 4, 16, 64)),
+    ):
+        manager.index_type = index_type
+        spec = manager._desired_index_spec(n, dim)
+        start = time.perf_counter()
+        index = faiss.index_factory(dim, spec, faiss.METRIC_L2)
+        if not index.is_trained:
+            sample = vectors[np.random.default_rng(0).choice(n, min(n, manager.train_size), replace=False)]
+            index.train(sample)
+        index.add(vectors)
+        build_seconds = time.perf_counter() - start
+        for value in values:
+            if param == "efSearch":
+                index.hnsw.efSearch = value
+            else:
+                faiss.extract_index_ivf(index).nprobe = value
+            recall, latency = evaluate(index, queries, ground_truth, k)
+            rows.append({
+                "spec": spec, "param": f"{param}={value}", "build_seconds": build_seconds,
+                "recall": recall, "latency_ms": latency,
+            })
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--index", help="Take vectors from an existing kb_index.faiss instead of synthetic ones")
+    parser.add_argument("--vectors", type=int, default=100_000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--out", help="Also write the rows as JSON to this file")
+    args = parser.parse_args()
+
+    vectors = load_vectors(args.index) if args.index else synthetic_vectors(args.vectors, args.dim)
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    rng = np.random.default_rng(1)
+    queries = vectors[rng.choice(len(vectors), min(args.queries, len(vectors)), replace=False)]
+    queries = queries + 0.05 * rng.normal(size=queries.shape).astype(np.float32)
+
+    rows = run_report(vectors, queries, args.k)
+    print(f"{len(vectors)} vectors, dim {vectors.shape[1]}, recall@{args.k} vs exact Flat search")
+    print(f"{'spec':<20}{'param':<16}{'build s':>10}{'recall':>10}{'ms/query':>12}")
+    for row in rows:
+        print(
+            f"{row['spec']:<20}{row['param'] or '-':<16}{row['build_seconds']:>10.2f}"
+            f"{row['recall']:>10.3f}{row['latency_ms']:>12.3f}"
+        )
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(rows, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
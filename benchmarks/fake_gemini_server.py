@@ -0,0 +1,178 @@
+"""
+Local fake of the Gemini REST API for exercising ChatGemini's timeouts, retries, hedging and
+context caching.
+
+Answers generateContent and streamGenerateContent requests with a fixed reply after a simulated
+latency. A fraction of requests can fail with 429/503 or be slow, and tests can queue exact
+(status, delay) responses with `FakeGeminiServer.script`. cachedContents can be created, and
+requests using one report its tokens as cachedContentTokenCount.
+
+Usage (from the repository root):
+    python -m benchmarks.fake_gemini_server --port 8089 --latency 0.3 --error-rate 0.1 --slow-rate 0.05
+    GEMINI_API_KEY=fake GEMINI_API_ENDPOINT=http://127.0.0.1:8089 streamlit run app.py
+"""
+import argparse
+import datetime
+import json
+import random
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from token_utils import estimate_tokens
+
+ERROR_STATUS = {429: "RESOURCE_EXHAUSTED", 500: "INTERNAL", 503: "UNAVAILABLE", 400: "INVALID_ARGUMENT"}
+
+
+class FakeGeminiServer:
+    def __init__(self, port=0, latency=0.0, error_rate=0.0, error_status=503, slow_rate=0.0, slow_latency=10.0,
+                 answer="Fake Gemini answer.", seed=None):
+        """
+        Args:
+            port (int): Port to listen on; 0 picks a free one (see `endpoint`).
+            latency (float): Seconds before each normal response.
+            error_rate (float): Fraction of requests answered with `error_status`.
+            error_status (int): HTTP status of simulated failures.
+            slow_rate (float): Fraction of requests delayed by `slow_latency` instead.
+            slow_latency (float): Seconds before a slow response.
+            answer (str): Text of every successful response.
+            seed (int, optional): Seed for the random failures.
+        """
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self.answer = answer
+        self.script = deque()
+        self.requests = 0
+        # cachedContents/<n> -> estimated tokens of its system instruction and contents
+        self.caches = {}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+
+    @property
+    def endpoint(self):
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, name="fake-gemini", daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _next_response(self):
+        """(status, delay) for the next request: scripted first, then randomised."""
+        with self._lock:
+            self.requests += 1
+            if self.script:
+                return self.script.popleft()
+            roll = self._random.random()
+        if roll < self.error_rate:
+            return self.error_status, self.latency
+        if roll < self.error_rate + self.slow_rate:
+            return 200, self.slow_latency
+        return 200, self.latency
+
+    @staticmethod
+    def _tokens(request):
+        """Estimated tokens of a request's system instruction and contents."""
+        contents = list(request.get("contents", []))
+        if request.get("systemInstruction"):
+            contents.append(request["systemInstruction"])
+        texts = (part.get("text", "") for content in contents for part in content.get("parts", []))
+        return sum(estimate_tokens(text) for text in texts)
+
+    def _create_cache(self, request):
+        with self._lock:
+            name = f"cachedContents/{len(self.caches) + 1}"
+            self.caches[name] = self._tokens(request)
+        now = datetime.datetime.now(datetime.timezone.utc)
+        ttl = float(request.get("ttl", "3600s").rstrip("s"))
+        return {
+            "name": name,
+            "model": request.get("model"),
+            "createTime": now.isoformat().replace("+00:00", "Z"),
+            "updateTime": now.isoformat().replace("+00:00", "Z"),
+            "expireTime": (now + datetime.timedelta(seconds=ttl)).isoformat().replace("+00:00", "Z"),
+            "usageMetadata": {"totalTokenCount": self.caches[name]},
+        }
+
+    def _body(self, status, stream, request):
+        if status != 200:
+            error = {"code": status, "message": "Simulated failure", "status": ERROR_STATUS.get(status, "UNKNOWN")}
+            return {"error": error}
+        words = len(self.answer.split())
+        cached = self.caches.get(request.get("cachedContent"), 0)
+        prompt_tokens = self._tokens(request) + cached
+        response = {
+            "candidates": [{
+                "content": {"role": "model", "parts": [{"text": self.answer}]},
+                "finishReason": "STOP",
+                "index": 0,
+            }],
+            "usageMetadata": {
+                "promptTokenCount": prompt_tokens, "cachedContentTokenCount": cached,
+                "candidatesTokenCount": words, "totalTokenCount": prompt_tokens + words,
+            },
+        }
+        # Streaming responses are a JSON array of partial responses
+        return [response] if stream else response
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                if self.path.split("?")[0].endswith("/cachedContents"):
+                    status, body = 200, server._create_cache(request)
+                else:
+                    status, delay = server._next_response()
+                    time.sleep(delay)
+                    body = server._body(status, ":streamGenerateContent" in self.path, request)
+                payload = json.dumps(body).encode("utf-8")
+                try:
+                    self.send_response(status)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(payload)))
+                    self.end_headers()
+                    self.wfile.write(payload)
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client timed out or a hedged duplicate won
+                    pass
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", type=float, default=0.3)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--slow-rate", type=float, default=0.0)
+    parser.add_argument("--slow-latency", type=float, default=10.0)
+    args = parser.parse_args()
+
+    server = FakeGeminiServer(
+        args.port, args.latency, args.error_rate, args.error_status, args.slow_rate, args.slow_latency
+    ).start()
+    print(f"[INFO] Fake Gemini API listening on {server.endpoint}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+Fire N concurrent questions at RAGPipeline.aask with a stubbed LLM.
+
+Usage (from the repository root):
+    python -m benchmarks.load_test --files data/AskDocsAI.txt --questions 50 --llm-latency 1.0
+"""
+import argparse
+import asyncio
+import statistics
+import tempfile
+import time
+
+from rag_pipeline import RAGPipeline
+from benchmarks.stub_llm import StubLLM
+
+SAMPLE_QUESTIONS = [
+    "Give me a summary of the project.",
+    "What file types are supported?",
+    "Which technologies are used?",
+    "How is chat history stored?",
+    "What does the vector store do?",
+]
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(int(round(pct / 100 * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+
+async def run_load_test(pipeline, questions):
+    async def timed(question):
+        start = time.perf_counter()
+        await pipeline.aask(question)
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    latencies = await asyncio.gather(*(timed(q) for q in questions))
+    wall = time.perf_counter() - start
+    return {
+        "questions": len(questions),
+        "wall_seconds": round(wall, 3),
+        "throughput_qps": round(len(questions) / wall, 2),
+        "latency_p50": round(statistics.median(latencies), 3),
+        "latency_p95": round(percentile(latencies, 95), 3),
+        "latency_max": round(max(latencies), 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", nargs="+", default=["data/AskDocsAI.txt"])
+    parser.add_argument("--questions", type=int, default=50, help="Number of concurrent questions")
+    parser.add_argument("--llm-latency", type=float, default=1.0, help="Simulated LLM latency in seconds")
+    args = parser.parse_args()
+
+    llm = StubLLM(latency=args.llm_latency)
+    # Keep the load test's (empty) history out of chat_history/
+    pipeline = RAGPipeline("load_test", args.files, llm=llm, history_dir=tempfile.mkdtemp())
+
+    questions = [SAMPLE_QUESTIONS[i % len(SAMPLE_QUESTIONS)] for i in range(args.questions)]
+    results = asyncio.run(run_load_test(pipeline, questions))
+    print(f"[INFO] Load test results: {results}")
+    print(f"[INFO] Serial lower bound would be {args.questions * args.llm_latency:.1f}s of LLM time alone")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+"""
+Benchmark suite for ingestion, retrieval and end-to-end answering, with machine-readable results.
+
+Indexes the sample files in data/ plus a synthetic corpus into a throwaway cache directory, then measures
+load/split throughput, cold and embedding-cache-warm index builds, warm (memory-mapped) loads, search
+latency and RAGPipeline.ask latency with the deterministic StubLLM in place of Gemini.
+
+Usage (from the repository root):
+    python -m benchmarks.run_benchmarks --synthetic-docs 200 --out bench.json
+    python -m benchmarks.run_benchmarks --out new.json --compare bench.json
+"""
+import argparse
+import glob
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import tempfile
+import time
+
+from rag_pipeline import RAGPipeline
+from vectorstore_manager import VectorStoreManager
+from benchmarks.load_test import SAMPLE_QUESTIONS, percentile
+from benchmarks.stub_llm import StubLLM
+
+WORDS = (
+    "index vector query latency document chunk embedding retrieval answer context budget cache "
+    "table column customer order invoice revenue region product schema report analyst model score"
+).split()
+
+
+def make_synthetic_corpus(directory, docs, words_per_doc, seed=0):
+    """Write `docs` text files of seeded random sentences, each naming a few unique identifiers."""
+    rng = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for i in range(docs):
+        sentences = []
+        for _ in range(max(words_per_doc // 10, 1)):
+            sentence = " ".join(rng.choice(WORDS) for _ in range(9))
+            sentences.append(f"{sentence.capitalize()} in table_{rng.randrange(docs * 4)}.")
+        path = os.path.join(directory, f"synthetic_{i:05d}.txt")
+        with open(path, "w") as f:
+            f.write(" ".join(sentences))
+        paths.append(path)
+    return paths
+
+
+def latency_stats(seconds):
+    ms = [s * 1000 for s in seconds]
+    return {
+        "count": len(ms),
+        "p50_ms": round(statistics.median(ms), 3),
+        "p95_ms": round(percentile(ms, 95), 3),
+        "max_ms": round(max(ms), 3),
+    }
+
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def index_size_bytes(manager):
+    paths = [manager.index_file, manager.docstore_file, manager.keyword_file, manager.manifest_file]
+    return sum(os.path.getsize(path) for path in paths if os.path.exists(path))
+
+
+def bench_load_split(files, cache_dir):
+    manager = VectorStoreManager(cache_dir=cache_dir)
+    start = time.perf_counter()
+    chunks = 0
+    for _, file_chunks in manager._load_and_split_files(files):
+        chunks += len(list(file_chunks or []))
+    seconds = time.perf_counter() - start
+    corpus_bytes = sum(os.path.getsize(file) for file in files)
+    return {
+        "files": len(files),
+        "chunks": chunks,
+        "corpus_mb": round(corpus_bytes / 1e6, 3),
+        "seconds": round(seconds, 3),
+        "files_per_sec": round(len(files) / seconds, 2),
+        "mb_per_sec": round(corpus_bytes / 1e6 / seconds, 3),
+    }
+
+
+def bench_build(files, cache_dir, rebuild=False):
+    manager = VectorStoreManager(cache_dir=cache_dir)
+    vectorstore, seconds = timed(manager.load_or_create_vectorstore, files, rebuild=rebuild)
+    embed_seconds = manager._embed_stats["seconds"]
+    return manager, vectorstore, {
+        "seconds": round(seconds, 3),
+        "vectors": vectorstore.index.ntotal,
+        "index_spec": manager._index_spec,
+        "index_bytes": index_size_bytes(manager),
+        "embed_seconds": round(embed_seconds, 3),
+        "embed_chunks_per_sec": round(manager._embed_stats["chunks"] / embed_seconds, 1) if embed_seconds else None,
+        "embedding_cache_hits": manager.embedding_cache.hits,
+        "embedding_cache_misses": manager.embedding_cache.misses,
+    }
+
+
+def bench_warm_load(files, cache_dir, repeats):
+    seconds = []
+    for _ in range(repeats):
+        manager = VectorStoreManager(cache_dir=cache_dir)
+        _, elapsed = timed(manager.load_or_create_vectorstore, files)
+        seconds.append(elapsed)
+    return latency_stats(seconds)
+
+
+def bench_search(pipeline, vectorstore, keyword_index, questions, k):
+    embed, vector, keyword, hybrid = [], [], [], []
+    for question in questions:
+        query_vector, elapsed = timed(pipeline._embed_query, question, vectorstore)
+        embed.append(elapsed)
+        vector.append(timed(vectorstore.similarity_search_by_vector, query_vector, k=k)[1])
+        keyword.append(timed(keyword_index.search, question, k)[1])
+        hybrid.append(timed(pipeline._search, question, query_vector, vectorstore, keyword_index, k)[1])
+    return {
+        "k": k,
+        "embed_query": latency_stats(embed),
+        "vector_search": latency_stats(vector),
+        "keyword_search": latency_stats(keyword),
+        "hybrid_search": latency_stats(hybrid),
+    }
+
+
+def bench_ask(pipeline, questions):
+    seconds = [timed(pipeline.ask, question)[1] for question in questions]
+    return latency_stats(seconds)
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def compare(current, previous, path=""):
+    """Yield (metric path, previous, current, relative change) for numeric metrics present in both runs."""
+    for key, value in current.items():
+        if key not in previous:
+            continue
+        name = f"{path}.{key}" if path else key
+        if isinstance(value, dict) and isinstance(previous[key], dict):
+            yield from compare(value, previous[key], name)
+        elif isinstance(value, (int, float)) and isinstance(previous[key], (int, float)) and previous[key]:
+            yield name, previous[key], value, (value - previous[key]) / previous[key]
+
+
+def run_benchmarks(files, questions, k=8, llm_latency=0.0, warm_repeats=3):
+    """Run every benchmark against `files` in a temporary cache directory and return the results."""
+    cache_dir = tempfile.mkdtemp(prefix="bench_cache_")
+    history_dir = tempfile.mkdtemp(prefix="bench_history_")
+    try:
+        results = {"load_split": bench_load_split(files, cache_dir)}
+        print(f"[INFO] Load/split: {results['load_split']}")
+
+        _, _, results["cold_build"] = bench_build(files, cache_dir)
+        print(f"[INFO] Cold build: {results['cold_build']}")
+        # Same files again from scratch: only the embedding cache is warm
+        manager, vectorstore, results["cached_embeddings_build"] = bench_build(files, cache_dir, rebuild=True)
+        print(f"[INFO] Build with warm embedding cache: {results['cached_embeddings_build']}")
+
+        results["warm_load"] = bench_warm_load(files, cache_dir, warm_repeats)
+        print(f"[INFO] Warm load: {results['warm_load']}")
+
+        pipeline = RAGPipeline(
+            "benchmark", files, llm=StubLLM(latency=llm_latency, first_token_latency=0), use_answer_cache=False,
+            vectorstore=vectorstore, index_version=manager.index_version, keyword_index=manager.keyword_index,
+            history_dir=history_dir,
+        )
+        results["search"] = bench_search(pipeline, vectorstore, manager.keyword_index, questions, k)
+        print(f"[INFO] Search: {results['search']}")
+        results["ask"] = bench_ask(pipeline, questions)
+        results["ask"]["llm_latency_ms"] = llm_latency * 1000
+        print(f"[INFO] Ask: {results['ask']}")
+        return results
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+        shutil.rmtree(history_dir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", nargs="*", help="Documents to index (default: everything in data/)")
+    parser.add_argument("--synthetic-docs", type=int, default=100, help="Synthetic text files added to the corpus")
+    parser.add_argument("--synthetic-words", type=int, default=2000, help="Words per synthetic file")
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--k", type=int, default=8)
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="Simulated LLM latency in seconds")
+    parser.add_argument("--warm-repeats", type=int, default=3)
+    parser.add_argument("--out", help="Write the results as JSON to this file")
+    parser.add_argument("--compare", help="Print relative changes against an earlier results file")
+    args = parser.parse_args()
+
+    files = args.files if args.files is not None else sorted(
+        path for path in glob.glob(os.path.join("data", "*")) if os.path.isfile(path)
+    )
+    corpus_dir = tempfile.mkdtemp(prefix="bench_corpus_")
+    try:
+        files = files + make_synthetic_corpus(corpus_dir, args.synthetic_docs, args.synthetic_words)
+        rng = random.Random(1)
+        questions = [
+            SAMPLE_QUESTIONS[i] if i < len(SAMPLE_QUESTIONS)
+            else f"What does table_{rng.randrange(max(args.synthetic_docs, 1) * 4)} say about {rng.choice(WORDS)}?"
+            for i in range(args.queries)
+        ]
+        results = run_benchmarks(files, questions, args.k, args.llm_latency, args.warm_repeats)
+    finally:
+        shutil.rmtree(corpus_dir, ignore_errors=True)
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "args": vars(args),
+        },
+        "results": results,
+    }
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"[INFO] Results written to {args.out}")
+    if args.compare:
+        with open(args.compare, "r") as f:
+            previous = json.load(f)
+        for name, before, after, change in compare(results, previous["results"]):
+            print(f"{name:<45}{before:>14.3f}{after:>14.3f}{change:>+10.1%}")
+
+
+if __name__ == "__main__":
+    main()
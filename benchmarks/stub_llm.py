@@ -0,0 +1,47 @@
+import asyncio
+import hashlib
+import time
+
+from llm_backends import LLMBackend
+
+
+class StubLLM(LLMBackend):
+    """
+    Deterministic stand-in for ChatGemini used by benchmarks and load tests.
+
+    Answers are derived from a hash of the prompt and returned after a fixed simulated latency,
+    so runs are repeatable and never touch the network. Selected with LLM_BACKEND=stub.
+    """
+
+    name = "stub"
+
+    def __init__(self, latency=0.5, first_token_latency=None, chunks=5):
+        self.latency = latency
+        self.first_token_latency = latency / 2 if first_token_latency is None else first_token_latency
+        self.chunks = chunks
+        self.calls = 0
+
+    def _answer(self, prompt):
+        digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:12]
+        return f"Stub answer {digest} for a prompt of {len(prompt)} characters."
+
+    def get_response(self, prompt):
+        self.calls += 1
+        time.sleep(self.latency)
+        return self._answer(prompt)
+
+    async def aget_response(self, prompt):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        return self._answer(prompt)
+
+    def stream_response(self, prompt):
+        self.calls += 1
+        answer = self._answer(prompt)
+        step = max(len(answer) // self.chunks, 1)
+        time.sleep(self.first_token_latency)
+        remaining = max(self.latency - self.first_token_latency, 0) / self.chunks
+        for i in range(0, len(answer), step):
+            if i:
+                time.sleep(remaining)
+            yield answer[i:i + step]
@@ -1,25 +1,433 @@
+import asyncio
+import contextvars
+import datetime
+import hashlib
+import itertools
 import os
+import random
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import requests
 from dotenv import load_dotenv
 import google.generativeai as genai
+from google.api_core import exceptions as api_exceptions
+
+import resources
+from llm_backends import LLMBackend
+from llm_errors import LLMError, LLMRateLimitError, LLMTimeoutError, LLMUnavailableError
+from prompts import Prompt
+from token_utils import estimate_tokens
+from tracing import tracer
 
 load_dotenv()
 
-class ChatGemini:
-    def __init__(self):
+
+def _env_float(name, default):
+    value = os.getenv(name)
+    return float(value) if value else default
+
+
+def _classify(error):
+    """Map an SDK or transport exception to the matching LLMError."""
+    if isinstance(error, LLMError):
+        return error
+    if isinstance(error, (api_exceptions.TooManyRequests, api_exceptions.ResourceExhausted)):
+        return LLMRateLimitError(str(error))
+    if isinstance(error, (api_exceptions.DeadlineExceeded, requests.Timeout, TimeoutError, asyncio.TimeoutError)):
+        return LLMTimeoutError(str(error))
+    if isinstance(error, (api_exceptions.ServerError, api_exceptions.ServiceUnavailable,
+                          requests.ConnectionError, ConnectionError)):
+        return LLMUnavailableError(str(error))
+    # Bad requests, auth failures and blocked responses will not succeed on retry
+    return LLMError(f"{type(error).__name__}: {error}")
+
+
+class ChatGemini(LLMBackend):
+    """
+    Gemini client with per-call deadlines, jittered exponential retries, a rate limit shared by
+    the whole process and optional hedged requests. Failures raise LLMError subclasses.
+
+    A `Prompt` is sent as a system instruction plus its prefix and suffix parts, so Gemini's
+    implicit prefix cache can match across calls. Once a long enough system + prefix is reused,
+    either repeated or extended by a later prompt (as chat history grows turn by turn), an
+    explicit context cache (CachedContent) is created for it in the background. Later calls
+    whose prefix starts with a cached one send only the rest of their prefix and the suffix.
+    Cached and billed input tokens are counted in the `llm_input_tokens_total` metric.
+
+    Every setting defaults to an environment variable:
+        GEMINI_MODEL         model name (default gemini-2.5-flash)
+        GEMINI_TIMEOUT       seconds allowed for one attempt (default 30)
+        GEMINI_DEADLINE      seconds allowed for a call including retries (default 60)
+        GEMINI_MAX_RETRIES   retries after the first attempt (default 3)
+        GEMINI_RPM           client-side requests per minute (default: unlimited)
+        GEMINI_HEDGE_AFTER   seconds before a second, hedged request is sent (default: off)
+        GEMINI_HEDGE_WORKERS threads running hedged calls' requests, two per call in flight (default 128)
+        GEMINI_API_ENDPOINT  alternative API host, e.g. http://127.0.0.1:8089 for a fake server
+        GEMINI_TRANSPORT     "grpc" or "rest" (default: rest with a custom endpoint, else the SDK default)
+        GEMINI_CACHE_MIN_TOKENS  smallest system + prefix worth an explicit context cache (default
+                             1024, the API's minimum for flash models; 0 disables explicit caching)
+        GEMINI_CACHE_TTL     seconds an explicit context cache lives (default 600)
+    """
+
+    name = "gemini"
+
+    def __init__(self, model_name=None, timeout=None, deadline=None, max_retries=None, requests_per_minute=None,
+                 hedge_after=None, api_endpoint=None, transport=None, backoff_base=0.5, backoff_max=8.0,
+                 cache_min_tokens=None, cache_ttl=None, max_caches=64, hedge_workers=None):
+        """
+        Args:
+            model_name (str, optional): Gemini model to call.
+            timeout (float, optional): Seconds allowed for one attempt.
+            deadline (float, optional): Seconds allowed for a whole call, retries and backoff included.
+            max_retries (int, optional): Retries of retryable failures (429, 5xx, timeouts).
+            requests_per_minute (float, optional): Client-side rate limit shared by all ChatGemini
+                instances in the process.
+            hedge_after (float, optional): Send a second identical request if the first has not
+                answered after this many seconds, and use whichever finishes first.
+            api_endpoint (str, optional): API host to call instead of Google's.
+            transport (str, optional): SDK transport, "grpc" or "rest".
+            backoff_base (float): Upper bound of the first retry delay; doubles per retry.
+            backoff_max (float): Upper bound of any retry delay.
+            cache_min_tokens (int, optional): Estimated tokens a prompt's system instruction and
+                prefix need before they are put in an explicit context cache; 0 disables it.
+            cache_ttl (float, optional): Lifetime of each explicit context cache in seconds.
+            max_caches (int): Prefixes tracked for explicit caching.
+            hedge_workers (int, optional): Threads for the requests of hedged calls; each call in
+                flight needs up to two, or its requests wait for a free thread.
+        """
         api_key = os.getenv("GEMINI_API_KEY")
         if not api_key:
             raise ValueError("GEMINI_API_KEY not found in .env file.")
-        genai.configure(api_key=api_key)
-        
+        api_endpoint = api_endpoint or os.getenv("GEMINI_API_ENDPOINT")
+        self.transport = transport or os.getenv("GEMINI_TRANSPORT") or ("rest" if api_endpoint else None)
+        config = {"api_key": api_key, "transport": self.transport}
+        if api_endpoint:
+            config["client_options"] = {"api_endpoint": api_endpoint}
+        genai.configure(**config)
+
         # Fix is here: Updated to the current, supported model name.
-        self.model = genai.GenerativeModel("gemini-2.5-flash") 
+        self.model_name = model_name or os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
+        self.model = genai.GenerativeModel(self.model_name)
+        # System instruction -> model configured with it
+        self._models = {}
+        self.timeout = timeout if timeout is not None else _env_float("GEMINI_TIMEOUT", 30.0)
+        self.deadline = deadline if deadline is not None else _env_float("GEMINI_DEADLINE", 60.0)
+        self.max_retries = max_retries if max_retries is not None else int(_env_float("GEMINI_MAX_RETRIES", 3))
+        self.hedge_after = hedge_after if hedge_after is not None else _env_float("GEMINI_HEDGE_AFTER", None)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        requests_per_minute = requests_per_minute or _env_float("GEMINI_RPM", None)
+        self.rate_limiter = resources.get_rate_limiter("gemini", requests_per_minute) if requests_per_minute else None
+        self.hedge_workers = hedge_workers or int(_env_float("GEMINI_HEDGE_WORKERS", 128))
+        self._hedge_pool = (
+            ThreadPoolExecutor(max_workers=self.hedge_workers, thread_name_prefix="gemini-hedge")
+            if self.hedge_after else None
+        )
+        self.cache_min_tokens = (
+            cache_min_tokens if cache_min_tokens is not None else int(_env_float("GEMINI_CACHE_MIN_TOKENS", 1024))
+        )
+        self.cache_ttl = cache_ttl if cache_ttl is not None else _env_float("GEMINI_CACHE_TTL", 600.0)
+        self.max_caches = max_caches
+        # sha256 of system + prefix -> {"key", "system", "prefix", "model", "expires", "pending"},
+        # least recently used first
+        self._caches = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._cache_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="gemini-cache")
 
-    def get_response(self, prompt):
+    @staticmethod
+    def _record_usage(span, response):
+        """Attach the token counts Gemini reports to the span and count cached vs billed input tokens."""
+        usage = getattr(response, "usage_metadata", None)
+        if usage is not None:
+            # prompt_token_count includes the tokens served from a (implicit or explicit) context cache
+            cached = usage.cached_content_token_count or 0
+            span.set(prompt_tokens=usage.prompt_token_count, cached_tokens=cached,
+                     output_tokens=usage.candidates_token_count)
+            tracer.incr("llm_input_tokens_total", cached, kind="cached")
+            tracer.incr("llm_input_tokens_total", usage.prompt_token_count - cached, kind="billed")
+            tracer.incr("llm_output_tokens_total", usage.candidates_token_count)
+
+    # --- Prompt layout and context caching ---
+
+    def _system_model(self, system):
+        model = self._models.get(system)
+        if model is None:
+            model = self._models[system] = genai.GenerativeModel(self.model_name, system_instruction=system)
+        return model
+
+    def _request(self, prompt):
+        """The (model, contents) to send for `prompt`."""
+        if not isinstance(prompt, Prompt):
+            return self.model, prompt
+        cached = self._cached_model(prompt)
+        if cached is not None:
+            model, rest = cached
+            return model, [part for part in (rest, prompt.suffix) if part]
+        return self._system_model(prompt.system), [part for part in (prompt.prefix, prompt.suffix) if part]
+
+    def _cached_model(self, prompt):
+        """
+        (model, rest of the prefix) for the longest ready context cache the prompt's system +
+        prefix starts with, or None.
+
+        The prompt's prefix is remembered; a remembered prefix is cached once a later prompt
+        repeats or extends it, so one-off prompts cost nothing extra and chat turns can use the
+        cache of the history up to the previous turn.
+        """
+        if not self.cache_min_tokens or not prompt.prefix:
+            return None
+        if estimate_tokens(prompt.system) + estimate_tokens(prompt.prefix) < self.cache_min_tokens:
+            return None
+        key = hashlib.sha256(f"{prompt.system}\0{prompt.prefix}".encode("utf-8")).hexdigest()
+        now = time.monotonic()
+        with self._cache_lock:
+            # Remembered prefixes this prompt repeats or extends, longest first
+            reused = sorted(
+                (entry for entry in self._caches.values()
+                 if entry["system"] == prompt.system and prompt.prefix.startswith(entry["prefix"])),
+                key=lambda entry: len(entry["prefix"]), reverse=True,
+            )
+            ready = next((entry for entry in reused if entry["model"] is not None and now < entry["expires"]), None)
+            for entry in reused:
+                if entry is ready:
+                    break
+                # Cache a longer prefix only if it saves another cache's worth of tokens
+                uncached = entry["prefix"][len(ready["prefix"]):] if ready else entry["prefix"]
+                if entry["pending"] or estimate_tokens(uncached) < (self.cache_min_tokens if ready else 0):
+                    continue
+                entry["pending"] = True
+                self._cache_pool.submit(self._create_cache, entry, entry["system"], entry["prefix"])
+                break
+            if key not in self._caches:
+                self._caches[key] = {
+                    "key": key, "system": prompt.system, "prefix": prompt.prefix,
+                    "model": None, "expires": 0.0, "pending": False,
+                }
+                if len(self._caches) > self.max_caches:
+                    # Evicted caches are not deleted; they expire on the server after their TTL
+                    self._caches.popitem(last=False)
+            self._caches.move_to_end(key)
+            if ready is not None:
+                if ready["key"] in self._caches:
+                    self._caches.move_to_end(ready["key"])
+                tracer.incr("llm_context_cache_total", result="hit")
+                return ready["model"], prompt.prefix[len(ready["prefix"]):]
+        tracer.incr("llm_context_cache_total", result="miss")
+        return None
+
+    def _create_cache(self, entry, system, prefix):
+        """Create the context cache off the request path; failed prefixes are not tried again."""
+        try:
+            with tracer.span("gemini.cache_create"):
+                cache = genai.caching.CachedContent.create(
+                    model=self.model_name, system_instruction=system, contents=[prefix],
+                    ttl=datetime.timedelta(seconds=self.cache_ttl),
+                )
+                model = genai.GenerativeModel.from_cached_content(cache)
+        except Exception as e:
+            tracer.incr("llm_context_cache_total", result="error")
+            print(f"[WARNING] Could not create a Gemini context cache: {e}")
+            return
+        with self._cache_lock:
+            entry["model"] = model
+            # Stop using the cache shortly before the server expires it
+            entry["expires"] = time.monotonic() + self.cache_ttl - min(30.0, self.cache_ttl / 10)
+            entry["pending"] = False
+        tracer.incr("llm_context_cache_total", result="created")
+
+    # --- Deadlines, rate limiting and retries ---
+
+    def _attempt_timeout(self, deadline):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise LLMTimeoutError(f"Gemini call exceeded its {self.deadline}s deadline")
+        return min(self.timeout, remaining)
+
+    def _request_options(self, deadline):
+        # Retries are ours; the SDK's own retry would ignore the deadline
+        return {"timeout": self._attempt_timeout(deadline), "retry": None}
+
+    def _acquire(self, deadline):
+        if self.rate_limiter is not None and not self.rate_limiter.acquire(timeout=self._attempt_timeout(deadline)):
+            raise LLMRateLimitError("No client-side Gemini request slot before the deadline")
+
+    async def _acquire_async(self, deadline):
+        if self.rate_limiter is not None:
+            if not await self.rate_limiter.acquire_async(timeout=self._attempt_timeout(deadline)):
+                raise LLMRateLimitError("No client-side Gemini request slot before the deadline")
+
+    def _retry_delay(self, error, attempt, deadline):
+        """Seconds to wait before retrying after `error`, or None if the call should fail now."""
+        if not error.retryable or attempt >= self.max_retries:
+            return None
+        # Full jitter: spread retries from many sessions instead of retrying in lockstep
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        if time.monotonic() + delay >= deadline:
+            return None
+        tracer.incr("llm_retries_total", error=type(error).__name__)
+        print(f"[WARNING] Gemini call failed ({type(error).__name__}: {error}); retrying in {delay:.2f}s")
+        return delay
+
+    # --- Single attempts ---
+
+    def _attempt(self, request, deadline):
+        model, contents = request
         try:
-            # The generate_content method is correct for the Python SDK
-            response = self.model.generate_content(prompt) 
-            return response.text
+            response = model.generate_content(contents, request_options=self._request_options(deadline))
+            return response, response.text
         except Exception as e:
-            # It's better to catch the specific API error for better debugging, 
-            # but this general catch is fine for now.
-            return f"Gemini API Error: {e}"
\ No newline at end of file
+            raise _classify(e) from e
+
+    async def _attempt_async(self, request, deadline):
+        if self.transport == "rest":
+            # The SDK's async client only works over gRPC
+            return await asyncio.to_thread(self._attempt, request, deadline)
+        model, contents = request
+        try:
+            response = await model.generate_content_async(contents, request_options=self._request_options(deadline))
+            return response, response.text
+        except Exception as e:
+            raise _classify(e) from e
+
+    def _hedged_attempt(self, request, deadline):
+        """One attempt, plus a duplicate request if the first is still running after `hedge_after`."""
+        if self._hedge_pool is None:
+            return self._attempt(request, deadline)
+        started = threading.Event()
+
+        def first_attempt():
+            started.set()
+            return self._attempt(request, deadline)
+
+        # Attempts run in a copy of this context, so their spans nest under the current one
+        first = self._hedge_pool.submit(contextvars.copy_context().run, first_attempt)
+        # `hedge_after` counts from when the request is sent, not from when it waited for a free thread
+        started.wait()
+        done, _ = wait([first], timeout=self.hedge_after)
+        if done or (self.rate_limiter is not None and not self.rate_limiter.try_acquire()):
+            return first.result()
+        tracer.incr("llm_hedged_requests_total")
+        second = self._hedge_pool.submit(contextvars.copy_context().run, self._attempt, request, deadline)
+        pending, error = {first, second}, None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is second:
+                        tracer.incr("llm_hedge_wins_total")
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    async def _hedged_attempt_async(self, request, deadline):
+        if self.hedge_after is None:
+            return await self._attempt_async(request, deadline)
+        first = asyncio.ensure_future(self._attempt_async(request, deadline))
+        done, _ = await asyncio.wait({first}, timeout=self.hedge_after)
+        if done or (self.rate_limiter is not None and not self.rate_limiter.try_acquire()):
+            return await first
+        tracer.incr("llm_hedged_requests_total")
+        second = asyncio.ensure_future(self._attempt_async(request, deadline))
+        pending, error = {first, second}, None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is second:
+                            tracer.incr("llm_hedge_wins_total")
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    # --- Public API ---
+
+    def get_response(self, prompt):
+        """
+        Returns Gemini's answer to `prompt`.
+
+        Raises:
+            LLMError: The call failed, after retries for retryable failures.
+        """
+        with tracer.span("gemini.generate") as span:
+            deadline = time.monotonic() + self.deadline
+            request = self._request(prompt)
+            for attempt in itertools.count():
+                try:
+                    self._acquire(deadline)
+                    response, text = self._hedged_attempt(request, deadline)
+                    break
+                except LLMError as e:
+                    delay = self._retry_delay(e, attempt, deadline)
+                    if delay is None:
+                        tracer.incr("llm_requests_total", status="error")
+                        raise
+                    time.sleep(delay)
+            span.set(attempts=attempt + 1)
+            self._record_usage(span, response)
+            tracer.incr("llm_requests_total", status="ok")
+            return text
+
+    async def aget_response(self, prompt):
+        """Async variant of `get_response` using the SDK's async client."""
+        with tracer.span("gemini.generate", mode="async") as span:
+            deadline = time.monotonic() + self.deadline
+            request = self._request(prompt)
+            for attempt in itertools.count():
+                try:
+                    await self._acquire_async(deadline)
+                    response, text = await self._hedged_attempt_async(request, deadline)
+                    break
+                except LLMError as e:
+                    delay = self._retry_delay(e, attempt, deadline)
+                    if delay is None:
+                        tracer.incr("llm_requests_total", status="error")
+                        raise
+                    await asyncio.sleep(delay)
+            span.set(attempts=attempt + 1)
+            self._record_usage(span, response)
+            tracer.incr("llm_requests_total", status="ok")
+            return text
+
+    def stream_response(self, prompt):
+        """
+        Yields the response text in chunks as Gemini generates it.
+
+        Failures before the first chunk are retried like `get_response`; once text has been
+        yielded, a failure raises instead, since the caller has already shown part of the answer.
+        """
+        with tracer.span("gemini.generate", mode="stream") as span:
+            deadline = time.monotonic() + self.deadline
+            model, contents = self._request(prompt)
+            for attempt in itertools.count():
+                started = False
+                try:
+                    self._acquire(deadline)
+                    response = model.generate_content(
+                        contents, stream=True, request_options=self._request_options(deadline)
+                    )
+                    for chunk in response:
+                        # Chunks carrying only safety/usage metadata have no candidates or text parts;
+                        # `parts` raises on a chunk without candidates
+                        if chunk.candidates and chunk.parts:
+                            started = True
+                            yield chunk.text
+                    break
+                except Exception as e:
+                    error = _classify(e)
+                    delay = None if started else self._retry_delay(error, attempt, deadline)
+                    if delay is None:
+                        tracer.incr("llm_requests_total", status="error")
+                        if error is e:
+                            raise
+                        raise error from e
+                    time.sleep(delay)
+            span.set(attempts=attempt + 1)
+            self._record_usage(span, response)
+            tracer.incr("llm_requests_total", status="ok")
@@ -0,0 +1,123 @@
+from token_utils import estimate_tokens, truncate_to_tokens
+
+
+def _overlap(left, right, min_overlap=20):
+    """Length of the longest suffix of `left` that is a prefix of `right` (0 if below `min_overlap`)."""
+    for size in range(min(len(left), len(right)), min_overlap - 1, -1):
+        if left.endswith(right[:size]):
+            return size
+    return 0
+
+
+def _merge_positioned(chunks):
+    """Merge (start_index, text) chunks of one document into passages of overlapping or adjacent text."""
+    passages = []
+    for start, text in sorted(chunks):
+        end = start + len(text)
+        if passages and start <= passages[-1][1]:
+            last = passages[-1]
+            if end > last[1]:
+                last[2] += text[last[1] - start:]
+                last[1] = end
+        else:
+            passages.append([start, end, text])
+    return [text for _, _, text in passages]
+
+
+def _merge_unpositioned(texts):
+    """Merge chunks without offsets by containment and suffix/prefix overlap of their text."""
+    passages = []
+    for text in texts:
+        for i, passage in enumerate(passages):
+            if text in passage:
+                break
+            if passage in text:
+                passages[i] = text
+                break
+            size = _overlap(passage, text)
+            if size:
+                passages[i] = passage + text[size:]
+                break
+            size = _overlap(text, passage)
+            if size:
+                passages[i] = text + passage[size:]
+                break
+        else:
+            passages.append(text)
+    return passages
+
+
+class ContextBuilder:
+    """
+    Packs retrieved chunks into the prompt context within a token budget.
+
+    Chunks are taken greedily in relevance order. Chunks from the same source and page are
+    merged into passages in document order, so the splitter's overlap and duplicate chunks
+    are included (and counted against the budget) once.
+    """
+
+    def __init__(self, token_budget=1500, separator="\n\n"):
+        """
+        Args:
+            token_budget (int): Maximum estimated tokens of the packed context.
+            separator (str): Placed between passages.
+        """
+        self.token_budget = token_budget
+        self.separator = separator
+
+    def _passages(self, group):
+        if all(start is not None for start, _ in group):
+            return _merge_positioned(group)
+        return _merge_unpositioned([text for _, text in group])
+
+    def _render(self, groups):
+        # Groups keep the order of their most relevant chunk
+        return self.separator.join(passage for group in groups.values() for passage in self._passages(group))
+
+    def build(self, docs):
+        """
+        Pack `docs` into a context string.
+
+        Args:
+            docs (list): Retrieved Documents, most relevant first.
+
+        Returns:
+            tuple: (context, stats), where stats counts the chunks used, duplicated and dropped for
+                the budget, and compares the context's tokens with naively joining the same chunks.
+        """
+        groups = {}
+        used, duplicates, dropped = [], 0, 0
+        context_tokens = 0
+        for doc in docs:
+            key = (doc.metadata.get("source"), doc.metadata.get("page"))
+            group = groups.get(key, [])
+            candidate = dict(groups)
+            candidate[key] = group + [(doc.metadata.get("start_index"), doc.page_content)]
+            tokens = estimate_tokens(self._render(candidate))
+            if tokens <= context_tokens:
+                duplicates += 1
+                used.append(doc)
+                continue
+            if tokens > self.token_budget:
+                dropped += 1
+                continue
+            groups, context_tokens = candidate, tokens
+            used.append(doc)
+
+        context = self._render(groups)
+        if not context and docs:
+            # Not even the most relevant chunk fits; include as much of it as the budget allows
+            context = truncate_to_tokens(docs[0].page_content, self.token_budget)
+            used, dropped = [docs[0]], len(docs) - 1
+
+        naive_tokens = estimate_tokens(self.separator.join(doc.page_content for doc in used))
+        stats = {
+            "chunks": len(docs),
+            "chunks_used": len(used) - duplicates,
+            "duplicates": duplicates,
+            "dropped_over_budget": dropped,
+            "naive_tokens": naive_tokens,
+            "context_tokens": estimate_tokens(context),
+        }
+        stats["tokens_saved"] = naive_tokens - stats["context_tokens"]
+        return context, stats
@@ -0,0 +1,114 @@
+import hashlib
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+from array import array
+
+
+class EmbeddingCache:
+    """
+    Persistent on-disk cache of chunk embeddings, keyed by a hash of (model name, chunk text).
+
+    Entries are stored in a small SQLite database and evicted least-recently-used
+    first once the cache grows beyond `max_entries`.
+    """
+
+    def __init__(self, cache_dir="faiss_cache", max_entries=200_000):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.db_path = os.path.join(cache_dir, "embedding_cache.sqlite")
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        with self._connect() as conn:
+            # WAL lets readers proceed while another process writes
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_last_used ON embeddings (last_used)")
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _key(model_name, text):
+        return hashlib.sha256(f"{model_name}\0{text}".encode("utf-8")).hexdigest()
+
+    def embed_documents(self, embeddings, model_name, texts):
+        """
+        Return embeddings for `texts`, computing only the ones not already cached.
+
+        Args:
+            embeddings: A LangChain embeddings object used for cache misses.
+            model_name (str): The embedding model name, part of the cache key.
+            texts (list): The chunk texts to embed.
+
+        Returns:
+            list: One vector (list of floats) per text, in input order.
+        """
+        keys = [self._key(model_name, text) for text in texts]
+        vectors = {}
+        now = time.time()
+
+        # Look up and touch the cached vectors in one short transaction; the embedding model
+        # runs outside any transaction, so other processes are never locked out while it works
+        with self._connect() as conn:
+            unique_keys = list(dict.fromkeys(keys))
+            # SQLite limits the number of bound parameters per statement
+            for i in range(0, len(unique_keys), 500):
+                batch = unique_keys[i:i + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                for key, blob in rows:
+                    vectors[key] = array("f", blob).tolist()
+            conn.executemany(
+                "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                [(now, key) for key in vectors],
+            )
+
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in vectors and key not in missing:
+                missing[key] = text
+        miss_count = sum(1 for key in keys if key in missing)
+        self.misses += miss_count
+        self.hits += len(keys) - miss_count
+
+        if missing:
+            computed = embeddings.embed_documents(list(missing.values()))
+            for key, vector in zip(missing, computed):
+                vectors[key] = list(vector)
+            with self._connect() as conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+                    [(key, array("f", vectors[key]).tobytes(), now) for key in missing],
+                )
+                self._evict(conn)
+
+        return [vectors[key] for key in keys]
+
+    def _evict(self, conn):
+        """Delete the least recently used entries beyond `max_entries`."""
+        (count,) = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        excess = count - self.max_entries
+        if excess > 0:
+            conn.execute(
+                "DELETE FROM embeddings WHERE key IN "
+                "(SELECT key FROM embeddings ORDER BY last_used ASC LIMIT ?)",
+                (excess,),
+            )
+            print(f"[INFO] Evicted {excess} entries from the embedding cache")
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
@@ -0,0 +1,53 @@
+import os
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+class LockUnavailable(Exception):
+    """Raised by a non-blocking `file_lock` when another process holds the lock."""
+
+
+def _acquire(fd, blocking, path):
+    if fcntl is not None:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            raise LockUnavailable(path)
+        return
+    while True:
+        try:
+            # LK_LOCK gives up after ~10 seconds, so keep retrying when blocking
+            msvcrt.locking(fd, msvcrt.LK_LOCK if blocking else msvcrt.LK_NBLCK, 1)
+            return
+        except OSError:
+            if not blocking:
+                raise LockUnavailable(path)
+
+
+@contextmanager
+def file_lock(path, blocking=True):
+    """
+    Hold an exclusive inter-process lock on `path` for the duration of the block.
+
+    Args:
+        path (str): The lock file; created if missing and never deleted.
+        blocking (bool): Wait for the lock, or raise LockUnavailable immediately if it is held.
+    """
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        _acquire(fd, blocking, path)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            else:
+                os.lseek(fd, 0, os.SEEK_SET)
+                msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+    finally:
+        os.close(fd)
@@ -1,19 +1,174 @@
 import json, os
+from tracing import tracer
+
 
 class HistoryManager:
-    def __init__(self, session_id):
-        self.file_path = f"chat_history/{session_id}.json"
-        os.makedirs("chat_history", exist_ok=True)
+    """
+    Append-only chat history stored as one JSON message per line in chat_history/<id>.jsonl.
+
+    fsync controls durability: "always" flushes each write to disk, "never" leaves it
+    to the operating system. Legacy chat_history/<id>.json files are migrated on first use.
+    """
+
+    def __init__(self, session_id, history_dir="chat_history", fsync="always"):
+        if fsync not in ("always", "never"):
+            raise ValueError(f"Unknown fsync policy: {fsync}")
+        self.fsync = fsync
+        self.file_path = os.path.join(history_dir, f"{session_id}.jsonl")
+        self.legacy_path = os.path.join(history_dir, f"{session_id}.json")
+        self.summary_path = os.path.join(history_dir, f"{session_id}.summary.json")
+        # (file size, message count) of the last count, so recounting only scans new bytes
+        self._count_state = (0, 0)
+        os.makedirs(history_dir, exist_ok=True)
         if not os.path.exists(self.file_path):
-            with open(self.file_path, 'w') as f:
-                json.dump([], f)
+            self._migrate_legacy()
+        else:
+            self._repair_tail()
+
+    def _repair_tail(self):
+        """Truncate a partial last line left by a crash so new appends start on a fresh line."""
+        with open(self.file_path, 'rb+') as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            if size == 0:
+                return
+            f.seek(size - 1)
+            if f.read(1) == b"\n":
+                return
+            position = size
+            while position > 0:
+                read_size = min(8192, position)
+                position -= read_size
+                f.seek(position)
+                newline = f.read(read_size).rfind(b"\n")
+                if newline != -1:
+                    position += newline + 1
+                    break
+            f.truncate(position)
+            print(f"[WARNING] Dropped a partially written message from {self.file_path}")
+
+    def _migrate_legacy(self):
+        """Convert an old whole-file JSON history into the append-only format."""
+        messages = []
+        if os.path.exists(self.legacy_path):
+            try:
+                with open(self.legacy_path, 'r') as f:
+                    messages = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"[WARNING] Could not migrate {self.legacy_path}: {e}")
+        # Write to a temp file and rename so a crash never leaves a half-migrated log
+        tmp_path = self.file_path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            for message in messages:
+                f.write(json.dumps(message) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.file_path)
+        if messages:
+            print(f"[INFO] Migrated {len(messages)} messages from {self.legacy_path}")
+
+    @staticmethod
+    def _parse_lines(lines):
+        messages = []
+        for line in lines:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                messages.append(json.loads(line))
+            except ValueError:
+                # A torn final line from a crash mid-write; skip it
+                continue
+        return messages
+
+    def load_history(self, last_n=None):
+        """
+        Load the session history.
+
+        Args:
+            last_n (int, optional): Only return the last `last_n` messages. These are read
+                from the end of the file without parsing the rest of it.
+
+        Returns:
+            list: Messages as {"role": ..., "content": ...} dicts, oldest first.
+        """
+        if last_n is None:
+            with open(self.file_path, 'r') as f:
+                return self._parse_lines(f)
+        if last_n <= 0:
+            return []
+        return self._parse_lines(self._tail_lines(last_n))[-last_n:]
+
+    def _tail_lines(self, n, block_size=8192):
+        """Read backwards in blocks until at least n complete lines are available."""
+        with open(self.file_path, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            position = f.tell()
+            data = b""
+            # n lines need n + 1 newlines unless we reach the start of the file
+            while position > 0 and data.count(b"\n") <= n:
+                read_size = min(block_size, position)
+                position -= read_size
+                f.seek(position)
+                data = f.read(read_size) + data
+        lines = data.decode("utf-8", errors="replace").splitlines()
+        if position > 0:
+            # The first line is probably partial
+            lines = lines[1:]
+        return lines[-(n + 1):]
+
+    def message_count(self):
+        """Number of messages in the log, counting only the bytes appended since the last call."""
+        size = os.path.getsize(self.file_path)
+        counted_size, count = self._count_state
+        if size < counted_size:
+            counted_size, count = 0, 0
+        with open(self.file_path, 'rb') as f:
+            f.seek(counted_size)
+            while True:
+                block = f.read(65536)
+                if not block:
+                    break
+                count += block.count(b"\n")
+        self._count_state = (size, count)
+        return count
+
+    def load_summary(self):
+        """
+        Load the rolling summary of older turns.
+
+        Returns:
+            dict: {"summary": str, "covered": int}, where `covered` is the number of
+                messages from the start of the log already folded into the summary.
+        """
+        if not os.path.exists(self.summary_path):
+            return {"summary": "", "covered": 0}
+        try:
+            with open(self.summary_path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {"summary": "", "covered": 0}
+
+    def save_summary(self, summary, covered):
+        tmp_path = self.summary_path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({"summary": summary, "covered": covered}, f)
+        os.replace(tmp_path, self.summary_path)
+
+    def save_turns(self, turns):
+        """
+        Append several messages with a single write.
 
-    def load_history(self):
-        with open(self.file_path, 'r') as f:
-            return json.load(f)
+        Args:
+            turns (list): (role, content) tuples, in order.
+        """
+        payload = "".join(json.dumps({"role": role, "content": content}) + "\n" for role, content in turns)
+        with tracer.span("history.save", messages=len(turns), fsync=self.fsync):
+            with open(self.file_path, 'a') as f:
+                f.write(payload)
+                if self.fsync == "always":
+                    f.flush()
+                    os.fsync(f.fileno())
 
     def save_turn(self, role, content):
-        history = self.load_history()
-        history.append({"role": role, "content": content})
-        with open(self.file_path, 'w') as f:
-            json.dump(history, f, indent=2)
+        self.save_turns([(role, content)])
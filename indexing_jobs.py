@@ -0,0 +1,226 @@
+"""
+Background indexing jobs, so building a vector store never blocks the Streamlit script thread.
+
+A job loads or updates the index of one document set on a worker thread. Callers poll its
+status and progress, may cancel it, and take the finished vector store into their pipeline.
+"""
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from vectorstore_manager import VectorStoreManager
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED = (DONE, FAILED, CANCELLED)
+
+
+class JobCancelled(Exception):
+    """Raised inside a running job when cancellation was requested."""
+
+
+class IndexingJob:
+    def __init__(self, files, rebuild=False):
+        self.id = uuid.uuid4().hex[:12]
+        self.files = list(files)
+        self.rebuild = rebuild
+        self.status = QUEUED
+        self.progress = 0.0
+        self.message = "Waiting for an indexing worker"
+        self.error = None
+        # Set once the job is done; the vector store and keyword index are released once every owner took them
+        self.vectorstore = None
+        self.keyword_index = None
+        self.index_version = None
+        self.replaced_index_version = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        # Callers that submitted this job and still want its result
+        self.owners = set()
+        self._cancel_requested = threading.Event()
+
+    @property
+    def finished(self):
+        return self.status in FINISHED
+
+    def cancel(self):
+        """Ask the job to stop; it does so at its next progress update. Nothing is saved."""
+        self._cancel_requested.set()
+
+    def _report_progress(self, fraction, message):
+        # Runs on the worker thread as the progress callback of VectorStoreManager
+        if self._cancel_requested.is_set():
+            raise JobCancelled(self.id)
+        self.progress = fraction
+        self.message = message
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "files": self.files,
+            "status": self.status,
+            "progress": self.progress,
+            "message": self.message,
+            "error": self.error,
+            "index_version": self.index_version,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class IndexingJobQueue:
+    """
+    Runs indexing jobs on a small thread pool.
+
+    Jobs for the same document set share its file lock anyway, so submitting a set that is
+    already queued or running returns the existing job instead of indexing it twice. Each
+    submitter is recorded as an owner, and an owner's cancel only stops the job once no other
+    owner is left.
+
+    Finished jobs keep their vector store only until each owner has taken it with `take_result`,
+    and only the latest `keep_finished` of them are remembered at all.
+    """
+
+    def __init__(self, max_workers=1, keep_finished=8, manager_factory=VectorStoreManager):
+        """
+        Args:
+            max_workers (int): Document sets indexed at the same time.
+            keep_finished (int): Finished jobs remembered for polling before they are forgotten.
+            manager_factory (callable): Builds the VectorStoreManager used by each job.
+        """
+        self.keep_finished = keep_finished
+        self.manager_factory = manager_factory
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="indexing")
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, files, rebuild=False, owner=None):
+        """
+        Queue indexing of `files` and return its IndexingJob.
+
+        Args:
+            files (list): Paths of the documents in the set.
+            rebuild (bool): Discard the cached index and rebuild it from scratch.
+            owner (str, optional): Identifies the submitter (e.g. a browser session) for `cancel`.
+        """
+        fingerprint = VectorStoreManager._document_set_fingerprint(files)
+        with self._lock:
+            for job in self._jobs.values():
+                if (
+                    not job.finished and not job._cancel_requested.is_set() and not rebuild
+                    and VectorStoreManager._document_set_fingerprint(job.files) == fingerprint
+                ):
+                    if owner is not None:
+                        job.owners.add(owner)
+                    return job
+            job = IndexingJob(files, rebuild)
+            if owner is not None:
+                job.owners.add(owner)
+            self._jobs[job.id] = job
+            self._forget_finished()
+        self._executor.submit(self._run, job)
+        return job
+
+    def get(self, job_id):
+        """Return the job with `job_id`, or None if it is unknown or was forgotten."""
+        return self._jobs.get(job_id)
+
+    def take_result(self, job_id, owner=None):
+        """
+        Hand a finished job's index to one of its owners.
+
+        Once every owner has taken it (or immediately, without `owner`), the job drops its
+        references so the index is only kept alive by the pipelines using it.
+
+        Returns:
+            tuple: (vectorstore, keyword_index), or None if the job is not done or its result
+                was already released.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.status != DONE or job.vectorstore is None:
+                return None
+            result = job.vectorstore, job.keyword_index
+            if owner is not None:
+                job.owners.discard(owner)
+            if owner is None or not job.owners:
+                job.vectorstore = job.keyword_index = None
+            return result
+
+    def cancel(self, job_id, owner=None):
+        """
+        Request cancellation of a job.
+
+        With `owner`, only that owner gives up the job, and it keeps running while other owners
+        still wait for it.
+
+        Returns:
+            bool: Whether the job is being cancelled; False if it is unknown, already finished
+                or still owned by someone else.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.finished:
+                return False
+            if owner is not None:
+                job.owners.discard(owner)
+                if job.owners:
+                    return False
+            job.cancel()
+            return True
+
+    def jobs(self):
+        """Snapshot of all remembered jobs, oldest first."""
+        with self._lock:
+            return list(self._jobs.values())
+
+    def _forget_finished(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished]
+        for job_id in finished[:max(len(finished) - self.keep_finished, 0)]:
+            del self._jobs[job_id]
+
+    def _run(self, job):
+        if job._cancel_requested.is_set():
+            job.message, job.finished_at = "Cancelled", time.time()
+            job.status = CANCELLED
+            return
+        job.status, job.started_at = RUNNING, time.time()
+        job.message = "Indexing documents"
+        try:
+            manager = self.manager_factory()
+            vectorstore = manager.load_or_create_vectorstore(
+                job.files, rebuild=job.rebuild, progress_callback=job._report_progress
+            )
+        except JobCancelled:
+            print(f"[INFO] Indexing job {job.id} cancelled")
+            job.message, job.finished_at = "Cancelled", time.time()
+            job.status = CANCELLED
+        except Exception as e:
+            print(f"[ERROR] Indexing job {job.id} failed. Error: {e}")
+            job.error, job.message, job.finished_at = str(e), "Failed", time.time()
+            job.status = FAILED
+        else:
+            if vectorstore is None:
+                print(f"[ERROR] Indexing job {job.id} failed: none of the documents could be loaded")
+                job.error, job.message, job.finished_at = "None of the documents could be loaded", "Failed", time.time()
+                job.status = FAILED
+                return
+            job.vectorstore = vectorstore
+            job.keyword_index = manager.keyword_index
+            job.index_version = manager.index_version
+            job.replaced_index_version = manager.replaced_index_version
+            job.progress, job.message, job.finished_at = 1.0, "Done", time.time()
+            # Publish the status last, so pollers that see DONE also see the result
+            job.status = DONE
+            print(f"[INFO] Indexing job {job.id} finished in {job.finished_at - job.started_at:.2f}s")
+        finally:
+            # Old results are dropped as jobs finish, not only when the next job is submitted
+            with self._lock:
+                self._forget_finished()
@@ -0,0 +1,194 @@
+import heapq
+import json
+import math
+import re
+import threading
+from collections import Counter
+
+from sqlite_store import SQLiteStore
+
+# Runs on lowercased text; snake_case identifiers stay whole (and are also split, see tokenize)
+TOKEN_PATTERN = re.compile(r"[a-z0-9_]+")
+
+
+def tokenize(text):
+    """
+    Lowercase word tokens of `text`.
+
+    Identifiers such as `order_items` yield the whole identifier plus its parts, so both
+    the exact name and the words in it match.
+    """
+    tokens = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        tokens.append(token)
+        if "_" in token:
+            tokens.extend(part for part in token.split("_") if part)
+    return tokens
+
+
+class KeywordIndex(SQLiteStore):
+    """
+    Okapi BM25 inverted index over chunk texts, keyed by docstore id.
+
+    It is kept next to the FAISS index and updated with the same ids, so keyword hits map
+    straight back to documents in the vector store's docstore.
+
+    A new index is built in memory. A saved one is searched in SQLite, where each term's
+    postings are one row, so loading it reads nothing and a query reads only its own terms;
+    the first `add` or `remove` reads the whole index back into memory to update it.
+    """
+
+    schema = (
+        "CREATE TABLE docs (id TEXT PRIMARY KEY, length INTEGER NOT NULL)",
+        # term -> {doc_id: [frequency, document length]}
+        "CREATE TABLE terms (term TEXT PRIMARY KEY, postings TEXT NOT NULL)",
+        "CREATE TABLE meta (key TEXT PRIMARY KEY, value REAL NOT NULL)",
+    )
+
+    def __init__(self, k1=1.5, b=0.75, path=None):
+        """
+        Args:
+            k1 (float): Term frequency saturation.
+            b (float): Document length normalisation.
+            path (str, optional): An index written by `save`; `k1` and `b` are then read from it.
+        """
+        self._lock = threading.RLock()
+        self.k1 = k1
+        self.b = b
+        self._conn = None
+        # doc_id -> {term: frequency}, or None while the index is only on disk
+        self._docs = {}
+        # term -> {doc_id: frequency}
+        self._postings = {}
+        self._lengths = {}
+        self._count = 0
+        self._total_length = 0
+        if path is not None:
+            self._open_saved(path)
+
+    def _open_saved(self, path):
+        self._open(path)
+        stored = dict(self._query("SELECT key, value FROM meta"))
+        self.k1, self.b = stored["k1"], stored["b"]
+        self._count, self._total_length = int(stored["count"]), int(stored["total_length"])
+        self._docs = self._postings = self._lengths = None
+
+    def _in_memory(self):
+        """Read a saved index into memory, so it can be updated."""
+        if self._docs is None:
+            self._docs = {doc_id: {} for doc_id, in self._query("SELECT id FROM docs")}
+            self._postings, self._lengths = {}, {}
+            for term, postings in self._query("SELECT term, postings FROM terms"):
+                postings = json.loads(postings)
+                self._postings[term] = {doc_id: frequency for doc_id, (frequency, _) in postings.items()}
+                for doc_id, (frequency, length) in postings.items():
+                    self._docs[doc_id][term] = frequency
+                    self._lengths[doc_id] = length
+            self._conn.close()
+            self._conn = None
+
+    def __len__(self):
+        return self._count
+
+    def ids(self):
+        with self._lock:
+            if self._docs is None:
+                return {doc_id for doc_id, in self._query("SELECT id FROM docs")}
+            return set(self._docs)
+
+    def add(self, doc_id, text):
+        """Index `text` under `doc_id`, replacing any previous text for that id."""
+        with self._lock:
+            self._in_memory()
+            if doc_id in self._docs:
+                self.remove([doc_id])
+            self._add_counts(doc_id, Counter(tokenize(text)))
+
+    def _add_counts(self, doc_id, counts):
+        self._docs[doc_id] = counts
+        for term, frequency in counts.items():
+            self._postings.setdefault(term, {})[doc_id] = frequency
+        length = sum(counts.values())
+        self._lengths[doc_id] = length
+        self._count += 1
+        self._total_length += length
+
+    def remove(self, doc_ids):
+        with self._lock:
+            self._in_memory()
+            for doc_id in doc_ids:
+                counts = self._docs.pop(doc_id, None)
+                if counts is None:
+                    continue
+                for term in counts:
+                    postings = self._postings[term]
+                    del postings[doc_id]
+                    if not postings:
+                        del self._postings[term]
+                self._count -= 1
+                self._total_length -= self._lengths.pop(doc_id)
+
+    def _term_postings(self, term):
+        """(doc_id, frequency, document length) for each document containing `term`."""
+        if self._docs is None:
+            rows = self._query("SELECT postings FROM terms WHERE term = ?", (term,))
+            return [(doc_id, frequency, length) for doc_id, (frequency, length) in json.loads(rows[0][0]).items()] \
+                if rows else []
+        return [(doc_id, frequency, self._lengths[doc_id]) for doc_id, frequency in self._postings.get(term, {}).items()]
+
+    def search(self, query, k=10):
+        """
+        Return up to `k` (doc_id, score) pairs for `query`, best first.
+
+        Documents sharing no term with the query are never returned.
+        """
+        with self._lock:
+            n = self._count
+            if not n:
+                return []
+            average_length = self._total_length / n or 1.0
+            scores = {}
+            for term in set(tokenize(query)):
+                postings = self._term_postings(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+                for doc_id, frequency, length in postings:
+                    norm = self.k1 * (1 - self.b + self.b * length / average_length)
+                    scores[doc_id] = scores.get(doc_id, 0.0) + idf * frequency * (self.k1 + 1) / (frequency + norm)
+        return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+
+    def save(self, path):
+        """Write the index to `path` atomically; it is then searched on disk and its memory freed."""
+        with self._lock:
+            self._in_memory()
+            self._conn = self._connect_scratch()
+            for statement in self.schema:
+                self._conn.execute(statement)
+            self._conn.executemany("INSERT INTO docs (id, length) VALUES (?, ?)", self._lengths.items())
+            self._conn.executemany(
+                "INSERT INTO terms (term, postings) VALUES (?, ?)",
+                (
+                    (term, json.dumps({doc_id: [frequency, self._lengths[doc_id]] for doc_id, frequency in postings.items()}))
+                    for term, postings in self._postings.items()
+                ),
+            )
+            self._conn.executemany(
+                "INSERT INTO meta (key, value) VALUES (?, ?)",
+                [("k1", self.k1), ("b", self.b), ("count", self._count), ("total_length", self._total_length)],
+            )
+            super().save(path)
+            self._conn.close()
+            self._open_saved(path)
+
+    @classmethod
+    def load(cls, path):
+        return cls(path=path)
+
+    @classmethod
+    def from_docstore(cls, vectorstore):
+        """Build the index from every document in a LangChain FAISS vector store."""
+        index = cls()
+        for doc_id in vectorstore.index_to_docstore_id.values():
+            index.add(doc_id, vectorstore.docstore.search(doc_id).page_content)
+        return index
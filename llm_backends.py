@@ -0,0 +1,283 @@
+"""
+Pluggable LLM backends.
+
+Every backend implements `LLMBackend` and raises LLMError subclasses on failure. The backend is
+chosen per deployment with the LLM_BACKEND environment variable (default: gemini):
+    gemini        Google Gemini API (see ChatGemini for its GEMINI_* settings)
+    llama_cpp     local GGUF model on the CPU via llama-cpp-python; LLM_MODEL_PATH is required
+    transformers  local Hugging Face causal LM via transformers; LLM_MODEL names it
+    stub          deterministic offline answers, for tests and benchmarks
+
+Local backends also read LLM_MAX_TOKENS and LLM_THREADS; llama_cpp also reads LLM_CONTEXT and LLM_PROMPT_CACHE_MB.
+"""
+import asyncio
+import os
+import threading
+
+from dotenv import load_dotenv
+
+from llm_errors import LLMError
+from prompts import Prompt
+from tracing import tracer
+
+load_dotenv()
+
+DEFAULT_BACKEND = "gemini"
+DEFAULT_TRANSFORMERS_MODEL = "Qwen/Qwen2.5-0.5B-Instruct"
+
+
+def chat_messages(prompt):
+    """Chat messages for `prompt`; a Prompt's system instruction becomes the system message."""
+    if isinstance(prompt, Prompt):
+        user = "\n\n".join(part for part in (prompt.prefix, prompt.suffix) if part)
+        return [{"role": "system", "content": prompt.system}, {"role": "user", "content": user}]
+    return [{"role": "user", "content": prompt}]
+
+
+class LLMBackend:
+    """
+    Interface of the model that answers questions and summarises history.
+
+    Only `get_response` has to be implemented; by default the async variant runs it in a worker
+    thread and the streaming variant yields the whole answer as one chunk. Prompts may be `Prompt`
+    strings, whose system/prefix/suffix parts a backend can use for prefix caching.
+    """
+
+    name = "base"
+
+    def get_response(self, prompt):
+        """
+        Returns the model's answer to `prompt`.
+
+        Raises:
+            LLMError: The model could not answer.
+        """
+        raise NotImplementedError
+
+    async def aget_response(self, prompt):
+        return await asyncio.to_thread(self.get_response, prompt)
+
+    def stream_response(self, prompt):
+        yield self.get_response(prompt)
+
+
+class LocalBackend(LLMBackend):
+    """Base for in-process models: one generation runs at a time, since the model is not thread-safe."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    def _generate(self, prompt):
+        raise NotImplementedError
+
+    def _stream(self, prompt):
+        raise NotImplementedError
+
+    def get_response(self, prompt):
+        with tracer.span(f"{self.name}.generate") as span:
+            try:
+                with self._lock:
+                    text, usage = self._generate(prompt)
+            except Exception as e:
+                tracer.incr("llm_requests_total", status="error")
+                raise LLMError(f"{type(e).__name__}: {e}") from e
+            span.set(**usage)
+            tracer.incr("llm_requests_total", status="ok")
+            return text
+
+    def stream_response(self, prompt):
+        with tracer.span(f"{self.name}.generate", mode="stream"):
+            try:
+                with self._lock:
+                    yield from self._stream(prompt)
+            except Exception as e:
+                tracer.incr("llm_requests_total", status="error")
+                raise LLMError(f"{type(e).__name__}: {e}") from e
+            tracer.incr("llm_requests_total", status="ok")
+
+
+class LlamaCppBackend(LocalBackend):
+    """
+    GGUF model (e.g. a quantised Llama, Qwen or Phi instruct model) run on the CPU by llama.cpp.
+
+    llama.cpp reuses the evaluated KV state for the prompt's longest common prefix with the
+    previous call; the RAM prompt cache keeps such states for several recent prefixes, so
+    interleaved sessions each skip re-evaluating their system instruction and history.
+    """
+
+    name = "llama_cpp"
+
+    def __init__(self, model_path, n_ctx=4096, n_threads=None, max_tokens=512, temperature=0.2, prompt_cache_mb=512):
+        """
+        Args:
+            model_path (str): Path of the .gguf model file.
+            n_ctx (int): Context window in tokens; prompts must fit together with `max_tokens`.
+            n_threads (int, optional): CPU threads; defaults to all cores.
+            max_tokens (int): Longest answer in tokens.
+            temperature (float): Sampling temperature.
+            prompt_cache_mb (int): Size of the RAM prompt (KV state) cache; 0 disables it.
+        """
+        super().__init__()
+        try:
+            from llama_cpp import Llama, LlamaRAMCache
+        except ImportError as e:
+            raise ImportError("The llama_cpp backend needs llama-cpp-python: pip install llama-cpp-python") from e
+        if not model_path or not os.path.exists(model_path):
+            raise ValueError(f"GGUF model not found: {model_path!r} (set LLM_MODEL_PATH)")
+        self.model = Llama(model_path=model_path, n_ctx=n_ctx, n_threads=n_threads or os.cpu_count(), verbose=False)
+        if prompt_cache_mb:
+            self.model.set_cache(LlamaRAMCache(capacity_bytes=prompt_cache_mb << 20))
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+        print(f"[INFO] Loaded local model {model_path}")
+
+    def _chat(self, prompt, stream):
+        # The chat completion applies the chat template stored in the GGUF file
+        return self.model.create_chat_completion(
+            messages=chat_messages(prompt),
+            max_tokens=self.max_tokens, temperature=self.temperature, stream=stream,
+        )
+
+    def _generate(self, prompt):
+        result = self._chat(prompt, stream=False)
+        usage = result.get("usage") or {}
+        return result["choices"][0]["message"]["content"], {
+            "prompt_tokens": usage.get("prompt_tokens"), "output_tokens": usage.get("completion_tokens"),
+        }
+
+    def _stream(self, prompt):
+        for chunk in self._chat(prompt, stream=True):
+            text = chunk["choices"][0]["delta"].get("content")
+            if text:
+                yield text
+
+
+class TransformersBackend(LocalBackend):
+    """Small Hugging Face causal language model run on the CPU with greedy decoding."""
+
+    name = "transformers"
+
+    def __init__(self, model_name=DEFAULT_TRANSFORMERS_MODEL, max_new_tokens=512, threads=None):
+        """
+        Args:
+            model_name (str): Hugging Face model id or local directory of an instruct model.
+            max_new_tokens (int): Longest answer in tokens.
+            threads (int, optional): Torch CPU threads.
+        """
+        super().__init__()
+        import torch
+        from transformers import AutoModelForCausalLM, AutoTokenizer
+
+        if threads:
+            torch.set_num_threads(threads)
+        self.torch = torch
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        self.model = AutoModelForCausalLM.from_pretrained(model_name)
+        self.model.eval()
+        self.max_new_tokens = max_new_tokens
+        print(f"[INFO] Loaded local model {model_name}")
+
+    def _inputs(self, prompt):
+        if self.tokenizer.chat_template:
+            try:
+                text = self.tokenizer.apply_chat_template(
+                    chat_messages(prompt), tokenize=False, add_generation_prompt=True
+                )
+            except Exception:
+                # Some chat templates (e.g. Gemma's) reject a system message
+                text = self.tokenizer.apply_chat_template(
+                    [{"role": "user", "content": str(prompt)}], tokenize=False, add_generation_prompt=True
+                )
+            prompt = text
+        return self.tokenizer(prompt, return_tensors="pt")
+
+    def _generate(self, prompt):
+        inputs = self._inputs(prompt)
+        with self.torch.inference_mode():
+            output = self.model.generate(**inputs, max_new_tokens=self.max_new_tokens, do_sample=False)
+        prompt_tokens = inputs["input_ids"].shape[1]
+        new_tokens = output[0][prompt_tokens:]
+        return self.tokenizer.decode(new_tokens, skip_special_tokens=True), {
+            "prompt_tokens": prompt_tokens, "output_tokens": len(new_tokens),
+        }
+
+    def _stream(self, prompt):
+        from transformers import TextIteratorStreamer
+
+        inputs = self._inputs(prompt)
+        streamer = TextIteratorStreamer(self.tokenizer, skip_prompt=True, skip_special_tokens=True)
+        errors = []
+
+        def generate():
+            try:
+                with self.torch.inference_mode():
+                    self.model.generate(
+                        **inputs, max_new_tokens=self.max_new_tokens, do_sample=False, streamer=streamer
+                    )
+            except Exception as e:
+                errors.append(e)
+                # generate() only ends the stream when it succeeds; without this the consumer
+                # would wait forever while holding the model lock
+                streamer.end()
+
+        thread = threading.Thread(target=generate, name="transformers-generate", daemon=True)
+        thread.start()
+        for text in streamer:
+            if text:
+                yield text
+        thread.join()
+        if errors:
+            raise errors[0]
+
+
+def _env_int(name, default=None):
+    value = os.getenv(name)
+    return int(value) if value else default
+
+
+def _gemini():
+    from chat_gemini import ChatGemini
+    return ChatGemini()
+
+
+def _llama_cpp():
+    return LlamaCppBackend(
+        os.getenv("LLM_MODEL_PATH"), n_ctx=_env_int("LLM_CONTEXT", 4096), n_threads=_env_int("LLM_THREADS"),
+        max_tokens=_env_int("LLM_MAX_TOKENS", 512), prompt_cache_mb=_env_int("LLM_PROMPT_CACHE_MB", 512),
+    )
+
+
+def _transformers():
+    return TransformersBackend(
+        os.getenv("LLM_MODEL", DEFAULT_TRANSFORMERS_MODEL), max_new_tokens=_env_int("LLM_MAX_TOKENS", 512),
+        threads=_env_int("LLM_THREADS"),
+    )
+
+
+def _stub():
+    from benchmarks.stub_llm import StubLLM
+    return StubLLM(latency=float(os.getenv("LLM_STUB_LATENCY", "0")))
+
+
+# Backend name -> factory building it from the environment
+BACKENDS = {"gemini": _gemini, "llama_cpp": _llama_cpp, "transformers": _transformers, "stub": _stub}
+
+
+def register_backend(name, factory):
+    """Make another backend selectable by name; `factory()` builds it."""
+    BACKENDS[name] = factory
+
+
+def backend_name(name=None):
+    """`name`, or the LLM_BACKEND setting, or the default backend."""
+    return (name or os.getenv("LLM_BACKEND") or DEFAULT_BACKEND).lower()
+
+
+def create_backend(name=None):
+    """Builds the named (or configured) backend."""
+    name = backend_name(name)
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown LLM backend {name!r}; expected one of {', '.join(BACKENDS)}")
+    backend = BACKENDS[name]()
+    print(f"[INFO] Using the {name} LLM backend")
+    return backend
@@ -0,0 +1,22 @@
+class LLMError(Exception):
+    """An LLM call that did not produce an answer. `retryable` errors may succeed on a later attempt."""
+
+    retryable = False
+
+
+class LLMTimeoutError(LLMError):
+    """The call (or its overall deadline) timed out."""
+
+    retryable = True
+
+
+class LLMRateLimitError(LLMError):
+    """The provider rejected the call for rate or quota limits (HTTP 429), or no client-side slot was free."""
+
+    retryable = True
+
+
+class LLMUnavailableError(LLMError):
+    """The provider failed or could not be reached (HTTP 5xx, connection errors)."""
+
+    retryable = True
@@ -0,0 +1,44 @@
+SYSTEM_INSTRUCTION = """You are a professional assistant that answers questions based only on the user's uploaded documents.
+
+Your primary goal:
+- Use the document context to answer the user's question as accurately as possible.
+- If the answer is NOT found in the provided context, or is only partially related, say clearly:
+  "The definition/details are not mentioned directly in the document, but based on related context from the file, here's what can be inferred."
+
+Rules:
+1. Always prioritize facts and examples found in the context.
+2. Never make up new document content — if it's not there, acknowledge it.
+3. You may provide a short general explanation only AFTER clarifying it's not in the document.
+4. Do NOT mention that you're an AI or language model."""
+
+
+class Prompt(str):
+    """
+    Prompt text that keeps its parts, most stable first: the fixed system instruction, a `prefix`
+    that repeats across calls and the per-call `suffix`.
+
+    It is a plain string for backends that take text, and since the parts are joined in that
+    order, calls sharing a prefix share the longest possible leading text for providers' prefix
+    (KV) caches. ChatGemini sends the parts separately and can cache the system and prefix parts.
+    """
+
+    def __new__(cls, system, prefix, suffix):
+        prompt = super().__new__(cls, "\n\n".join(part for part in (system, prefix, suffix) if part))
+        prompt.system = system
+        prompt.prefix = prefix
+        prompt.suffix = suffix
+        return prompt
+
+
+def build_prompt(context, chat_history, query):
+    """
+    The chat answer prompt. The conversation so far is the prefix: it only grows between turns,
+    while the retrieved context and the question change with every turn and go last.
+    """
+    prefix = f"Chat history:\n{chat_history}" if chat_history else ""
+    return Prompt(SYSTEM_INSTRUCTION, prefix, f"📘 Document Context: {context}\n\nQuestion: {query}")
+
+
+def build_document_prompt(context, query):
+    """A prompt without history, for many questions over the same context: the context is the prefix."""
+    return Prompt(SYSTEM_INSTRUCTION, f"📘 Document Context: {context}", f"Question: {query}")
@@ -1,23 +1,358 @@
+import asyncio
+import contextvars
+import time
+from concurrent.futures import wait
 from vectorstore_manager import VectorStoreManager
 from history_manager import HistoryManager
-from chat_gemini import ChatGemini
+from token_utils import estimate_tokens, truncate_to_tokens
+from context_builder import ContextBuilder
+from prompts import build_prompt
+from llm_errors import LLMError
+from tracing import tracer
+import resources
+
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """
+    Merge ranked id lists by reciprocal-rank fusion: each list adds 1 / (k + rank) per id.
+
+    Returns:
+        list: Ids ordered by fused score, best first.
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores, key=scores.get, reverse=True)
 
 
 class RAGPipeline:
-    def __init__(self, session_id, file_paths):
+    def __init__(self, session_id, file_paths, history_turns=4, history_token_budget=1500, summary_batch_turns=4,
+                 llm=None, use_answer_cache=True, progress_callback=None, vectorstore=None, index_version=None,
+                 keyword_index=None, retrieval_mode="hybrid", retrieval_k=8, fetch_k=20, rrf_k=60,
+                 retrieval_budget_ms=250, reranker=None, rerank_candidates=20, context_token_budget=1000,
+                 history_dir="chat_history"):
         """
         Initializes the RAG pipeline components.
 
         Args:
             session_id (str): The ID of the current chat session.
             file_paths (list): A list of paths to the uploaded document files (PDF, DOCX, TXT, etc.).
+            history_turns (int): Number of most recent question/answer turns kept verbatim in the prompt.
+            history_token_budget (int): Maximum estimated tokens for the summary plus verbatim history.
+            summary_batch_turns (int): How many turns beyond the window to accumulate before folding
+                them into the rolling summary, so the summary is not recomputed on every question.
+            llm (LLMBackend, optional): LLM to use instead of the shared configured backend (e.g. a stub in load tests).
+            use_answer_cache (bool): Serve repeated (or near-identical) questions from the shared answer cache.
+            progress_callback (callable, optional): Receives `(fraction, message)` updates while indexing.
+            vectorstore (optional): An already built vector store for `file_paths` (e.g. from a background
+                indexing job); skips loading the index here.
+            index_version (str, optional): The version of `vectorstore`, used to key the answer cache.
+            keyword_index (KeywordIndex, optional): The BM25 index built with `vectorstore`.
+            retrieval_mode (str): "vector", "keyword", or "hybrid" to fuse both rankings.
+            retrieval_k (int): Document chunks retrieved as context candidates.
+            fetch_k (int): Candidates taken from each retriever before fusion.
+            rrf_k (int): Reciprocal-rank fusion constant; larger values flatten the rank weights.
+            retrieval_budget_ms (float): In hybrid mode, retrievers that have not answered within
+                this budget are left out of the fusion.
+            reranker (CrossEncoderReranker, optional): Reranks `rerank_candidates` retrieved chunks down to
+                `retrieval_k` (e.g. `resources.get_reranker()`); None disables reranking.
+            rerank_candidates (int): Chunks retrieved for the reranker to choose from.
+            context_token_budget (int): Maximum estimated tokens of document context. Retrieved chunks are
+                packed in relevance order, merging overlapping neighbours, until it is full.
+            history_dir (str): Directory of the persisted chat history.
+        """
+        self.file_paths = list(file_paths)
+        self.answer_cache = resources.get_answer_cache() if use_answer_cache else None
+        replaced_index_version = None
+        if vectorstore is None:
+            # Load or create the vector store using the generic file paths
+            manager = VectorStoreManager()
+            vectorstore = manager.load_or_create_vectorstore(file_paths, progress_callback=progress_callback)
+            index_version, replaced_index_version = manager.index_version, manager.replaced_index_version
+            keyword_index = manager.keyword_index
+        # (vectorstore, index_version, keyword_index), replaced as one tuple so a question never mixes two indexes
+        self._index = (vectorstore, index_version, keyword_index)
+        if self.answer_cache is not None and replaced_index_version:
+            # Answers built from the previous contents of this index are stale now
+            self.answer_cache.invalidate(replaced_index_version)
+        self.history = HistoryManager(session_id, history_dir=history_dir)
+        # The configured LLM backend is shared across pipelines in this process
+        self.llm = llm if llm is not None else resources.get_llm()
+        self.history_turns = history_turns
+        self.history_token_budget = history_token_budget
+        self.summary_batch_turns = summary_batch_turns
+        self.retrieval_mode = retrieval_mode
+        self.retrieval_k = retrieval_k
+        self.fetch_k = fetch_k
+        self.rrf_k = rrf_k
+        self.retrieval_budget_ms = retrieval_budget_ms
+        self.reranker = reranker
+        self.rerank_candidates = rerank_candidates
+        self.context_builder = ContextBuilder(context_token_budget)
+        self.last_prompt_metrics = {}
+        self.last_retrieval_metrics = {}
+
+    @property
+    def vectorstore(self):
+        return self._index[0]
+
+    @property
+    def index_version(self):
+        return self._index[1]
+
+    @property
+    def keyword_index(self):
+        return self._index[2]
+
+    def swap_index(self, vectorstore, index_version, file_paths=None, replaced_index_version=None,
+                   keyword_index=None):
+        """
+        Atomically switch to a newly built index.
+
+        Questions already in flight finish against the index they started with.
+
+        Args:
+            vectorstore: The new vector store.
+            index_version (str): Its version.
+            file_paths (list, optional): The document set it was built from, if that changed.
+            replaced_index_version (str, optional): Version whose cached answers are now stale.
+            keyword_index (KeywordIndex, optional): The BM25 index built with `vectorstore`.
+        """
+        self._index = (vectorstore, index_version, keyword_index)
+        if file_paths is not None:
+            self.file_paths = list(file_paths)
+        if self.answer_cache is not None and replaced_index_version:
+            self.answer_cache.invalidate(replaced_index_version)
+        print(f"[INFO] Switched to index version {index_version}")
+
+    def _summarize(self, summary, messages):
+        """Fold `messages` into the running `summary` with one LLM call."""
+        transcript = "\n".join([f"{m['role']}: {m['content']}" for m in messages])
+        max_words = max(self.history_token_budget // 4, 50)
+        prompt = f"""
+        Update the running summary of a conversation between a user and a document assistant.
+        Keep facts, names, figures and open questions that later turns may refer to.
+        Answer with the updated summary only, in at most {max_words} words.
+
+        Current summary:
+        {summary or "(empty)"}
+
+        New messages:
+        {transcript}
+        """
+        try:
+            new_summary = self.llm.get_response(prompt)
+        except LLMError as e:
+            # Keep the old summary and try again with the next batch of turns
+            print(f"[WARNING] Could not update history summary: {e}")
+            return None
+        return new_summary.strip()
+
+    def _build_history(self):
+        """
+        Returns the rolling summary and the verbatim recent messages that fit the token budget.
+
+        Messages older than the verbatim window are folded into a summary that is persisted
+        next to the session history, in batches of `summary_batch_turns` turns.
+        """
+        with tracer.span("history.load") as span:
+            summary, recent = self._load_history_context()
+            span.set(messages=len(recent), summary_tokens=estimate_tokens(summary))
+        return summary, recent
+
+    def _load_history_context(self):
+        state = self.history.load_summary()
+        summary, covered = state["summary"], state["covered"]
+        total = self.history.message_count()
+        if covered > total:
+            # The history was reset underneath the summary
+            summary, covered = "", 0
+
+        recent = self.history.load_history(last_n=total - covered)
+        window = self.history_turns * 2
+        fold_count = 0
+        if len(recent) > window + self.summary_batch_turns * 2:
+            fold_count = len(recent) - window
+
+        def history_tokens(messages):
+            return sum(estimate_tokens(f"{m['role']}: {m['content']}") for m in messages)
+
+        def over(limit):
+            return estimate_tokens(summary) + history_tokens(recent[fold_count:]) > limit
+
+        if over(self.history_token_budget):
+            # Over budget: fold down to a low watermark that leaves room for another batch of
+            # turns of the current average size, so the next questions do not fold again. The
+            # last turn stays verbatim unless it alone exceeds the budget.
+            per_turn = 2 * history_tokens(recent) / len(recent)
+            low_watermark = self.history_token_budget - per_turn * self.summary_batch_turns
+            while fold_count < len(recent) and (
+                over(self.history_token_budget) or (fold_count < len(recent) - 2 and over(low_watermark))
+            ):
+                fold_count += 2 if fold_count + 2 <= len(recent) else 1
+
+        if fold_count:
+            new_summary = self._summarize(summary, recent[:fold_count])
+            if new_summary is not None:
+                summary = truncate_to_tokens(new_summary, self.history_token_budget // 2)
+                covered += fold_count
+                self.history.save_summary(summary, covered)
+                recent = recent[fold_count:]
+                print(f"[INFO] Folded {fold_count} messages into the history summary")
+
+        return summary, recent
+
+    def _embed_query(self, query, vectorstore):
+        """Embeds the query once; the vector is reused for retrieval and the answer cache."""
+        with tracer.span("query.embed"):
+            return vectorstore.embedding_function.embed_query(query)
+
+    def _use_answer_cache(self):
+        """
+        Whether this question may be answered from (and stored in) the shared answer cache.
+
+        The prompt includes the conversation so far, and the cache is shared across sessions, so
+        only questions that open a conversation are cached; a follow-up must never get an answer
+        written for another conversation.
+        """
+        return self.answer_cache is not None and self.history.message_count() == 0
+
+    def _cached_answer(self, query, query_vector, index_version):
+        with tracer.span("answer_cache.lookup") as span:
+            answer = self.answer_cache.get(query, index_version, query_vector)
+            span.set(hit=answer is not None)
+        tracer.incr("answer_cache_lookups_total", result="hit" if answer is not None else "miss")
+        if answer is not None:
+            print(f"[INFO] Answer cache hit (hit rate {self.answer_cache.stats()['hit_rate']:.0%})")
+        return answer
+
+    def _cache_answer(self, query, query_vector, answer, index_version):
+        self.answer_cache.put(query, index_version, answer, query_vector)
+
+    def _retrieve(self, query, query_vector, vectorstore, keyword_index):
+        """
+        Returns the `retrieval_k` most relevant document chunks for the query.
+
+        With a reranker, `rerank_candidates` chunks are retrieved and the reranker keeps the best
+        `retrieval_k` of them.
+        """
+        with tracer.span("retrieve", mode=self.retrieval_mode):
+            if self.reranker is None:
+                return self._search(query, query_vector, vectorstore, keyword_index, self.retrieval_k)
+            candidates = self._search(query, query_vector, vectorstore, keyword_index, self.rerank_candidates)
+            with tracer.span("rerank", candidates=len(candidates)):
+                docs = self.reranker.rerank(query, candidates, self.retrieval_k)
+        self.last_retrieval_metrics["rerank"] = self.reranker.last_stats
+        print(f"[INFO] Rerank: {self.reranker.last_stats}")
+        return docs
+
+    @staticmethod
+    def _vector_search(vectorstore, query_vector, k):
+        with tracer.span("search.vector", k=k):
+            return vectorstore.similarity_search_by_vector(query_vector, k=k)
+
+    @staticmethod
+    def _keyword_search(keyword_index, query, k):
+        with tracer.span("search.keyword", k=k):
+            return keyword_index.search(query, k)
+
+    def _search(self, query, query_vector, vectorstore, keyword_index, k):
+        """
+        Returns the `k` most relevant document chunks for the query.
+
+        In hybrid mode the vector and BM25 searches run in parallel and their rankings are
+        merged with reciprocal-rank fusion. A retriever that misses `retrieval_budget_ms` (or
+        fails) is left out; if neither answered in time, the vector search is awaited.
+        Timings are stored in `self.last_retrieval_metrics`.
         """
-        # Load or create the vector store using the generic file paths
-        self.vectorstore = VectorStoreManager().load_or_create_vectorstore(file_paths)
-        self.history = HistoryManager(session_id)
-        self.llm = ChatGemini()
+        start = time.perf_counter()
+        mode = self.retrieval_mode if keyword_index is not None else "vector"
+        if mode == "vector":
+            docs = self._vector_search(vectorstore, query_vector, k)
+        elif mode == "keyword":
+            hits = self._keyword_search(keyword_index, query, k)
+            docs = [vectorstore.docstore.search(doc_id) for doc_id, _ in hits]
+        else:
+            pool = resources.get_retrieval_pool()
+            fetch_k = max(self.fetch_k, k)
+            # Each search runs in a copy of this context, so its span nests under the current one
+            vector_future = pool.submit(
+                contextvars.copy_context().run, self._vector_search, vectorstore, query_vector, fetch_k
+            )
+            keyword_future = pool.submit(
+                contextvars.copy_context().run, self._keyword_search, keyword_index, query, fetch_k
+            )
+            done, _ = wait([vector_future, keyword_future], timeout=self.retrieval_budget_ms / 1000)
+
+            rankings, docs_by_id, late = [], {}, []
+            for name, future in (("vector", vector_future), ("keyword", keyword_future)):
+                if future not in done:
+                    late.append(name)
+                elif future.exception() is not None:
+                    print(f"[WARNING] {name} retrieval failed. Error: {future.exception()}")
+                elif name == "vector":
+                    docs_by_id.update((doc.id, doc) for doc in future.result())
+                    rankings.append([doc.id for doc in future.result()])
+                else:
+                    rankings.append([doc_id for doc_id, _ in future.result()])
+            if late:
+                tracer.incr("retrieval_budget_misses_total", len(late))
+                print(f"[WARNING] {', '.join(late)} retrieval missed the {self.retrieval_budget_ms}ms budget")
+            if not rankings:
+                vector_docs = vector_future.result()
+                docs_by_id.update((doc.id, doc) for doc in vector_docs)
+                rankings.append([doc.id for doc in vector_docs])
+
+            fused = reciprocal_rank_fusion(rankings, self.rrf_k)[:k]
+            docs = [docs_by_id.get(doc_id) or vectorstore.docstore.search(doc_id) for doc_id in fused]
+            mode = f"hybrid ({len(rankings)} rankings)"
+
+        self.last_retrieval_metrics = {"mode": mode, "retrieval_ms": (time.perf_counter() - start) * 1000}
+        print(f"[INFO] Retrieval: {self.last_retrieval_metrics}")
+        return docs
 
+    def _build_prompt(self, query, query_vector, vectorstore, keyword_index):
+        """
+        Retrieves context for `query` and assembles the full prompt.
+
+        Prompt size metrics for the call are stored in `self.last_prompt_metrics`.
+        """
+        # 1. Retrieval: Find the top `retrieval_k` relevant document chunks
+        docs = self._retrieve(query, query_vector, vectorstore, keyword_index)
+
+        # 2. History: Summary of older turns plus the most recent turns verbatim
+        # Note: We load the history *before* the current turn is saved to only provide past context.
+        summary, recent = self._build_history()
 
+        return self._format_prompt(query, docs, summary, recent)
+
+    def _format_prompt(self, query, docs, summary, recent):
+        """Assembles the prompt from retrieved documents and history, recording size metrics."""
+        with tracer.span("prompt.assemble", chunks=len(docs)):
+            context, context_stats = self.context_builder.build(docs)
+            chat_history = "\n".join([f"{h['role']}: {h['content']}" for h in recent])
+            if summary:
+                chat_history = f"Summary of earlier conversation: {summary}\n{chat_history}"
+
+            # 3. Augmentation & Generation: Construct the prompt
+            prompt = build_prompt(context, chat_history, query)
+
+            self.last_prompt_metrics = {
+                "context_tokens": estimate_tokens(context),
+                "context_chunks": context_stats["chunks_used"],
+                "context_tokens_saved": context_stats["tokens_saved"],
+                "context_chunks_dropped": context_stats["dropped_over_budget"],
+                "history_tokens": estimate_tokens(chat_history),
+                "summary_tokens": estimate_tokens(summary),
+                "history_messages": len(recent),
+                "prompt_tokens": estimate_tokens(prompt),
+                # Stable part (system instruction and history) that prefix caches can reuse across turns
+                "prompt_prefix_tokens": estimate_tokens(prompt.system) + estimate_tokens(prompt.prefix),
+            }
+            print(f"[INFO] Prompt size: {self.last_prompt_metrics}")
+
+            return prompt
 
     def ask(self, query):
         """
@@ -28,44 +363,107 @@ class RAGPipeline:
 
         Returns:
             str: The LLM-generated answer based on the retrieved context.
+                Prompt size metrics for the call are stored in `self.last_prompt_metrics`.
+
+        Raises:
+            LLMError: The LLM call failed.
         """
-        # 1. Retrieval: Find the top 3 relevant document chunks
-        docs = self.vectorstore.similarity_search(query, k=3)
-        context = "\n\n".join([d.page_content for d in docs])
-        
-        # 2. History: Format the chat history
-        # Note: We load the history *before* the current turn is saved to only provide past context.
-        chat_history = "\n".join([f"{h['role']}: {h['content']}" for h in self.history.load_history()])
+        with tracer.request("rag.ask"):
+            vectorstore, index_version, keyword_index = self._index
+            query_vector = self._embed_query(query, vectorstore)
+            use_cache = self._use_answer_cache()
+            cached = self._cached_answer(query, query_vector, index_version) if use_cache else None
+            if cached is not None:
+                return cached
 
-        # 3. Augmentation & Generation: Construct the prompt
-        prompt = f"""
-        You are a professional assistant that answers questions based only on the user's uploaded documents.
-
-        Your primary goal:
-        - Use the document context below to answer the user's question as accurately as possible.
-        - If the answer is NOT found in the provided context, or is only partially related, say clearly:
-          "The definition/details are not mentioned directly in the document, but based on related context from the file, here's what can be inferred."
-
-        Rules:
-        1. Always prioritize facts and examples found in the context.
-        2. Never make up new document content — if it's not there, acknowledge it.
-        3. You may provide a short general explanation only AFTER clarifying it's not in the document.
-        4. Do NOT mention that you're an AI or language model.
-
-        -----------------------
-        📘 Document Context: {context}
-        
-        Chat history:
-        {chat_history}
-
-        Question: {query}
-        """
-
-        # 4. Generate the response
-        response = self.llm.get_response(prompt)
-        
-        # NOTE: History saving happens in app.py after the response is received to ensure both the 
-        # user query and assistant response are appended together to the session history.
-        # Removing the save_turn calls here to prevent duplication, as app.py handles persistence.
-        
-        return response
+            prompt = self._build_prompt(query, query_vector, vectorstore, keyword_index)
+
+            # 4. Generate the response
+            with tracer.span("llm"):
+                response = self.llm.get_response(prompt)
+            if use_cache:
+                self._cache_answer(query, query_vector, response, index_version)
+
+            # NOTE: History saving happens in app.py after the response is received to ensure both the
+            # user query and assistant response are appended together to the session history.
+            # Removing the save_turn calls here to prevent duplication, as app.py handles persistence.
+
+            return response
+
+    def ask_stream(self, query):
+        """
+        Streaming variant of `ask` that yields the answer in pieces as the LLM produces them.
+
+        Args:
+            query (str): The user's question.
+
+        Yields:
+            str: Successive text chunks of the answer.
+
+        Raises:
+            LLMError: The LLM call failed, possibly after some chunks were yielded.
+        """
+        with tracer.request("rag.ask_stream"):
+            vectorstore, index_version, keyword_index = self._index
+            query_vector = self._embed_query(query, vectorstore)
+            use_cache = self._use_answer_cache()
+            cached = self._cached_answer(query, query_vector, index_version) if use_cache else None
+            if cached is not None:
+                yield cached
+                return
+
+            prompt = self._build_prompt(query, query_vector, vectorstore, keyword_index)
+            start = time.perf_counter()
+            first_token_at = None
+            chunks = []
+            with tracer.span("llm", mode="stream") as span:
+                for chunk in self.llm.stream_response(prompt):
+                    if first_token_at is None:
+                        first_token_at = time.perf_counter()
+                        self.last_prompt_metrics["ttft_seconds"] = first_token_at - start
+                        span.set(ttft_ms=round((first_token_at - start) * 1000, 3))
+                        tracer.observe("llm_ttft_seconds", first_token_at - start)
+                        print(f"[INFO] Time to first token: {first_token_at - start:.2f}s")
+                    chunks.append(chunk)
+                    yield chunk
+            self.last_prompt_metrics["total_seconds"] = time.perf_counter() - start
+            if use_cache:
+                self._cache_answer(query, query_vector, "".join(chunks), index_version)
+
+    async def aask(self, query):
+        """
+        Async variant of `ask` for serving many questions concurrently from one process.
+
+        Retrieval and history loading run concurrently in worker threads, and the LLM call
+        uses the backend's async call so it does not block the event loop.
+
+        Args:
+            query (str): The user's question.
+
+        Returns:
+            str: The LLM-generated answer based on the retrieved context.
+        """
+        with tracer.request("rag.aask"):
+            vectorstore, index_version, keyword_index = self._index
+            use_cache = self._use_answer_cache()
+
+            async def retrieve():
+                query_vector = await asyncio.to_thread(self._embed_query, query, vectorstore)
+                cached = self._cached_answer(query, query_vector, index_version) if use_cache else None
+                if cached is not None:
+                    return query_vector, cached, None
+                docs = await asyncio.to_thread(self._retrieve, query, query_vector, vectorstore, keyword_index)
+                return query_vector, None, docs
+
+            (query_vector, cached, docs), (summary, recent) = await asyncio.gather(
+                retrieve(),
+                asyncio.to_thread(self._build_history),
+            )
+            if cached is not None:
+                return cached
+            prompt = self._format_prompt(query, docs, summary, recent)
+            with tracer.span("llm", mode="async"):
+                response = await self.llm.aget_response(prompt)
+            if use_cache:
+                self._cache_answer(query, query_vector, response, index_version)
+            return response
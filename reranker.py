@@ -0,0 +1,126 @@
+import threading
+import time
+from collections import OrderedDict
+
+from answer_cache import normalize_query
+
+
+class CrossEncoderReranker:
+    """
+    Reorders retrieved chunks by a local cross-encoder's relevance scores.
+
+    Scores are cached per (normalised query, chunk id), so follow-ups and repeated questions
+    only score chunks they have not seen. Reranking is skipped (and the retrieval order kept)
+    when the uncached pairs are not expected to finish within `max_latency_ms`, or when
+    scoring runs past it. Each skip halves the cost estimate, so a slow spell (or a stale
+    estimate) only disables reranking until the next probe shows scoring is fast again.
+    """
+
+    def __init__(self, model_name="cross-encoder/ms-marco-MiniLM-L-6-v2", batch_size=16, max_latency_ms=300,
+                 cache_size=4096):
+        """
+        Args:
+            model_name (str): The sentence-transformers cross-encoder model.
+            batch_size (int): (query, chunk) pairs per forward pass.
+            max_latency_ms (float): Latency cap for scoring one query's candidates.
+            cache_size (int): (query, chunk id) scores kept in the LRU cache.
+        """
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.max_latency_ms = max_latency_ms
+        self.cache_size = cache_size
+        self._model = None
+        self._scores = OrderedDict()
+        self._lock = threading.Lock()
+        # Running estimate of the scoring cost, used to skip reranking that would miss the cap
+        self._seconds_per_pair = None
+        self.last_stats = {}
+
+    @property
+    def model(self):
+        if self._model is None:
+            from sentence_transformers import CrossEncoder
+            print(f"[INFO] Loading reranker model: {self.model_name}")
+            model = CrossEncoder(self.model_name, device="cpu")
+            # The first forward pass initialises the backend; keep it out of the scoring estimate
+            model.predict([("warm up", "warm up")], show_progress_bar=False)
+            self._model = model
+        return self._model
+
+    def _cached_score(self, key):
+        with self._lock:
+            score = self._scores.get(key)
+            if score is not None:
+                self._scores.move_to_end(key)
+            return score
+
+    def _cache_scores(self, items):
+        with self._lock:
+            for key, score in items:
+                self._scores[key] = score
+                self._scores.move_to_end(key)
+            while len(self._scores) > self.cache_size:
+                self._scores.popitem(last=False)
+
+    def rerank(self, query, docs, top_k):
+        """
+        Return the `top_k` most relevant of `docs` for `query`.
+
+        Args:
+            query (str): The user's question.
+            docs (list): Candidate Documents in retrieval order; their `id` keys the score cache.
+            top_k (int): Documents to keep.
+
+        Returns:
+            list: The reranked top_k documents, or the first top_k in retrieval order if
+                reranking was skipped. Details are stored in `self.last_stats`.
+        """
+        # Loading the model takes seconds; it must not count against the latency cap or the estimate
+        model = self.model
+        start = time.perf_counter()
+        normalized = normalize_query(query)
+        scores = {}
+        uncached = []
+        for position, doc in enumerate(docs):
+            score = self._cached_score((normalized, doc.id))
+            if score is None:
+                uncached.append(position)
+            else:
+                scores[position] = score
+        self.last_stats = {"candidates": len(docs), "cached": len(scores), "scored": 0, "skipped": None}
+
+        budget = self.max_latency_ms / 1000 if self.max_latency_ms is not None else None
+        if budget is not None and self._seconds_per_pair is not None and uncached:
+            if len(uncached) * self._seconds_per_pair > budget:
+                # Decay the estimate, so reranking is probed again after a few skipped questions
+                self._seconds_per_pair /= 2
+                return self._skip(docs, top_k, start, "expected to exceed the latency cap")
+
+        for i in range(0, len(uncached), self.batch_size):
+            if budget is not None and time.perf_counter() - start > budget:
+                return self._skip(docs, top_k, start, "exceeded the latency cap")
+            positions = uncached[i:i + self.batch_size]
+            batch_start = time.perf_counter()
+            batch_scores = model.predict(
+                [(query, docs[p].page_content) for p in positions],
+                batch_size=self.batch_size, show_progress_bar=False,
+            )
+            per_pair = (time.perf_counter() - batch_start) / len(positions)
+            self._seconds_per_pair = (
+                per_pair if self._seconds_per_pair is None else 0.8 * self._seconds_per_pair + 0.2 * per_pair
+            )
+            batch_scores = [float(score) for score in batch_scores]
+            # Scores finished before a skip are kept for the next question
+            self._cache_scores(((normalized, docs[p].id), score) for p, score in zip(positions, batch_scores))
+            scores.update(zip(positions, batch_scores))
+            self.last_stats["scored"] += len(positions)
+
+        ranked = sorted(range(len(docs)), key=lambda p: scores[p], reverse=True)[:top_k]
+        self.last_stats["rerank_ms"] = (time.perf_counter() - start) * 1000
+        return [docs[p] for p in ranked]
+
+    def _skip(self, docs, top_k, start, reason):
+        self.last_stats["skipped"] = reason
+        self.last_stats["rerank_ms"] = (time.perf_counter() - start) * 1000
+        print(f"[WARNING] Reranking skipped: {reason} ({self.max_latency_ms}ms)")
+        return docs[:top_k]
@@ -0,0 +1,145 @@
+"""
+Process-wide registry of expensive, shareable resources.
+
+Streamlit re-executes app.py on every interaction but keeps imported modules
+in memory, so anything stored here is created once per server process and
+shared by all reruns and browser sessions.
+"""
+import os
+import threading
+
+_resources = {}
+_lock = threading.Lock()
+
+
+def get_resource(key, factory):
+    """
+    Return the shared resource stored under `key`, creating it with `factory()` on first use.
+
+    Args:
+        key: A hashable identifier for the resource.
+        factory (callable): Builds the resource. Called at most once per key.
+    """
+    resource = _resources.get(key)
+    if resource is not None:
+        return resource
+    with _lock:
+        # Another thread may have created it while we were waiting for the lock
+        if key not in _resources:
+            _resources[key] = factory()
+        return _resources[key]
+
+
+def get_embeddings(model_name="sentence-transformers/all-MiniLM-L6-v2", batch_size=32, normalize=False, threads=None):
+    """
+    Shared HuggingFace embedding model, loaded once per process.
+
+    Args:
+        model_name (str): The sentence-transformers model.
+        batch_size (int): Texts per forward pass when embedding documents.
+        normalize (bool): Return unit-length vectors.
+        threads (int, optional): torch intra-op threads; defaults to all CPU cores.
+    """
+    def factory():
+        import torch
+        from langchain_community.embeddings import HuggingFaceEmbeddings
+        torch.set_num_threads(threads or os.cpu_count() or 1)
+        print(f"[INFO] Loading embedding model: {model_name} ({torch.get_num_threads()} threads)")
+        return HuggingFaceEmbeddings(
+            model_name=model_name,
+            encode_kwargs={"batch_size": batch_size, "normalize_embeddings": normalize},
+        )
+
+    return get_resource(("embeddings", model_name, batch_size, normalize), factory)
+
+
+def get_llm(name=None):
+    """Shared LLM backend (`name` or LLM_BACKEND, default Gemini), configured once per process."""
+    from llm_backends import backend_name, create_backend
+    name = backend_name(name)
+
+    def factory():
+        return create_backend(name)
+
+    return get_resource(("llm", name), factory)
+
+
+def get_rate_limiter(name, requests_per_minute):
+    """Shared token bucket, so every session's calls to one provider count against one limit."""
+    def factory():
+        from rate_limiter import TokenBucket
+        return TokenBucket.per_minute(requests_per_minute)
+
+    return get_resource(("rate_limiter", name, requests_per_minute), factory)
+
+
+def get_answer_cache():
+    """Shared answer cache, so repeated questions hit it across sessions."""
+    def factory():
+        from answer_cache import AnswerCache
+        return AnswerCache()
+
+    return get_resource(("answer_cache",), factory)
+
+
+def get_reranker(model_name="cross-encoder/ms-marco-MiniLM-L-6-v2", max_latency_ms=300):
+    """Shared cross-encoder reranker; its model loads on first use and its score cache is shared."""
+    def factory():
+        from reranker import CrossEncoderReranker
+        return CrossEncoderReranker(model_name, max_latency_ms=max_latency_ms)
+
+    return get_resource(("reranker", model_name, max_latency_ms), factory)
+
+
+def get_retrieval_pool():
+    """Shared threads for running the vector and keyword searches of hybrid retrieval in parallel."""
+    def factory():
+        from concurrent.futures import ThreadPoolExecutor
+        return ThreadPoolExecutor(max_workers=8, thread_name_prefix="retrieval")
+
+    return get_resource(("retrieval_pool",), factory)
+
+
+def worker_context():
+    """
+    Multiprocessing context for worker processes: a forkserver (spawn where that is unavailable),
+    since forking this multithreaded process could copy locks held by other threads into the child.
+    """
+    import multiprocessing
+    method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    return multiprocessing.get_context(method)
+
+
+def get_load_pool(workers):
+    """Shared worker processes that load and split documents, started on first use."""
+    def factory():
+        from concurrent.futures import ProcessPoolExecutor
+        return ProcessPoolExecutor(max_workers=workers, mp_context=worker_context())
+
+    return get_resource(("load_pool", workers), factory)
+
+
+def terminate_load_pool(workers, pool):
+    """Kill the processes of a stuck or broken load pool; the next `get_load_pool` starts a new one."""
+    with _lock:
+        if _resources.get(("load_pool", workers)) is pool:
+            del _resources[("load_pool", workers)]
+    # Workers stuck in a hung parser never return, so they are terminated, not joined
+    for process in list((pool._processes or {}).values()):
+        process.terminate()
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def get_indexing_jobs():
+    """Shared background indexing queue; jobs outlive the script run that submitted them."""
+    def factory():
+        from indexing_jobs import IndexingJobQueue
+        return IndexingJobQueue()
+
+    return get_resource(("indexing_jobs",), factory)
+
+
+def clear():
+    """Drop all shared resources (mainly useful in tests)."""
+    with _lock:
+        _resources.clear()
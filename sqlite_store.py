@@ -0,0 +1,186 @@
+import json
+import os
+import pathlib
+import sqlite3
+import threading
+
+from langchain_community.docstore.base import AddableMixin, Docstore
+from langchain_core.documents import Document
+
+
+class SQLiteStore:
+    """
+    Base of the stores saved as one SQLite file next to the FAISS index.
+
+    A saved store is opened read-only and queried in place, so loading it does not read its
+    contents into memory. Saved files are never modified: the first write copies the store into
+    a private temporary database (deleted when it is closed), and `save` writes a new file and
+    renames it over the old one. Pipelines and processes still reading the old file keep a
+    consistent view of it until they let go.
+    """
+
+    # CREATE statements run on every new, empty store
+    schema = ()
+
+    def __init__(self, path=None):
+        """
+        Args:
+            path (str, optional): A file written by `save`; without it the store starts empty.
+        """
+        self._lock = threading.RLock()
+        if path is None:
+            self._conn = self._connect_scratch()
+            for statement in self.schema:
+                self._conn.execute(statement)
+            self._writable = True
+        else:
+            self._open(path)
+
+    def _open(self, path):
+        if not os.path.exists(path):
+            raise FileNotFoundError(path)
+        # immutable: saved files are only ever replaced, so SQLite can skip locking them
+        uri = pathlib.Path(path).absolute().as_uri() + "?mode=ro&immutable=1"
+        self._conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        self._writable = False
+
+    @staticmethod
+    def _connect_scratch():
+        # An empty name is a private temporary database that spills to disk once it grows
+        conn = sqlite3.connect("", check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=OFF")
+        conn.execute("PRAGMA synchronous=OFF")
+        return conn
+
+    def _write_conn(self):
+        """The connection to write to, copying a saved store into a scratch database first."""
+        if not self._writable:
+            scratch = self._connect_scratch()
+            self._conn.backup(scratch)
+            self._conn.close()
+            self._conn = scratch
+            self._writable = True
+        return self._conn
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def _query_in(self, sql, values):
+        """Run `sql`, whose "{}" is replaced by placeholders, over `values` in batches."""
+        values = list(values)
+        rows = []
+        with self._lock:
+            # SQLite limits the number of bound parameters per statement
+            for i in range(0, len(values), 500):
+                batch = values[i:i + 500]
+                rows.extend(self._conn.execute(sql.format(",".join("?" * len(batch))), batch).fetchall())
+        return rows
+
+    def save(self, path):
+        """Write the store to `path` atomically and keep reading from the saved file."""
+        with self._lock:
+            self._conn.commit()
+            tmp_path = path + ".tmp"
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            target = sqlite3.connect(tmp_path)
+            try:
+                self._conn.backup(target)
+            finally:
+                target.close()
+            os.replace(tmp_path, path)
+            self._conn.close()
+            self._open(path)
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+
+
+class SQLiteDocstore(SQLiteStore, Docstore, AddableMixin):
+    """
+    LangChain docstore whose chunks are read from SQLite by id as searches return them.
+
+    The file also holds the FAISS position -> docstore id mapping and the index spec, so the
+    whole vector store is described by the FAISS index file plus this one.
+    """
+
+    schema = (
+        "CREATE TABLE docs (id TEXT PRIMARY KEY, page_content TEXT NOT NULL, metadata TEXT NOT NULL)",
+        "CREATE TABLE positions (position INTEGER PRIMARY KEY, id TEXT NOT NULL)",
+        "CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)",
+    )
+
+    def __len__(self):
+        return self._query("SELECT COUNT(*) FROM docs")[0][0]
+
+    def search(self, search):
+        """The Document stored as `search`, or an error string as InMemoryDocstore returns."""
+        rows = self._query("SELECT page_content, metadata FROM docs WHERE id = ?", (search,))
+        if not rows:
+            return f"ID {search} not found."
+        page_content, metadata = rows[0]
+        return Document(id=search, page_content=page_content, metadata=json.loads(metadata))
+
+    def mget(self, ids):
+        """Documents for `ids` in order (None where missing), read in a few queries."""
+        rows = self._query_in("SELECT id, page_content, metadata FROM docs WHERE id IN ({})", dict.fromkeys(ids))
+        docs = {
+            doc_id: Document(id=doc_id, page_content=page_content, metadata=json.loads(metadata))
+            for doc_id, page_content, metadata in rows
+        }
+        return [docs.get(doc_id) for doc_id in ids]
+
+    def add(self, texts):
+        """Store Documents from a {doc_id: Document} dict."""
+        with self._lock:
+            self._write_conn().executemany(
+                "INSERT OR REPLACE INTO docs (id, page_content, metadata) VALUES (?, ?, ?)",
+                [
+                    (doc_id, doc.page_content, json.dumps(doc.metadata, default=str))
+                    for doc_id, doc in texts.items()
+                ],
+            )
+
+    def delete(self, ids):
+        with self._lock:
+            self._write_conn().executemany("DELETE FROM docs WHERE id = ?", [(doc_id,) for doc_id in ids])
+
+    def index_to_docstore_id(self):
+        """The saved FAISS position -> docstore id mapping."""
+        return dict(self._query("SELECT position, id FROM positions ORDER BY position"))
+
+    def index_spec(self):
+        rows = self._query("SELECT value FROM meta WHERE key = 'index_spec'")
+        return rows[0][0] if rows else "Flat"
+
+    def save(self, path, index_to_docstore_id=None, index_spec=None):
+        """
+        Save the documents together with the vector store's position mapping and index spec.
+
+        Args:
+            path (str): The docstore file.
+            index_to_docstore_id (dict, optional): FAISS position -> docstore id.
+            index_spec (str, optional): The faiss.index_factory spec of the index.
+        """
+        with self._lock:
+            if index_to_docstore_id is not None or index_spec is not None:
+                conn = self._write_conn()
+                if index_to_docstore_id is not None:
+                    conn.execute("DELETE FROM positions")
+                    conn.executemany(
+                        "INSERT INTO positions (position, id) VALUES (?, ?)", sorted(index_to_docstore_id.items())
+                    )
+                if index_spec is not None:
+                    conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('index_spec', ?)", (index_spec,))
+            super().save(path)
+
+    @classmethod
+    def from_docstore(cls, docstore, ids):
+        """Copy the documents `ids` from another docstore (e.g. the InMemoryDocstore of a new index)."""
+        store = cls()
+        for i in range(0, len(ids), 1000):
+            store.add({doc_id: docstore.search(doc_id) for doc_id in ids[i:i + 1000]})
+        return store
@@ -0,0 +1,122 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from benchmarks.fake_gemini_server import FakeGeminiServer
+from llm_errors import LLMError, LLMRateLimitError, LLMTimeoutError, LLMUnavailableError
+
+
+@pytest.fixture
+def server():
+    server = FakeGeminiServer(answer="Fake answer.").start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def make_client(server, monkeypatch):
+    monkeypatch.setenv("GEMINI_API_KEY", "fake")
+    from chat_gemini import ChatGemini
+
+    def make(**kwargs):
+        options = {"timeout": 2.0, "deadline": 5.0, "backoff_base": 0.01, "cache_min_tokens": 0}
+        options.update(kwargs)
+        return ChatGemini(api_endpoint=server.endpoint, **options)
+
+    return make
+
+
+def test_retries_retryable_errors(server, make_client):
+    client = make_client()
+    server.script.extend([(503, 0), (429, 0)])
+    assert client.get_response("question") == "Fake answer."
+    assert server.requests == 3
+
+
+def test_does_not_retry_bad_requests(server, make_client):
+    client = make_client()
+    server.script.append((400, 0))
+    with pytest.raises(LLMError) as excinfo:
+        client.get_response("question")
+    assert not excinfo.value.retryable
+    assert server.requests == 1
+
+
+@pytest.mark.parametrize("status, error_type", [
+    (429, LLMRateLimitError),
+    (500, LLMUnavailableError),
+    (503, LLMUnavailableError),
+])
+def test_typed_errors_after_retries(server, make_client, status, error_type):
+    client = make_client(max_retries=2)
+    server.script.extend([(status, 0)] * 3)
+    with pytest.raises(error_type) as excinfo:
+        client.get_response("question")
+    assert excinfo.value.retryable
+    assert server.requests == 3
+
+
+def test_attempt_timeout(server, make_client):
+    client = make_client(timeout=0.3, max_retries=0)
+    server.script.append((200, 2))
+    start = time.monotonic()
+    with pytest.raises(LLMTimeoutError):
+        client.get_response("question")
+    assert time.monotonic() - start < 1.5
+
+
+def test_deadline_bounds_retries(server, make_client):
+    client = make_client(timeout=0.3, deadline=0.8, max_retries=10)
+    server.script.extend([(200, 2)] * 10)
+    start = time.monotonic()
+    with pytest.raises(LLMTimeoutError):
+        client.get_response("question")
+    assert time.monotonic() - start < 1.5
+
+
+def test_hedged_request_answers_when_first_is_slow(server, make_client):
+    client = make_client(hedge_after=0.1)
+    server.script.append((200, 2))
+    start = time.monotonic()
+    assert client.get_response("question") == "Fake answer."
+    assert time.monotonic() - start < 1.0
+    assert server.requests == 2
+
+
+def test_hedges_are_not_held_back_by_other_calls(server, make_client):
+    client = make_client(hedge_after=0.1)
+    # More concurrent calls than the old fixed pool of 16 threads, each with a slow first request
+    server.script.extend([(200, 2)] * 20)
+
+    def ask(_):
+        start = time.monotonic()
+        answer = client.get_response("question")
+        return answer, time.monotonic() - start
+
+    with ThreadPoolExecutor(max_workers=20) as callers:
+        results = list(callers.map(ask, range(20)))
+    assert all(answer == "Fake answer." for answer, _ in results)
+    assert max(seconds for _, seconds in results) < 1.5
+
+
+def test_async_hedged_request_answers_when_first_is_slow(server, make_client):
+    client = make_client(hedge_after=0.1)
+    server.script.append((200, 2))
+
+    async def ask():
+        start = time.monotonic()
+        answer = await client.aget_response("question")
+        return answer, time.monotonic() - start
+
+    answer, seconds = asyncio.run(ask())
+    assert answer == "Fake answer."
+    assert seconds < 1.0
+
+
+def test_stream_retries_before_first_chunk(server, make_client):
+    client = make_client()
+    server.script.append((503, 0))
+    assert "".join(client.stream_response("question")) == "Fake answer."
+    assert server.requests == 2
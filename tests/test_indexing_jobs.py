@@ -0,0 +1,55 @@
+import threading
+import time
+
+from indexing_jobs import DONE, IndexingJobQueue
+
+
+class FakeManager:
+    """Stands in for VectorStoreManager; returns a new index once `release` is set."""
+
+    index_version = "v1"
+    replaced_index_version = None
+
+    def __init__(self, release):
+        self.release = release
+        self.keyword_index = None
+
+    def load_or_create_vectorstore(self, files, rebuild=False, progress_callback=None):
+        self.release.wait(5)
+        self.keyword_index = object()
+        return object()
+
+
+def job_queue(release, **kwargs):
+    return IndexingJobQueue(manager_factory=lambda: FakeManager(release), **kwargs)
+
+
+def wait_until(condition):
+    deadline = time.monotonic() + 5
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert condition()
+
+
+def test_result_is_released_once_every_owner_took_it():
+    release = threading.Event()
+    jobs = job_queue(release)
+    job = jobs.submit(["a.txt"], owner="first")
+    assert jobs.submit(["a.txt"], owner="second") is job
+    release.set()
+    wait_until(lambda: job.status == DONE)
+    vectorstore, keyword_index = jobs.take_result(job.id, owner="first")
+    assert job.vectorstore is vectorstore
+    assert jobs.take_result(job.id, owner="second") == (vectorstore, keyword_index)
+    assert job.vectorstore is None and job.keyword_index is None
+    assert jobs.take_result(job.id, owner="second") is None
+
+
+def test_old_finished_jobs_are_forgotten_without_another_submit():
+    release = threading.Event()
+    jobs = job_queue(release, keep_finished=2)
+    submitted = [jobs.submit([f"{i}.txt"]) for i in range(4)]
+    release.set()
+    # The oldest jobs are dropped as later ones finish, not on the next submit
+    wait_until(lambda: all(job.status == DONE for job in submitted) and len(jobs.jobs()) == 2)
+    assert [job.id for job in jobs.jobs()] == [job.id for job in submitted[2:]]
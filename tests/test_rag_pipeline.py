@@ -0,0 +1,62 @@
+import pytest
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+import resources
+from benchmarks.stub_llm import StubLLM
+from llm_backends import create_backend
+from rag_pipeline import RAGPipeline
+
+
+@pytest.fixture
+def documents(tmp_path, monkeypatch):
+    """A small document set in a scratch directory, indexed with deterministic fake embeddings."""
+    monkeypatch.chdir(tmp_path)
+    resources.clear()
+    embeddings = DeterministicFakeEmbedding(size=32)
+    monkeypatch.setattr(resources, "get_embeddings", lambda *args, **kwargs: embeddings)
+    path = tmp_path / "guide.txt"
+    path.write_text(
+        "AskDocsAI answers questions about uploaded documents.\n\n"
+        "It indexes PDF, DOCX and text files with FAISS and keeps a chat history per session.\n"
+    )
+    yield [str(path)]
+    resources.clear()
+
+
+def make_pipeline(documents, llm, session_id="session"):
+    return RAGPipeline(session_id, documents, llm=llm, history_dir="chat_history")
+
+
+def test_ask_answers_from_the_stub_backend(documents):
+    llm = StubLLM(latency=0)
+    pipeline = make_pipeline(documents, llm)
+
+    answer = pipeline.ask("What does AskDocsAI do?")
+
+    assert answer.startswith("Stub answer")
+    assert llm.calls == 1
+    assert pipeline.last_prompt_metrics["context_tokens"] > 0
+
+
+def test_ask_serves_repeated_opening_questions_from_the_answer_cache(documents):
+    llm = StubLLM(latency=0)
+    first = make_pipeline(documents, llm, "first").ask("What does AskDocsAI do?")
+    second = make_pipeline(documents, llm, "second").ask("What does AskDocsAI do?")
+
+    assert second == first
+    assert llm.calls == 1
+
+
+def test_follow_up_questions_bypass_the_answer_cache(documents):
+    llm = StubLLM(latency=0)
+    make_pipeline(documents, llm, "first").ask("Which files can it index?")
+    pipeline = make_pipeline(documents, llm, "second")
+    pipeline.history.save_turns([("user", "What does AskDocsAI do?"), ("assistant", "It answers questions.")])
+
+    pipeline.ask("Which files can it index?")
+
+    assert llm.calls == 2
+
+
+def test_stub_backend_is_selectable_by_name():
+    assert isinstance(create_backend("stub"), StubLLM)
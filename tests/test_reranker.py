@@ -0,0 +1,53 @@
+import sys
+import time
+import types
+
+import pytest
+from langchain_core.documents import Document
+
+from reranker import CrossEncoderReranker
+
+
+class SlowLoadingCrossEncoder:
+    """Stand-in cross-encoder: slow to load, fast to score (longer chunks score higher)."""
+
+    load_seconds = 0.5
+
+    def __init__(self, model_name, device=None):
+        time.sleep(self.load_seconds)
+
+    def predict(self, pairs, batch_size=None, show_progress_bar=None):
+        return [len(text) for _, text in pairs]
+
+
+@pytest.fixture
+def cross_encoder(monkeypatch):
+    module = types.SimpleNamespace(CrossEncoder=SlowLoadingCrossEncoder)
+    monkeypatch.setitem(sys.modules, "sentence_transformers", module)
+
+
+def make_docs(n, query_id=0):
+    return [Document(id=f"{query_id}-{i}", page_content="x" * (i + 1)) for i in range(n)]
+
+
+def test_model_loading_does_not_count_against_the_latency_cap(cross_encoder):
+    reranker = CrossEncoderReranker(max_latency_ms=100)
+    for query_id in range(3):
+        docs = make_docs(8, query_id)
+        ranked = reranker.rerank(f"question {query_id}", docs, 3)
+        assert reranker.last_stats["skipped"] is None
+        assert reranker.last_stats["scored"] == 8
+        assert [doc.id for doc in ranked] == [docs[7].id, docs[6].id, docs[5].id]
+
+
+def test_stale_cost_estimate_does_not_disable_reranking(cross_encoder):
+    reranker = CrossEncoderReranker(max_latency_ms=100)
+    reranker.model
+    # As if one earlier batch had been very slow
+    reranker._seconds_per_pair = 1.0
+    stats = []
+    for query_id in range(12):
+        reranker.rerank(f"question {query_id}", make_docs(8, query_id), 3)
+        stats.append(reranker.last_stats)
+    assert stats[0]["skipped"] == "expected to exceed the latency cap"
+    assert stats[-1]["skipped"] is None and stats[-1]["scored"] == 8
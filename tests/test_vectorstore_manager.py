@@ -0,0 +1,309 @@
+import json
+import multiprocessing
+import os
+import threading
+import time
+
+import faiss
+import numpy as np
+import pytest
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+import resources
+import vectorstore_manager
+from vectorstore_manager import VectorStoreManager
+
+
+class HangingLoader:
+    """Loader whose parser never finishes, like a pathological upload."""
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+
+    def load(self):
+        time.sleep(60)
+        return []
+
+    def lazy_load(self):
+        time.sleep(60)
+        yield Document(page_content="never")
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """Scratch directory with deterministic fake embeddings and fork-started worker processes."""
+    monkeypatch.chdir(tmp_path)
+    resources.clear()
+    embeddings = DeterministicFakeEmbedding(size=32)
+    monkeypatch.setattr(resources, "get_embeddings", lambda *args, **kwargs: embeddings)
+    # Forked workers inherit the loaders patched in by a test
+    monkeypatch.setattr(resources, "worker_context", lambda: multiprocessing.get_context("fork"))
+    (tmp_path / "data").mkdir()
+    yield tmp_path
+    resources.clear()
+
+
+def write(path, text):
+    path.write_text(text)
+    return str(path)
+
+
+def load_in_thread(manager, files):
+    """Runs _load_and_split_files on a background thread, as indexing jobs do."""
+    results = {}
+
+    def run():
+        start = time.monotonic()
+        try:
+            results["files"] = [(file, chunks if chunks is None else list(chunks))
+                                for file, chunks in manager._load_and_split_files(files)]
+        except Exception as e:
+            results["error"] = e
+        results["seconds"] = time.monotonic() - start
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    thread.join(30)
+    return results
+
+
+@pytest.mark.parametrize("load_workers", [1, 4])
+def test_file_timeout_applies_off_the_main_thread(workdir, monkeypatch, load_workers):
+    monkeypatch.setattr(vectorstore_manager, "get_loader", HangingLoader)
+    manager = VectorStoreManager(cache_dir="cache", load_workers=load_workers, file_timeout=1)
+    results = load_in_thread(manager, [write(workdir / "data" / "hangs.txt", "text")])
+    assert results["seconds"] < 5
+    assert [chunks for _, chunks in results["files"]] == [None]
+
+
+def test_streamed_file_timeout(workdir, monkeypatch):
+    monkeypatch.setattr(vectorstore_manager, "get_loader", HangingLoader)
+    manager = VectorStoreManager(cache_dir="cache", load_workers=1, file_timeout=1, stream_threshold_bytes=1)
+    results = load_in_thread(manager, [write(workdir / "data" / "hangs.txt", "text")])
+    assert results["seconds"] < 5
+    assert isinstance(results["error"], TimeoutError)
+
+
+@pytest.mark.parametrize("stream_threshold_bytes", [1, 1 << 20])
+def test_timed_loads_still_return_chunks(workdir, stream_threshold_bytes):
+    manager = VectorStoreManager(cache_dir="cache", load_workers=1, file_timeout=10,
+                                 stream_threshold_bytes=stream_threshold_bytes)
+    results = load_in_thread(manager, [write(workdir / "data" / "notes.txt", "Paris is the capital of France.")])
+    [(_, chunks)] = results["files"]
+    assert [chunk.page_content for chunk in chunks] == ["Paris is the capital of France."]
+
+
+class InlinePool:
+    """Stands in for the process pool and records how many files were submitted."""
+
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, fn, file, *args):
+        from concurrent.futures import Future
+        self.submitted.append(file)
+        future = Future()
+        future.set_result(fn(file, *args))
+        return future
+
+
+def test_only_a_few_files_are_loaded_ahead(workdir, monkeypatch):
+    pool = InlinePool()
+    monkeypatch.setattr(resources, "get_load_pool", lambda workers: pool)
+    manager = VectorStoreManager(cache_dir="cache", load_workers=2)
+    files = [write(workdir / "data" / f"doc{i}.txt", f"Document number {i}.") for i in range(20)]
+    loads = manager._load_and_split_files(files)
+    seen = []
+    for file, chunks in loads:
+        seen.append(file)
+        assert len(pool.submitted) <= len(seen) + 2 * manager.load_workers
+    assert seen == files and pool.submitted == files
+
+
+class BreaksAfterOnePage:
+    """Loader of a large file whose parser fails after its first page."""
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+
+    def lazy_load(self):
+        yield Document(page_content="The first page loads fine.", metadata={"source": self.file_path})
+        raise ValueError("corrupt page")
+
+
+def test_hnsw_update_rebuilds_the_index_once(workdir, monkeypatch):
+    def loader(file_path):
+        return BreaksAfterOnePage(file_path) if "broken" in file_path else vectorstore_manager.TextLoader(file_path)
+
+    monkeypatch.setattr(vectorstore_manager, "get_loader", loader)
+    data = workdir / "data"
+    files = [write(data / f"doc{i}.txt", f"Document number {i}.") for i in range(3)]
+    manager = VectorStoreManager(cache_dir="cache", load_workers=1, file_timeout=0, index_type="hnsw",
+                                 embed_batch_size=1, stream_threshold_bytes=1 << 20)
+    manager.load_or_create_vectorstore(files)
+    rebuilds = []
+    original = VectorStoreManager._rebuild_index
+    monkeypatch.setattr(VectorStoreManager, "_rebuild_index",
+                        lambda self, *args, **kwargs: rebuilds.append(args) or original(self, *args, **kwargs))
+
+    # One changed file and one large file that fails part-way, after its first chunk was embedded
+    write(data / "doc1.txt", "Document number one, revised.")
+    broken = write(data / "broken.txt", "x" * 64)
+    manager.stream_threshold_bytes = 32
+    vectorstore = manager.load_or_create_vectorstore(files + [broken])
+
+    assert len(rebuilds) == 1
+    texts = {doc.page_content for doc in vectorstore.docstore.mget(list(vectorstore.index_to_docstore_id.values()))}
+    assert len(vectorstore.docstore) == 3
+    assert texts == {"Document number 0.", "Document number one, revised.", "Document number 2."}
+    assert vectorstore.index.ntotal == len(vectorstore.index_to_docstore_id) == 3
+
+
+def test_auto_index_type_uses_ivf_for_large_corpora(workdir):
+    manager = VectorStoreManager(cache_dir="cache", ann_threshold=1_000, ivf_threshold=100_000)
+    assert manager._desired_index_spec(500, 384) == "Flat"
+    assert manager._desired_index_spec(50_000, 384).endswith(",Flat")
+    assert ",PQ" in manager._desired_index_spec(200_000, 384)
+
+
+def assert_index_matches_docstore(vectorstore, embeddings):
+    """Every docstore id sits at its own position, and a search for its vector finds it there."""
+    index = vectorstore.index
+    assert index.ntotal == len(vectorstore.index_to_docstore_id) == len(vectorstore.docstore._dict)
+    assert set(vectorstore.index_to_docstore_id.values()) == set(vectorstore.docstore._dict)
+    ivf = faiss.extract_index_ivf(index)
+    ivf.nprobe = ivf.nlist
+    ivf.make_direct_map()
+    positions = sorted(vectorstore.index_to_docstore_id)
+    texts = [vectorstore.docstore.search(vectorstore.index_to_docstore_id[p]).page_content for p in positions]
+    # Encoding is deterministic, so the stored code of each position is that of its chunk's vector
+    vectors = np.asarray(embeddings.embed_documents(texts), dtype=np.float32)
+    stored = index.reconstruct_n(0, index.ntotal)
+    np.testing.assert_allclose(stored, index.sa_decode(index.sa_encode(vectors)), atol=1e-5)
+    distances, found = index.search(stored, 3)
+    for position in positions:
+        assert position in found[position][distances[position] < 1e-4]
+
+
+@pytest.mark.parametrize("index_type", ["ivf_flat", "ivf_pq"])
+def test_ivf_delete_then_add_keeps_ids_consistent(workdir, index_type):
+    embeddings = resources.get_embeddings()
+    manager = VectorStoreManager(cache_dir="cache", index_type=index_type, nlist=4)
+    texts = [f"Chunk number {i}." for i in range(400)]
+    vectorstore = FAISS.from_texts(texts, embeddings, ids=[f"id{i}" for i in range(400)])
+    vectorstore = manager._rebuild_index(vectorstore, manager._desired_index_spec(400, 32))
+    assert manager._index_spec.startswith("IVF")
+
+    vectorstore = manager._delete_vectors(vectorstore, [f"id{i}" for i in range(0, 400, 3)])
+    vectorstore.add_texts([f"New chunk {i}." for i in range(50)], ids=[f"new{i}" for i in range(50)])
+    vectorstore = manager._delete_vectors(vectorstore, ["id1", "new0", "new49"])
+
+    assert vectorstore.index.ntotal == 400 - 134 + 50 - 3
+    assert_index_matches_docstore(vectorstore, embeddings)
+
+
+class BrokenLoader:
+    """Loader of a file that cannot be parsed."""
+
+    calls = 0
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+
+    def load(self):
+        BrokenLoader.calls += 1
+        raise ValueError("not a text file")
+
+
+def test_updates_reindex_only_the_files_that_changed(workdir, monkeypatch):
+    def loader(file_path):
+        return BrokenLoader(file_path) if "broken" in file_path else vectorstore_manager.TextLoader(file_path)
+
+    monkeypatch.setattr(vectorstore_manager, "get_loader", loader)
+    data = workdir / "data"
+    a, b, c = (write(data / f"{name}.txt", f"Document {name}.") for name in "abc")
+    manager = VectorStoreManager(cache_dir="cache", load_workers=1, file_timeout=0)
+    manager.load_or_create_vectorstore([a, b, c])
+    first = manager._load_manifest()
+    first_version = manager.index_version
+    assert sorted(first) == [a, b, c] and all(entry["ids"] for entry in first.values())
+
+    # Touched but unchanged: the new stat is recorded and nothing is re-indexed
+    os.utime(a, (first[a]["mtime"] + 10, first[a]["mtime"] + 10))
+    manager.load_or_create_vectorstore([a, b, c])
+    touched = manager._load_manifest()
+    assert touched[a]["mtime"] == first[a]["mtime"] + 10 and touched[a]["ids"] == first[a]["ids"]
+    assert manager.index_version == first_version and manager.replaced_index_version is None
+
+    # c changed in place: only its vectors are replaced, and answers for the old version are stale
+    write(data / "c.txt", "Document c, revised.")
+    manager.load_or_create_vectorstore([a, b, c])
+    changed = manager._load_manifest()
+    assert [changed[file]["ids"] == first[file]["ids"] for file in (a, b, c)] == [True, True, False]
+    assert manager.replaced_index_version == first_version != manager.index_version
+
+    # b changed, c removed, d added and a broken file added; a is re-used, not re-embedded
+    write(data / "b.txt", "Document b, revised.")
+    d = write(data / "d.txt", "Document d.")
+    broken = write(data / "broken.txt", "garbage")
+    vectorstore = manager.load_or_create_vectorstore([a, b, d, broken])
+    manifest = manager._load_manifest()
+    assert sorted(manifest) == sorted([a, b, d, broken])
+    assert manifest[a]["ids"] == first[a]["ids"]
+    assert manifest[b]["ids"] and set(manifest[b]["ids"]).isdisjoint(first[b]["ids"])
+    assert manifest[broken]["ids"] == [] and "not a text file" in manifest[broken]["error"]
+    # A new document set starts from a copy of the overlapping index, which keeps its own version
+    assert manager.index_version != first_version and manager.replaced_index_version is None
+    ids = [doc_id for entry in manifest.values() for doc_id in entry["ids"]]
+    assert sorted(vectorstore.index_to_docstore_id.values()) == sorted(ids) and len(vectorstore.docstore) == len(ids)
+    assert sorted(doc.page_content for doc in vectorstore.docstore.mget(ids)) == [
+        "Document a.", "Document b, revised.", "Document d.",
+    ]
+
+    # The failed file is not retried until its content changes
+    calls = BrokenLoader.calls
+    version = manager.index_version
+    manager.load_or_create_vectorstore([a, b, d, broken])
+    assert BrokenLoader.calls == calls and manager.index_version == version
+
+
+def test_saved_stores_are_read_in_place_and_never_modified(workdir):
+    data = workdir / "data"
+    files = [write(data / f"doc{i}.txt", f"Document number {i}.") for i in range(3)]
+    manager = VectorStoreManager(cache_dir="cache", load_workers=1, file_timeout=0)
+    manager.load_or_create_vectorstore(files)
+    old = manager.load_or_create_vectorstore(files)
+    old_keywords = manager.keyword_index
+    old_ids = dict(old.index_to_docstore_id)
+
+    write(data / "doc1.txt", "Document number one, revised.")
+    new = manager.load_or_create_vectorstore(files)
+
+    # The index loaded before the update still finds its own chunks, in the old file
+    assert [doc.page_content for doc in old.docstore.mget(list(old_ids.values()))] == [
+        "Document number 0.", "Document number 1.", "Document number 2.",
+    ]
+    assert [doc_id for doc_id, _ in old_keywords.search("number 1")][:1] == [old_ids[1]]
+    assert "one, revised" in new.docstore.search(manager.keyword_index.search("revised")[0][0]).page_content
+    assert old_keywords.search("revised") == []
+
+
+def test_json_docstore_of_earlier_versions_is_migrated(workdir):
+    files = [write(workdir / "data" / "notes.txt", "Paris is the capital of France.")]
+    manager = VectorStoreManager(cache_dir="cache", load_workers=1, file_timeout=0)
+    vectorstore = manager.load_or_create_vectorstore(files)
+    doc_id = vectorstore.index_to_docstore_id[0]
+    with open(manager.legacy_docstore_file, "w") as f:
+        json.dump({
+            "index_to_docstore_id": [doc_id], "index_spec": "Flat",
+            "docs": {doc_id: {"page_content": "Paris is the capital of France.", "metadata": {"source": files[0]}}},
+        }, f)
+    vectorstore.docstore.close()
+    os.remove(manager.docstore_file)
+
+    vectorstore = manager.load_or_create_vectorstore(files)
+
+    assert vectorstore.docstore.search(doc_id).metadata == {"source": files[0]}
+    assert os.path.exists(manager.docstore_file) and not os.path.exists(manager.legacy_docstore_file)
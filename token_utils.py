@@ -0,0 +1,20 @@
+import math
+
+
+def estimate_tokens(text):
+    """
+    Cheap token estimate for prompt budgeting.
+
+    Uses the common ~4 characters per token rule of thumb for English text, which is
+    close enough for budgeting without loading a tokenizer or calling the Gemini API.
+    """
+    if not text:
+        return 0
+    return math.ceil(len(text) / 4)
+
+
+def truncate_to_tokens(text, max_tokens):
+    """Cut `text` so that its estimated size fits in `max_tokens`."""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    return text[:max(max_tokens, 0) * 4]
@@ -0,0 +1,324 @@
+"""
+Lightweight in-process tracing: nested timing spans, counters and histograms.
+
+Every finished span is observed in the `span_seconds` histogram (labelled by span name) and kept
+in a bounded buffer of recent spans; with an export file, spans are also appended to it as JSON
+lines. Metrics can be dumped as JSON or served in Prometheus text format. Request spans can be
+profiled with a sampling profiler whose stacks are written out when the request is slow.
+
+Configuration from the environment (see `Tracer.configure_from_env`):
+    RAG_TRACE_FILE       append finished spans to this JSONL file
+    RAG_SLOW_REQUEST_MS  profile requests and keep the profiles of those slower than this
+    RAG_PROFILE_DIR      where slow-request profiles go (default: traces)
+    RAG_METRICS_PORT     serve /metrics (Prometheus text) and /metrics.json on this local port
+"""
+import contextvars
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+_span_ids = itertools.count(1)
+
+
+class Span:
+    __slots__ = ("name", "attrs", "span_id", "parent_id", "trace_id", "start_time", "duration")
+
+    def __init__(self, name, attrs, parent):
+        self.name = name
+        self.attrs = attrs
+        self.span_id = next(_span_ids)
+        self.parent_id = parent.span_id if parent is not None else None
+        self.trace_id = parent.trace_id if parent is not None else self.span_id
+        self.start_time = time.time()
+        self.duration = None
+
+    def set(self, **attrs):
+        """Attach attributes (e.g. sizes or hit/miss flags) to the span."""
+        self.attrs.update(attrs)
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start_time": self.start_time,
+            "duration_ms": round(self.duration * 1000, 3) if self.duration is not None else None,
+            "attrs": self.attrs,
+        }
+
+
+class SamplingProfiler:
+    """Samples one thread's Python stack at a fixed interval and counts the collapsed stacks."""
+
+    def __init__(self, thread_id, interval=0.005, max_depth=64):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.max_depth = max_depth
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            frames = []
+            while frame is not None and len(frames) < self.max_depth:
+                code = frame.f_code
+                frames.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+                frame = frame.f_back
+            if frames:
+                self.stacks[";".join(reversed(frames))] += 1
+
+    def write(self, path):
+        """Write the samples in collapsed-stack format, as read by flamegraph.pl and speedscope."""
+        with open(path, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"') for _, value in labels)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + "}"
+
+
+class Tracer:
+    def __init__(self, max_spans=1000, buckets=DEFAULT_BUCKETS, prefix="rag_"):
+        self.buckets = buckets
+        self.prefix = prefix
+        self.slow_request_ms = None
+        self.profile_dir = "traces"
+        self.sample_interval = 0.005
+        self._spans = deque(maxlen=max_spans)
+        # (name, sorted label items) -> value / [bucket counts..., sum, count]
+        self._counters = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+        self._export_file = None
+        self._server = None
+
+    def configure(self, export_path=None, slow_request_ms=None, profile_dir=None, sample_interval=None):
+        """
+        Args:
+            export_path (str, optional): Append every finished span to this JSONL file.
+            slow_request_ms (float, optional): Profile request spans; keep profiles slower than this.
+            profile_dir (str, optional): Directory for slow-request profiles.
+            sample_interval (float, optional): Seconds between profiler samples.
+        """
+        with self._lock:
+            if self._export_file is not None:
+                self._export_file.close()
+                self._export_file = None
+            if export_path:
+                os.makedirs(os.path.dirname(export_path) or ".", exist_ok=True)
+                # Line-buffered, so each span reaches the file as soon as it finishes
+                self._export_file = open(export_path, "a", buffering=1)
+        self.slow_request_ms = slow_request_ms
+        if profile_dir is not None:
+            self.profile_dir = profile_dir
+        if sample_interval is not None:
+            self.sample_interval = sample_interval
+        return self
+
+    def configure_from_env(self):
+        """Apply the RAG_* environment variables listed in the module docstring."""
+        slow_ms = os.getenv("RAG_SLOW_REQUEST_MS")
+        self.configure(
+            export_path=os.getenv("RAG_TRACE_FILE"),
+            slow_request_ms=float(slow_ms) if slow_ms else None,
+            profile_dir=os.getenv("RAG_PROFILE_DIR"),
+        )
+        port = os.getenv("RAG_METRICS_PORT")
+        if port and self._server is None:
+            self.serve_metrics(int(port))
+        return self
+
+    # --- Metrics ---
+
+    def incr(self, name, value=1, **labels):
+        """Add `value` to the counter `name`."""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        """Record `value` in the histogram `name`."""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram[i] += 1
+            histogram[-2] += value
+            histogram[-1] += 1
+
+    # --- Spans ---
+
+    @contextmanager
+    def span(self, name, **attrs):
+        """Time the enclosed block as span `name`, nested under the current span if any."""
+        span = Span(name, attrs, _current_span.get())
+        token = _current_span.set(span)
+        start = time.perf_counter()
+        try:
+            yield span
+        except BaseException as e:
+            span.attrs["error"] = type(e).__name__
+            raise
+        finally:
+            span.duration = time.perf_counter() - start
+            try:
+                _current_span.reset(token)
+            except ValueError:
+                # A generator span finalised from another context; nothing to restore there
+                pass
+            self._finish(span)
+
+    def record(self, name, seconds, **attrs):
+        """Record a span that was timed elsewhere (e.g. in a worker process)."""
+        span = Span(name, attrs, _current_span.get())
+        span.duration = seconds
+        self._finish(span)
+
+    @contextmanager
+    def request(self, name, **attrs):
+        """
+        Root span of one request. With `slow_request_ms` set, the request's thread is sampled
+        while it runs, and the profile is written to `profile_dir` if the request was slow.
+        """
+        profiler = None
+        if self.slow_request_ms is not None:
+            profiler = SamplingProfiler(threading.get_ident(), self.sample_interval)
+            profiler.start()
+        self.incr("requests_total", request=name)
+        try:
+            with self.span(name, **attrs) as span:
+                yield span
+        finally:
+            if profiler is not None:
+                profiler.stop()
+                if span.duration * 1000 >= self.slow_request_ms:
+                    self._write_profile(span, profiler)
+
+    def _write_profile(self, span, profiler):
+        os.makedirs(self.profile_dir, exist_ok=True)
+        path = os.path.join(
+            self.profile_dir,
+            f"{span.name}-{time.strftime('%Y%m%d-%H%M%S')}-{span.trace_id}-{span.duration * 1000:.0f}ms.folded",
+        )
+        profiler.write(path)
+        self.incr("slow_requests_total", request=span.name)
+        print(f"[WARNING] Slow request {span.name}: {span.duration * 1000:.0f}ms, profile written to {path}")
+
+    def _finish(self, span):
+        self.observe("span_seconds", span.duration, span=span.name)
+        record = span.to_dict()
+        with self._lock:
+            self._spans.append(record)
+            if self._export_file is not None:
+                self._export_file.write(json.dumps(record, default=str) + "\n")
+
+    # --- Export ---
+
+    def recent_spans(self, trace_id=None):
+        with self._lock:
+            spans = list(self._spans)
+        return [span for span in spans if trace_id is None or span["trace_id"] == trace_id]
+
+    def snapshot(self):
+        """Counters, histograms and recent spans as JSON-serialisable data."""
+        with self._lock:
+            counters = [
+                {"name": name, "labels": dict(labels), "value": value}
+                for (name, labels), value in self._counters.items()
+            ]
+            histograms = [
+                {
+                    "name": name, "labels": dict(labels), "count": values[-1], "sum": values[-2],
+                    "buckets": dict(zip(map(str, self.buckets), values[:-2])),
+                }
+                for (name, labels), values in self._histograms.items()
+            ]
+            spans = list(self._spans)
+        return {"counters": counters, "histograms": histograms, "spans": spans}
+
+    def export_json(self, path):
+        with open(path, "w") as f:
+            json.dump(self.snapshot(), f, indent=2, default=str)
+
+    def prometheus_text(self):
+        """Counters and histograms in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(self._histograms.items())
+        typed = set()
+        for (name, labels), value in counters:
+            metric = self.prefix + name
+            if metric not in typed:
+                lines.append(f"# TYPE {metric} counter")
+                typed.add(metric)
+            lines.append(f"{metric}{_format_labels(labels)} {value}")
+        for (name, labels), values in histograms:
+            metric = self.prefix + name
+            if metric not in typed:
+                lines.append(f"# TYPE {metric} histogram")
+                typed.add(metric)
+            for bound, count in zip(self.buckets, values[:-2]):
+                lines.append(f"{metric}_bucket{_format_labels(labels + (('le', bound),))} {count}")
+            lines.append(f"{metric}_bucket{_format_labels(labels + (('le', '+Inf'),))} {values[-1]}")
+            lines.append(f"{metric}_sum{_format_labels(labels)} {values[-2]}")
+            lines.append(f"{metric}_count{_format_labels(labels)} {values[-1]}")
+        return "\n".join(lines) + "\n"
+
+    def serve_metrics(self, port=9464, host="127.0.0.1"):
+        """Serve /metrics (Prometheus text) and /metrics.json from a background thread."""
+        tracer = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == "/metrics":
+                    body, content_type = tracer.prometheus_text(), "text/plain; version=0.0.4"
+                elif self.path == "/metrics.json":
+                    body, content_type = json.dumps(tracer.snapshot(), default=str), "application/json"
+                else:
+                    self.send_error(404)
+                    return
+                payload = body.encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), MetricsHandler)
+        threading.Thread(target=self._server.serve_forever, name="metrics-server", daemon=True).start()
+        print(f"[INFO] Serving metrics on http://{host}:{port}/metrics")
+        return self._server
+
+
+# Process-wide tracer used by all modules
+tracer = Tracer()
@@ -0,0 +1,37 @@
+import hashlib
+import os
+
+
+def content_hash(data):
+    """Hex SHA-256 of a bytes-like object."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def store_upload(name, data, root=os.path.join("data", "uploads")):
+    """
+    Store an uploaded file by content hash and return its path.
+
+    Files live at `<root>/<sha256>/<name>`, so identical content is written once no matter how
+    often it is uploaded, and re-running the app never touches (or bumps the mtime of) a file
+    that already exists. The original name is kept for the loader's extension and the sources.
+
+    Args:
+        name (str): The uploaded file's name.
+        data (bytes-like): The file content.
+        root (str): Directory holding the stored uploads.
+
+    Returns:
+        str: Path of the stored file.
+    """
+    digest = content_hash(data)
+    path = os.path.join(root, digest, os.path.basename(name))
+    if os.path.exists(path):
+        return path
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Write to a temp file and rename, so a concurrent reader never sees a partial upload
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+    print(f"[INFO] Stored upload {name} as {digest[:12]}")
+    return path
@@ -1,135 +1,964 @@
+import hashlib
+import itertools
+import json
+import math
 import os
-import pickle
+import queue
+import random
+import shutil
+import signal
+import threading
+import time
+import uuid
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+import faiss
+import numpy as np
+from langchain_core.documents import Document
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_community.vectorstores import FAISS
-from langchain_community.embeddings import HuggingFaceEmbeddings
 from langchain_community.document_loaders import PyPDFLoader, TextLoader, UnstructuredFileLoader
+from embedding_cache import EmbeddingCache
+from keyword_index import KeywordIndex
+from sqlite_store import SQLiteDocstore
+from file_lock import file_lock, LockUnavailable
+from tracing import tracer
+import resources
 
 
 
+def get_loader(file_path):
+    """Selects the appropriate LangChain DocumentLoader based on file extension."""
+    extension = os.path.splitext(file_path)[1].lower()
+
+    # Mapping common extensions to specific loaders
+    loader_map = {
+        ".pdf": PyPDFLoader,
+        ".txt": TextLoader,
+        ".sql": TextLoader,  # Example: Treating SQL files as text
+        ".csv": UnstructuredFileLoader,
+        ".docx": UnstructuredFileLoader,
+        ".pptx": UnstructuredFileLoader,
+    }
+
+    # Default to UnstructuredFileLoader for maximum compatibility
+    Loader = loader_map.get(extension, UnstructuredFileLoader)
+    return Loader(file_path)
+
+
+def _raise_timeout(signum, frame):
+    raise TimeoutError("file loading timed out")
+
+
+def load_and_split_file(file, chunk_size=1000, chunk_overlap=200, timeout=None):
+    """
+    Load one file and split it into chunks. Module-level so it can run in a worker process.
+
+    Returns:
+        tuple: (chunks, number of loaded documents, loader class name, error or None,
+            {"load": seconds, "split": seconds}).
+    """
+    # SIGALRM interrupts a stuck loader inside the worker (Unix main thread only)
+    use_alarm = bool(timeout) and hasattr(signal, "SIGALRM") and threading.current_thread() is threading.main_thread()
+    if use_alarm:
+        previous_handler = signal.signal(signal.SIGALRM, _raise_timeout)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    loader_name = None
+    # Timed here because worker processes cannot record spans in the parent's tracer
+    timings = {}
+    try:
+        start = time.perf_counter()
+        loader = get_loader(file)
+        loader_name = loader.__class__.__name__
+        docs = loader.load()
+        timings["load"] = time.perf_counter() - start
+        # start_index lets the context builder merge overlapping neighbours of a retrieved chunk
+        splitter = RecursiveCharacterTextSplitter(
+            chunk_size=chunk_size, chunk_overlap=chunk_overlap, add_start_index=True
+        )
+        start = time.perf_counter()
+        chunks = splitter.split_documents(docs)
+        timings["split"] = time.perf_counter() - start
+        return chunks, len(docs), loader_name, None, timings
+    except Exception as e:
+        if isinstance(e, TimeoutError):
+            e = f"timed out after {timeout}s"
+        return None, 0, loader_name, e, timings
+    finally:
+        if use_alarm:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, previous_handler)
+
+
+def stream_file_chunks(file, chunk_size, chunk_overlap, out):
+    """
+    Load `file` page by page in a worker process and put each page's chunks on the `out` queue.
+
+    Puts ("chunks", chunks, load seconds, split seconds) per page, then ("done", None) or
+    ("done", error message).
+    """
+    try:
+        loader = get_loader(file)
+        splitter = RecursiveCharacterTextSplitter(
+            chunk_size=chunk_size, chunk_overlap=chunk_overlap, add_start_index=True
+        )
+        pages = loader.lazy_load()
+        while True:
+            start = time.perf_counter()
+            doc = next(pages, None)
+            load_seconds = time.perf_counter() - start
+            if doc is None:
+                break
+            start = time.perf_counter()
+            chunks = splitter.split_documents([doc])
+            out.put(("chunks", chunks, load_seconds, time.perf_counter() - start))
+        out.put(("done", None))
+    except Exception as e:
+        out.put(("done", f"{type(e).__name__}: {e}"))
+
+
 class VectorStoreManager:
-    def __init__(self, cache_dir="faiss_cache"):
+    def __init__(self, cache_dir="faiss_cache", model_name="sentence-transformers/all-MiniLM-L6-v2", max_indexes=8,
+                 load_workers=None, file_timeout=300, chunk_size=1000, chunk_overlap=200,
+                 embed_batch_size=64, embed_threads=None, normalize_embeddings=False,
+                 stream_threshold_bytes=20 * 1024 * 1024, index_type="auto", nprobe=16, ef_search=64,
+                 hnsw_m=32, nlist=None, ann_threshold=50_000, ivf_threshold=1_000_000, train_size=100_000):
         self.cache_dir = cache_dir
-        os.makedirs(self.cache_dir, exist_ok=True)
-        self.cache_file = os.path.join(self.cache_dir, "kb_index.pkl")
-        # --- START: Change 3 (Rename metadata file) ---
-        self.metadata_file = os.path.join(self.cache_dir, "file_metadata.pkl") 
+        self.model_name = model_name
+        self.max_indexes = max_indexes
+        # Loading and splitting are CPU-bound, so they run in a process pool (1 = in-process)
+        self.load_workers = load_workers if load_workers is not None else (os.cpu_count() or 1)
+        self.file_timeout = file_timeout
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        # Chunks per embedding batch and torch intra-op threads (default: all cores)
+        self.embed_batch_size = embed_batch_size
+        self.embed_threads = embed_threads
+        self.normalize_embeddings = normalize_embeddings
+        # Files at least this large are streamed page by page instead of loaded whole
+        self.stream_threshold_bytes = stream_threshold_bytes
+        self.progress_callback = None
+        # Index type: "flat", "hnsw", "ivf_flat", "ivf_pq", or "auto" to choose by corpus size.
+        # nprobe / ef_search trade recall for speed at query time.
+        # "auto" never picks HNSW: faiss cannot delete from it, so every changed file would rebuild it
+        self.index_type = index_type
+        self.nprobe = nprobe
+        self.ef_search = ef_search
+        self.hnsw_m = hnsw_m
+        self.nlist = nlist
+        self.ann_threshold = ann_threshold
+        self.ivf_threshold = ivf_threshold
+        self.train_size = train_size
+        self._index_spec = "Flat"
+        # Shared by all document sets, so identical chunks are only embedded once
+        self.embedding_cache = EmbeddingCache(cache_dir)
+        # One index directory per document set, so sessions with different uploads never
+        # rebuild or overwrite each other's index
+        self.indexes_dir = os.path.join(self.cache_dir, "indexes")
+        os.makedirs(self.indexes_dir, exist_ok=True)
+        # Pickled caches written by earlier versions, which kept a single global index
+        self.legacy_files = [
+            os.path.join(self.cache_dir, name)
+            for name in ("kb_index.pkl", "file_metadata.pkl", "file_manifest.pkl")
+        ]
+        self.index_dir = None
+        # Identifies the contents of the last loaded index; answers cached against an
+        # older version are stale once the index is updated
+        self.index_version = None
+        self.replaced_index_version = None
+        # BM25 index over the same chunks, for keyword and hybrid retrieval
+        self.keyword_index = None
+        # file -> error message, for files that failed to load during the last update
+        self._load_errors = {}
+
+    @staticmethod
+    def _document_set_fingerprint(files):
+        """Identifies a document set by its (normalised) file paths, independent of their order."""
+        paths = sorted({os.path.abspath(file) for file in files})
+        return hashlib.sha256("\n".join(paths).encode("utf-8")).hexdigest()[:16]
+
+    def _use_index_dir(self, files):
+        """Point the cache file paths at the index directory of this document set."""
+        fingerprint = self._document_set_fingerprint(files)
+        self.index_dir = os.path.join(self.indexes_dir, fingerprint)
+        self.lock_file = os.path.join(self.indexes_dir, f"{fingerprint}.lock")
+        # Native FAISS index plus SQLite docstore and BM25 index; no pickles, so caches are safe
+        # to load, and chunks are read by id as searches return them instead of all at startup
+        self.index_file = os.path.join(self.index_dir, "kb_index.faiss")
+        self.docstore_file = os.path.join(self.index_dir, "kb_docstore.sqlite")
+        # Per-file manifest: {file: {"sha256": str, "size": int, "mtime": float, "ids": [docstore ids]}}
+        self.manifest_file = os.path.join(self.index_dir, "file_manifest.json")
+        self.keyword_file = os.path.join(self.index_dir, "kb_keywords.sqlite")
+        self.last_used_file = os.path.join(self.index_dir, "last_used")
+        # JSON docstore and keyword index written by earlier versions; the docstore is migrated on load
+        self.legacy_docstore_file = os.path.join(self.index_dir, "kb_docstore.json")
+        self.legacy_keyword_file = os.path.join(self.index_dir, "kb_keywords.json")
+
+    def _seed_from_overlapping_index(self, files):
+        """
+        Start a new document set's index from a copy of the cached index sharing most of its files.
+
+        Adding or removing one upload changes the document set, and a changed upload gets a new
+        path; the manifest diff then only loads the new files and deletes the missing ones instead
+        of re-indexing everything. Returns whether an index was copied.
+        """
+        wanted = set(files)
+        best = None
+        for name in os.listdir(self.indexes_dir):
+            path = os.path.join(self.indexes_dir, name)
+            manifest_file = os.path.join(path, "file_manifest.json")
+            if path == self.index_dir or not os.path.exists(os.path.join(path, "kb_index.faiss")):
+                continue
+            try:
+                with open(manifest_file, "r") as f:
+                    manifest = json.load(f)
+            except (OSError, ValueError):
+                continue
+            shared = sum(1 for file, entry in manifest.items() if file in wanted and entry.get("ids"))
+            # Most shared files first, then the fewest files to delete
+            if shared and (best is None or (shared, -len(manifest)) > best[:2]):
+                best = (shared, -len(manifest), name, path)
+        if best is None:
+            return False
+        shared, _, name, path = best
+        try:
+            # Never copy an index while another session or process is updating it
+            with file_lock(os.path.join(self.indexes_dir, f"{name}.lock"), blocking=False):
+                os.makedirs(self.index_dir, exist_ok=True)
+                targets = (self.index_file, self.docstore_file, self.keyword_file, self.manifest_file,
+                           self.legacy_docstore_file)
+                for target in targets:
+                    source = os.path.join(path, os.path.basename(target))
+                    if os.path.exists(source):
+                        shutil.copyfile(source, target)
+        except LockUnavailable:
+            return False
+        print(f"[INFO] Seeded index from cached index {name} sharing {shared} file(s)")
+        return True
+
+    def _evict_old_indexes(self):
+        """Delete the least recently used document-set indexes beyond `max_indexes`."""
+        candidates = []
+        for name in os.listdir(self.indexes_dir):
+            path = os.path.join(self.indexes_dir, name)
+            if not os.path.isdir(path) or path == self.index_dir:
+                continue
+            last_used = os.path.join(path, "last_used")
+            candidates.append((os.path.getmtime(last_used) if os.path.exists(last_used) else 0, name, path))
+        candidates.sort()
+        # The current index counts towards the limit
+        excess = len(candidates) + 1 - self.max_indexes
+        for _, name, path in candidates[:max(excess, 0)]:
+            try:
+                # Never delete an index another session or process is building
+                with file_lock(os.path.join(self.indexes_dir, f"{name}.lock"), blocking=False):
+                    shutil.rmtree(path, ignore_errors=True)
+                    print(f"[INFO] Evicted least recently used index {name}")
+            except LockUnavailable:
+                continue
+
+    @staticmethod
+    def _file_sha256(file, block_size=1 << 20):
+        digest = hashlib.sha256()
+        with open(file, "rb") as f:
+            for block in iter(lambda: f.read(block_size), b""):
+                digest.update(block)
+        return digest.hexdigest()
 
     # --- START: Change 3 (Rename and generalize function) ---
-    def _get_file_metadata(self, files):
-        """Return a dictionary of {file: last_modified_time} for existing files"""
+    def _get_file_metadata(self, files, manifest=None):
+        """
+        Return {file: {"sha256", "size", "mtime"}} for existing files.
+
+        Change detection uses the content hash; size and mtime only let us reuse the hash stored
+        in `manifest` instead of re-reading files whose stat has not changed.
+        """
+        manifest = manifest or {}
+        metadata = {}
         # Filter for existing files to prevent errors if a file was deleted
-        return {file: os.path.getmtime(file) for file in files if os.path.exists(file)}
-
-    def _has_file_changed(self, files):
-        """Check if files have changed since last cache"""
-        current_metadata = self._get_file_metadata(files)
-        # --- END: Change 3 ---
-        if not os.path.exists(self.metadata_file):
-            return True  # no previous metadata
-        
+        for file in files:
+            if not os.path.exists(file):
+                continue
+            stat = os.stat(file)
+            entry = manifest.get(file, {})
+            if entry.get("sha256") and entry.get("size") == stat.st_size and entry.get("mtime") == stat.st_mtime:
+                sha256 = entry["sha256"]
+            else:
+                sha256 = self._file_sha256(file)
+            metadata[file] = {"sha256": sha256, "size": stat.st_size, "mtime": stat.st_mtime}
+        return metadata
+    # --- END: Change 3 ---
+
+
+    def _load_manifest(self):
+        """Load the per-file manifest, returning an empty one if missing or unreadable."""
+        if not os.path.exists(self.manifest_file):
+            return {}
         try:
-            with open(self.metadata_file, "rb") as f:
-                cached_metadata = pickle.load(f)
+            with open(self.manifest_file, "r") as f:
+                return json.load(f)
         except Exception:
-            # If loading fails (e.g., file corrupted or format change), assume change
-            return True
-            
-        # Compare metadata
-        return cached_metadata != current_metadata
+            # If loading fails (e.g., file corrupted or format change), start from scratch
+            return {}
+
+    def _save_manifest(self, manifest):
+        self._write_json(self.manifest_file, manifest)
+
+    @staticmethod
+    def _write_json(path, data):
+        # Write to a temp file and rename, so readers never see a half-written file
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(data, f, default=str)
+        os.replace(tmp_path, path)
+
+    def _load_vectorstore(self, mmap=True):
+        """
+        Load the native FAISS index and open its SQLite docstore.
+
+        With `mmap`, the index is memory-mapped read-only so startup does not copy it into RAM
+        and processes share its pages. A mapped index must not be modified, so callers that
+        add or delete vectors load it with `mmap=False`. Chunks stay on disk either way.
+        """
+        with tracer.span("index.cache_load", mmap=mmap):
+            if not os.path.exists(self.docstore_file) and os.path.exists(self.legacy_docstore_file):
+                self._migrate_json_docstore()
+            if mmap:
+                flags = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+                index = faiss.read_index(self.index_file, flags)
+            else:
+                index = faiss.read_index(self.index_file)
+            docstore = SQLiteDocstore(self.docstore_file)
+            self._index_spec = docstore.index_spec()
+            self._apply_search_params(index)
+            index_to_docstore_id = docstore.index_to_docstore_id()
+            if index.ntotal != len(index_to_docstore_id):
+                raise ValueError("FAISS index and docstore are out of sync")
+            # The embedding model is not stored; attach the shared instance
+            return FAISS(self._embeddings(), index, docstore, index_to_docstore_id)
+
+    def _migrate_json_docstore(self):
+        """Convert a JSON docstore written by an earlier version to SQLite."""
+        with open(self.legacy_docstore_file, "r") as f:
+            stored = json.load(f)
+        docstore = SQLiteDocstore()
+        docstore.add({
+            doc_id: Document(id=doc_id, page_content=doc["page_content"], metadata=doc["metadata"])
+            for doc_id, doc in stored["docs"].items()
+        })
+        docstore.save(
+            self.docstore_file, dict(enumerate(stored["index_to_docstore_id"])), stored.get("index_spec", "Flat")
+        )
+        docstore.close()
+        os.remove(self.legacy_docstore_file)
+        print(f"[INFO] Migrated docstore to {self.docstore_file}")
+
+    def _save_vectorstore(self, vectorstore):
+        with tracer.span("index.save", vectors=vectorstore.index.ntotal):
+            tmp_index = self.index_file + ".tmp"
+            faiss.write_index(vectorstore.index, tmp_index)
+            docstore = vectorstore.docstore
+            if not isinstance(docstore, SQLiteDocstore):
+                # A new index starts with LangChain's in-memory docstore
+                docstore = SQLiteDocstore.from_docstore(docstore, list(vectorstore.index_to_docstore_id.values()))
+            # Docstore first: a stale docstore with a new index is caught by the size check on load
+            docstore.save(self.docstore_file, vectorstore.index_to_docstore_id, self._index_spec)
+            os.replace(tmp_index, self.index_file)
+            # From now on chunks are read from the saved file rather than kept in memory
+            vectorstore.docstore = docstore
+
+    def _load_keyword_index(self, vectorstore):
+        """Load the BM25 index saved with `vectorstore`, rebuilding it if it is missing or out of sync."""
+        with tracer.span("index.keyword_load"):
+            return self._read_keyword_index(vectorstore)
+
+    def _read_keyword_index(self, vectorstore):
+        if os.path.exists(self.keyword_file):
+            try:
+                keyword_index = KeywordIndex.load(self.keyword_file)
+                if keyword_index.ids() == set(vectorstore.index_to_docstore_id.values()):
+                    return keyword_index
+            except Exception as e:
+                print(f"[WARNING] Could not load keyword index. Error: {e}")
+        print("[INFO] Rebuilding keyword index from the docstore")
+        keyword_index = KeywordIndex.from_docstore(vectorstore)
+        keyword_index.save(self.keyword_file)
+        if os.path.exists(self.legacy_keyword_file):
+            os.remove(self.legacy_keyword_file)
+        return keyword_index
+
+    def _desired_index_spec(self, n, dim):
+        """
+        The faiss.index_factory spec for `n` vectors of dimension `dim`.
+
+        With index_type "auto": exact Flat search for small corpora, IVF-Flat from `ann_threshold`
+        vectors and compressed IVF-PQ from `ivf_threshold` vectors. Both IVF kinds delete
+        vectors in place, so incremental updates never rebuild the index.
+        """
+        index_type = self.index_type
+        if index_type == "auto":
+            if n < self.ann_threshold:
+                index_type = "flat"
+            elif n < self.ivf_threshold:
+                index_type = "ivf_flat"
+            else:
+                index_type = "ivf_pq"
+
+        if index_type == "flat":
+            return "Flat"
+        if index_type == "hnsw":
+            return f"HNSW{self.hnsw_m}"
+
+        # ~4*sqrt(n) lists, rounded to a power of two so the spec only changes when n quadruples,
+        # and small enough that every list gets ~39 training points as faiss recommends
+        nlist = self.nlist or 2 ** round(math.log2(max(4 * math.sqrt(n), 1)))
+        nlist = max(1, min(nlist, n // 39))
+        if index_type == "ivf_flat":
+            return f"IVF{nlist},Flat"
+        if index_type == "ivf_pq":
+            # PQ needs the dimension to split evenly into sub-quantizers
+            pq_m = next((m for m in (64, 48, 32, 16, 8, 4) if dim % m == 0 and dim // m >= 4), 1)
+            # 2**nbits centroids per sub-quantizer also need ~39 training points each
+            pq_nbits = max(1, min(8, int(math.log2(max(n // 39, 2)))))
+            return f"IVF{nlist},PQ{pq_m}x{pq_nbits}"
+        raise ValueError(f"Unknown index_type: {self.index_type}")
+
+    def _apply_search_params(self, index):
+        """Set the search-time accuracy/speed knobs for IVF (nprobe) and HNSW (efSearch) indexes."""
+        if "IVF" in self._index_spec:
+            faiss.extract_index_ivf(index).nprobe = self.nprobe
+        elif "HNSW" in self._index_spec:
+            index.hnsw.efSearch = self.ef_search
+
+    def _get_vectors(self, vectorstore, positions):
+        """Exact vectors for index positions, reconstructed from the index or re-embedded if it is lossy."""
+        if "PQ" in self._index_spec:
+            texts = [
+                vectorstore.docstore.search(vectorstore.index_to_docstore_id[p]).page_content
+                for p in positions
+            ]
+            cache_key = f"{self.model_name}|normalize={self.normalize_embeddings}"
+            vectors = self.embedding_cache.embed_documents(self._embeddings(), cache_key, texts)
+            return np.asarray(vectors, dtype=np.float32)
+        if "IVF" in self._index_spec:
+            faiss.extract_index_ivf(vectorstore.index).make_direct_map()
+        return vectorstore.index.reconstruct_batch(np.asarray(positions, dtype=np.int64))
+
+    def _rebuild_index(self, vectorstore, spec, exclude_ids=()):
+        """
+        Rebuild the FAISS index as `spec`, optionally dropping `exclude_ids`.
+
+        Used to switch index types and to delete vectors from HNSW indexes, which faiss cannot
+        remove vectors from; an update collects those deletions and rebuilds only once.
+        """
+        with tracer.span("index.build", spec=spec):
+            return self._build_index(vectorstore, spec, exclude_ids)
+
+    def _build_index(self, vectorstore, spec, exclude_ids):
+        start = time.perf_counter()
+        excluded = set(exclude_ids)
+        old_ids = vectorstore.index_to_docstore_id
+        keep_positions = [p for p in range(len(old_ids)) if old_ids[p] not in excluded]
+        index = faiss.index_factory(vectorstore.index.d, spec, faiss.METRIC_L2)
+        if not index.is_trained:
+            sample_size = min(len(keep_positions), self.train_size)
+            sample = sorted(random.Random(0).sample(keep_positions, sample_size))
+            print(f"[INFO] Training {spec} index on {len(sample)} vectors")
+            index.train(self._get_vectors(vectorstore, sample))
+        for i in range(0, len(keep_positions), 10_000):
+            index.add(self._get_vectors(vectorstore, keep_positions[i:i + 10_000]))
+
+        removed = [doc_id for doc_id in old_ids.values() if doc_id in excluded]
+        if removed:
+            vectorstore.docstore.delete(removed)
+        vectorstore.index_to_docstore_id = {i: old_ids[p] for i, p in enumerate(keep_positions)}
+        vectorstore.index = index
+        self._index_spec = spec
+        self._apply_search_params(index)
+        print(f"[INFO] Built {spec} index with {index.ntotal} vectors in {time.perf_counter() - start:.2f}s")
+        return vectorstore
+
+    def _delete_vectors(self, vectorstore, ids):
+        if self._index_spec == "Flat":
+            vectorstore.delete(ids)
+            return vectorstore
+        if "IVF" in self._index_spec:
+            with tracer.span("index.delete", spec=self._index_spec, vectors=len(ids)):
+                return self._remove_from_ivf(vectorstore, ids)
+        return self._rebuild_index(vectorstore, self._index_spec, exclude_ids=ids)
+
+    @staticmethod
+    def _remove_from_ivf(vectorstore, ids):
+        """
+        Delete vectors from an IVF index in place.
+
+        remove_ids leaves gaps in the vector ids, so the remaining ids are renumbered to their new
+        positions: the LangChain wrapper maps contiguous positions to docstore ids, and later adds
+        are numbered from ntotal. Only the ids are rewritten; no vector is re-added or re-trained.
+        """
+        excluded = set(ids)
+        old_ids = vectorstore.index_to_docstore_id
+        removed_positions = np.asarray([p for p, doc_id in old_ids.items() if doc_id in excluded], dtype=np.int64)
+        ivf = faiss.extract_index_ivf(vectorstore.index)
+        # An array direct map (made for reconstruction) cannot remove ids; it is rebuilt when needed
+        ivf.set_direct_map_type(faiss.DirectMap.NoMap)
+        ivf.remove_ids(faiss.IDSelectorBatch(removed_positions))
+
+        keep = np.ones(len(old_ids), dtype=bool)
+        keep[removed_positions] = False
+        new_position = np.cumsum(keep) - 1
+        for list_no in range(ivf.nlist):
+            size = ivf.invlists.list_size(list_no)
+            if size:
+                list_ids = faiss.rev_swig_ptr(ivf.invlists.get_ids(list_no), size)
+                list_ids[:] = new_position[list_ids]
+
+        vectorstore.docstore.delete([old_ids[p] for p in removed_positions.tolist()])
+        kept = [doc_id for p, doc_id in sorted(old_ids.items()) if keep[p]]
+        vectorstore.index_to_docstore_id = dict(enumerate(kept))
+        return vectorstore
+
+    @staticmethod
+    def _manifest_version(manifest):
+        """A short fingerprint of the indexed files and their vector ids."""
+        # Only content and ids count; a touched but unchanged file keeps the version, and files
+        # that failed to load (no ids) do not change what the index answers
+        contents = {file: (entry.get("sha256"), entry["ids"]) for file, entry in manifest.items() if entry["ids"]}
+        if not contents:
+            return None
+        payload = json.dumps(contents, sort_keys=True).encode("utf-8")
+        return hashlib.sha256(payload).hexdigest()[:16]
+
+    @staticmethod
+    def _diff_manifest(manifest, current_metadata):
+        """Split files into (removed, changed, added) relative to the manifest."""
+        removed = [file for file in manifest if file not in current_metadata]
+        # Manifests written before content hashing have no sha256, so their files count as changed
+        changed = [
+            file for file, metadata in current_metadata.items()
+            if file in manifest and manifest[file].get("sha256") != metadata["sha256"]
+        ]
+        added = [file for file in current_metadata if file not in manifest]
+        return removed, changed, added
+
+    def _clear_cache(self):
+        paths = [
+            self.index_file, self.docstore_file, self.manifest_file, self.keyword_file, self.last_used_file,
+            self.legacy_docstore_file, self.legacy_keyword_file,
+        ]
+        for path in paths + self.legacy_files:
+            if os.path.exists(path):
+                os.remove(path)
     
     # --- START: Change 2 (New helper for dynamic loading) ---
     def _get_loader(self, file_path):
         """Selects the appropriate LangChain DocumentLoader based on file extension."""
-        extension = os.path.splitext(file_path)[1].lower()
-        
-        # Mapping common extensions to specific loaders
-        loader_map = {
-            ".pdf": PyPDFLoader,
-            ".txt": TextLoader,
-            ".sql": TextLoader,  # Example: Treating SQL files as text
-            ".csv": UnstructuredFileLoader,
-            ".docx": UnstructuredFileLoader,
-            ".pptx": UnstructuredFileLoader,
-        }
-        
-        # Default to UnstructuredFileLoader for maximum compatibility
-        Loader = loader_map.get(extension, UnstructuredFileLoader)
-        return Loader(file_path)
+        return get_loader(file_path)
     # --- END: Change 2 ---
 
+    def _load_and_split(self, file):
+        """Load a single file and split it into chunks. Returns None if loading failed."""
+        result = load_and_split_file(file, self.chunk_size, self.chunk_overlap, self.file_timeout)
+        return self._report_load_result(file, result)
+
+    def _report_load_result(self, file, result):
+        chunks, doc_count, loader_name, error, timings = result
+        for stage, seconds in timings.items():
+            tracer.record(f"index.{stage}", seconds, file=os.path.basename(file), loader=loader_name)
+        if error is not None:
+            tracer.incr("index_file_errors_total")
+            print(f"[ERROR] Failed to load file {file}. Skipping. Error: {error}")
+            self._load_errors[file] = str(error)
+            return None
+        print(f"[INFO] Loaded file: {file} using {loader_name}")
+        print(f"[INFO] {doc_count} documents loaded from {file}")
+        return chunks
+
+    def _stream_chunks(self, file):
+        """
+        Lazily load `file` page by page and yield its chunks, so memory stays bounded by
+        a few pages plus one embedding batch however large the file is.
+
+        Pages are parsed in a separate process. If it produces no page for `file_timeout`
+        seconds, the parser is treated as hung: the process is killed and TimeoutError raised.
+        """
+        loader_name = get_loader(file).__class__.__name__
+        print(f"[INFO] Streaming file: {file} using {loader_name}")
+        context = resources.worker_context()
+        # A few pages in flight: parsing runs ahead of embedding without holding the whole file
+        pages = context.Queue(maxsize=4)
+        process = context.Process(
+            target=stream_file_chunks, args=(file, self.chunk_size, self.chunk_overlap, pages),
+            name="stream-loader", daemon=True,
+        )
+        process.start()
+        load_seconds = split_seconds = 0.0
+        try:
+            waited_since = time.monotonic()
+            while True:
+                try:
+                    message = pages.get(timeout=1.0)
+                except queue.Empty:
+                    if not process.is_alive():
+                        raise RuntimeError(f"loader process exited with code {process.exitcode}")
+                    if self.file_timeout and time.monotonic() - waited_since > self.file_timeout:
+                        raise TimeoutError(f"no page loaded for {self.file_timeout}s")
+                    continue
+                if message[0] == "done":
+                    if message[1] is not None:
+                        raise RuntimeError(message[1])
+                    break
+                _, chunks, load, split = message
+                load_seconds += load
+                split_seconds += split
+                yield from chunks
+                # Time spent embedding the chunks does not count against the parser
+                waited_since = time.monotonic()
+        finally:
+            if process.is_alive():
+                process.terminate()
+            process.join()
+            name = os.path.basename(file)
+            tracer.record("index.load", load_seconds, file=name, loader=loader_name, streamed=True)
+            tracer.record("index.split", split_seconds, file=name, streamed=True)
+
+    def _load_and_split_files(self, files):
+        """
+        Yield (file, chunks) in input order, loading and splitting files in a process pool.
+
+        `chunks` is None for files that failed to load or exceeded `file_timeout`.
+        Files of at least `stream_threshold_bytes` are not sent to the pool; their `chunks`
+        is a generator from `_stream_chunks` instead of a list.
+        Results are consumed in order, so embedding of the first files can start while
+        later files are still being loaded; at most 2 x `load_workers` files are loaded ahead.
+        """
+        small_files = [file for file in files if os.path.getsize(file) < self.stream_threshold_bytes]
+        workers = min(self.load_workers, len(small_files))
+        # A timeout can only be enforced on a worker process (SIGALRM needs the main thread, and
+        # indexing runs on a background thread), so timed files always go through the pool
+        if workers <= 1 and not self.file_timeout:
+            for file in files:
+                if file in small_files:
+                    yield file, self._load_and_split(file)
+                else:
+                    yield file, self._stream_chunks(file)
+            return
+
+        if small_files:
+            print(f"[INFO] Loading {len(small_files)} files with {max(workers, 1)} worker processes")
+        # The pool is shared by every load in the process and sized by `load_workers`
+        pool = resources.get_load_pool(self.load_workers)
+
+        def submit(file):
+            return pool.submit(load_and_split_file, file, self.chunk_size, self.chunk_overlap, self.file_timeout)
+
+        # Only a few files are loaded ahead of the one being embedded, so memory does not grow
+        # with the corpus; the next file is submitted as each result is taken
+        window = 2 * self.load_workers
+        pending = iter(small_files)
+        futures = {}
+
+        def fill():
+            for file in itertools.islice(pending, max(window - len(futures), 0)):
+                futures[file] = submit(file)
+
+        fill()
+        try:
+            for file in files:
+                if file not in futures:
+                    yield file, self._stream_chunks(file)
+                    continue
+                for attempt in range(2):
+                    try:
+                        # The worker enforces the timeout itself where it can; this is a safety net
+                        result = futures[file].result(timeout=self.file_timeout * 2 if self.file_timeout else None)
+                        break
+                    except FuturesTimeoutError:
+                        result, retry = (None, 0, None, f"timed out after {self.file_timeout}s", {}), False
+                    except BrokenProcessPool as e:
+                        # A worker crashed, or another load terminated the pool; try once more in a new one
+                        result, retry = (None, 0, None, e, {}), attempt == 0
+                    except Exception as e:
+                        result = (None, 0, None, e, {})
+                        break
+                    # The stuck or dead worker goes with its pool; unfinished files move to a new pool
+                    resources.terminate_load_pool(self.load_workers, pool)
+                    pool = resources.get_load_pool(self.load_workers)
+                    for other, future in list(futures.items()):
+                        if other != file and not (future.done() and future.exception() is None):
+                            futures[other] = submit(other)
+                    if not retry:
+                        break
+                    futures[file] = submit(file)
+                del futures[file]
+                fill()
+                yield file, self._report_load_result(file, result)
+        finally:
+            # Files not started yet are not loaded when the caller stops early (e.g. a cancelled job)
+            for future in futures.values():
+                future.cancel()
+
+    def _embeddings(self):
+        return resources.get_embeddings(
+            self.model_name, batch_size=self.embed_batch_size,
+            normalize=self.normalize_embeddings, threads=self.embed_threads,
+        )
+
+    def _embed_and_add(self, vectorstore, batch):
+        """Embed one batch of (chunk, id) pairs and add it to the index, creating it if needed."""
+        with tracer.span("index.embed", chunks=len(batch)) as span:
+            vectorstore = self._embed_batch(vectorstore, batch, span)
+        tracer.incr("index_chunks_embedded_total", len(batch))
+        return vectorstore
+
+    def _embed_batch(self, vectorstore, batch, span):
+        start = time.perf_counter()
+        hits = self.embedding_cache.hits
+        embeddings = self._embeddings()
+        texts = [chunk.page_content for chunk, _ in batch]
+        metadatas = [chunk.metadata for chunk, _ in batch]
+        ids = [doc_id for _, doc_id in batch]
+        # Normalised and raw vectors differ, so they are cached under different keys
+        cache_key = f"{self.model_name}|normalize={self.normalize_embeddings}"
+        vectors = self.embedding_cache.embed_documents(embeddings, cache_key, texts)
+        span.set(cache_hits=self.embedding_cache.hits - hits)
+        text_embeddings = list(zip(texts, vectors))
+        if vectorstore is None:
+            vectorstore = FAISS.from_embeddings(text_embeddings, embeddings, metadatas=metadatas, ids=ids)
+            # Keep chunks in SQLite rather than in memory while the rest of the corpus is added
+            vectorstore.docstore = SQLiteDocstore.from_docstore(vectorstore.docstore, ids)
+        else:
+            vectorstore.add_embeddings(text_embeddings, metadatas=metadatas, ids=ids)
+        for text, doc_id in zip(texts, ids):
+            self.keyword_index.add(doc_id, text)
+        self._embed_stats["chunks"] += len(batch)
+        self._embed_stats["seconds"] += time.perf_counter() - start
+        return vectorstore
+
     # --- START: Change 3 (Rename parameter to generic 'files') ---
-    def load_or_create_vectorstore(self, files, rebuild=False):
+    def _report_progress(self, fraction, message):
+        if self.progress_callback is not None:
+            self.progress_callback(fraction, message)
+
+    def load_or_create_vectorstore(self, files, rebuild=False, progress_callback=None):
         """
         Load cached FAISS vectorstore, or create a new one from multiple file types.
-        Automatically rebuilds if files have changed.
+        Automatically re-indexes only the files that were added, changed or removed.
+
+        Each document set has its own index directory, guarded by a file lock so concurrent
+        sessions and processes wait for each other instead of clobbering the same index.
+
+        Args:
+            files (list): Paths of the documents in the set.
+            rebuild (bool): Discard the cached index and rebuild it from scratch.
+            progress_callback (callable, optional): Called as `progress_callback(fraction, message)`
+                while files are indexed, with `fraction` between 0 and 1.
         """
-        # Check if rebuild is needed
-        if rebuild or self._has_file_changed(files):
+        self.progress_callback = progress_callback
+        self._use_index_dir(files)
+        with tracer.span("index.load_or_create", files=len(files), rebuild=rebuild) as span:
+            start = time.perf_counter()
+            with file_lock(self.lock_file):
+                tracer.record("index.lock_wait", time.perf_counter() - start)
+                os.makedirs(self.index_dir, exist_ok=True)
+                vectorstore = self._load_or_update(files, rebuild)
+                if vectorstore is not None:
+                    with open(self.last_used_file, "w") as f:
+                        f.write(str(time.time()))
+            self._evict_old_indexes()
+            span.set(index_version=self.index_version, updated=self.replaced_index_version is not None)
+        return vectorstore
+
+    def _load_or_update(self, files, rebuild):
+        if rebuild:
             # --- START: Change 3 (Update print statement) ---
-            print("[INFO] Rebuilding vectorstore due to file changes or rebuild request...")
+            print("[INFO] Rebuilding vectorstore due to rebuild request...")
             # --- END: Change 3
-            if os.path.exists(self.cache_file):
-                os.remove(self.cache_file)
-            if os.path.exists(self.metadata_file):
-                os.remove(self.metadata_file)
+            self._clear_cache()
 
-        # Load cache if exists
-        if os.path.exists(self.cache_file) and not rebuild:
-            print("[INFO] Loading cached vectorstore...")
-            with open(self.cache_file, "rb") as f:
-                vectorstore = pickle.load(f)
-            print(f"[INFO] Loaded vectorstore with {len(vectorstore.index_to_docstore_id)} vectors.")
-            return vectorstore
+        self.replaced_index_version = None
+        self.keyword_index = None
 
-        # Build new vectorstore
-        # --- START: Change 3 (Update print statement) ---
-        print("[INFO] Building vectorstore from files...")
-        # --- END: Change 3
-        
-        docs = []
-        # --- START: Change 4 (Update loading loop to handle all files) ---
+        # Without both the index and its manifest we cannot map vectors to files
+        has_cache = os.path.exists(self.index_file) and (
+            os.path.exists(self.docstore_file) or os.path.exists(self.legacy_docstore_file)
+        )
+        seeded = False
+        if not has_cache and not rebuild:
+            seeded = has_cache = self._seed_from_overlapping_index(files)
+        manifest = self._load_manifest() if has_cache else {}
+        current_metadata = self._get_file_metadata(files, manifest)
         for file in files:
-            if not os.path.exists(file):
-                 print(f"[WARNING] File not found and skipped: {file}")
-                 continue
-                 
+            if file not in current_metadata:
+                print(f"[WARNING] File not found and skipped: {file}")
+        removed, changed, added = self._diff_manifest(manifest, current_metadata)
+
+        # Load cache if exists
+        vectorstore = None
+        # FAISS.from_embeddings starts a fresh store with an exact flat index
+        self._index_spec = "Flat"
+        if manifest:
+            print("[INFO] Loading cached vectorstore...")
             try:
-                # Use the new dynamic loader function
-                loader = self._get_loader(file)
-                print(f"[INFO] Loading file: {file} using {loader.__class__.__name__}")
-                file_docs = loader.load()
-                print(f"[INFO] {len(file_docs)} documents loaded from {file}")
-                docs.extend(file_docs)
+                # Memory-map the index unless we are about to modify it
+                vectorstore = self._load_vectorstore(mmap=not (removed or changed or added))
+                print(f"[INFO] Loaded vectorstore with {len(vectorstore.index_to_docstore_id)} vectors.")
             except Exception as e:
-                print(f"[ERROR] Failed to load file {file}. Skipping. Error: {e}")
+                print(f"[WARNING] Could not load cached vectorstore, rebuilding. Error: {e}")
+                self._index_spec = "Flat"
+                manifest = {}
+                removed, changed, added = self._diff_manifest(manifest, current_metadata)
+
+        self.index_version = self._manifest_version(manifest)
+        if not (removed or changed or added):
+            if vectorstore is not None:
+                # Same content with a new stat (e.g. a touched file): remember it to skip rehashing
+                touched = {
+                    file: metadata for file, metadata in current_metadata.items()
+                    if (manifest[file].get("size"), manifest[file].get("mtime")) != (metadata["size"], metadata["mtime"])
+                }
+                if touched:
+                    for file, metadata in touched.items():
+                        manifest[file].update(metadata)
+                    self._save_manifest(manifest)
+                spec = self._desired_index_spec(vectorstore.index.ntotal, vectorstore.index.d)
+                if spec != self._index_spec:
+                    # Index type configuration changed; convert a writable copy and save it
+                    print(f"[INFO] Converting {self._index_spec} index to {spec}")
+                    vectorstore = self._rebuild_index(self._load_vectorstore(mmap=False), spec)
+                    self._save_vectorstore(vectorstore)
+                self.keyword_index = self._load_keyword_index(vectorstore)
+            return vectorstore
+        previous_version = self.index_version
+
+        print(
+            f"[INFO] Updating vectorstore: {len(added)} added, "
+            f"{len(changed)} changed, {len(removed)} removed file(s)"
+        )
+
+        self.keyword_index = self._load_keyword_index(vectorstore) if vectorstore is not None else KeywordIndex()
+
+        # HNSW cannot remove vectors, so its deletions are collected and dropped by a single
+        # rebuild once all files are added; other index types delete in place right away
+        deferred_ids = []
+
+        def delete(vectorstore, ids):
+            if "HNSW" in self._index_spec:
+                deferred_ids.extend(ids)
+                return vectorstore
+            return self._delete_vectors(vectorstore, ids)
+
+        # Drop the vectors of removed and changed files by their stored ids
+        stale_ids = [doc_id for file in removed + changed for doc_id in manifest[file]["ids"]]
+        if vectorstore is not None and stale_ids:
+            vectorstore = delete(vectorstore, stale_ids)
+            self.keyword_index.remove(stale_ids)
+            print(f"[INFO] Removed {len(stale_ids)} stale vectors")
+        for file in removed + changed:
+            del manifest[file]
+
+        # Embed only the added and changed files; the embedding cache skips chunk texts seen before.
+        # Chunks are streamed through the model in batches and added to the index as they go.
+        self.embedding_cache.reset_stats()
+        self._embed_stats = {"chunks": 0, "seconds": 0.0}
+        self._load_errors = {}
+        batch = []
+        to_index = changed + added
+        for done, (file, chunks) in enumerate(self._load_and_split_files(to_index)):
+            self._report_progress(done / len(to_index), f"Indexing {os.path.basename(file)}")
+            if chunks is None:
+                # Remember the failure with the file's hash, so it is only retried once its content changes
+                manifest[file] = dict(current_metadata[file], ids=[], error=self._load_errors.get(file))
+                continue
+            ids = []
+            failed = False
+            iterator = iter(chunks)
+            while True:
+                # Only reading chunks is guarded; embedding or progress callback errors abort the update
+                try:
+                    chunk = next(iterator)
+                except StopIteration:
+                    break
+                except Exception as e:
+                    print(f"[ERROR] Failed to load file {file}. Skipping. Error: {e}")
+                    failed, error = True, str(e)
+                    break
+                doc_id = uuid.uuid4().hex
+                ids.append(doc_id)
+                batch.append((chunk, doc_id))
+                if len(batch) >= self.embed_batch_size:
+                    vectorstore = self._embed_and_add(vectorstore, batch)
+                    batch = []
+                    self._report_progress(
+                        done / len(to_index),
+                        f"Indexing {os.path.basename(file)}: {len(ids)} chunks embedded",
+                    )
+            if failed:
+                # A streamed file failed part-way; roll back the chunks already taken from it
+                pending = {doc_id for _, doc_id in batch}
+                added_ids = [doc_id for doc_id in ids if doc_id not in pending]
+                file_ids = set(ids)
+                batch = [(chunk, doc_id) for chunk, doc_id in batch if doc_id not in file_ids]
+                if vectorstore is not None and added_ids:
+                    vectorstore = delete(vectorstore, added_ids)
+                    self.keyword_index.remove(added_ids)
+                manifest[file] = dict(current_metadata[file], ids=[], error=error)
                 continue
+            print(f"[INFO] Queued {len(ids)} text chunks from {file} for embedding")
+            manifest[file] = dict(current_metadata[file], ids=ids)
+        if batch:
+            vectorstore = self._embed_and_add(vectorstore, batch)
+        if deferred_ids:
+            remaining = vectorstore.index.ntotal - len(deferred_ids)
+            vectorstore = self._rebuild_index(
+                vectorstore, self._desired_index_spec(remaining, vectorstore.index.d), exclude_ids=deferred_ids
+            )
+        self._report_progress(1.0, "Saving index")
 
-        if not docs:
+        seconds = self._embed_stats["seconds"]
+        rate = self._embed_stats["chunks"] / seconds if seconds else 0.0
+        print(
+            f"[INFO] Embedded {self._embed_stats['chunks']} chunks in {seconds:.2f}s "
+            f"({rate:.1f} chunks/sec, batch size {self.embed_batch_size})"
+        )
+        print(
+            f"[INFO] Embedding cache: {self.embedding_cache.hits} hits, "
+            f"{self.embedding_cache.misses} misses"
+        )
+
+        if vectorstore is None or not vectorstore.index_to_docstore_id:
             # --- START: Change 3 (Update print statement) ---
             print("[WARNING] No documents loaded from files!")
             # --- END: Change 3
+            self._clear_cache()
+            self.index_version = None
+            self.keyword_index = None
             return None
-        # --- END: Change 4 ---
 
-        splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
-        chunks = splitter.split_documents(docs)
-        print(f"[INFO] Created {len(chunks)} text chunks for embeddings")
-
-        embeddings = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
-        vectorstore = FAISS.from_documents(chunks, embeddings)
-        print(f"[INFO] Vectorstore created with {len(vectorstore.index_to_docstore_id)} vectors")
-
-        # Cache vectorstore
-        with open(self.cache_file, "wb") as f:
-            pickle.dump(vectorstore, f)
-            print(f"[INFO] Vectorstore cached at {self.cache_file}")
-
-        # Save file metadata
-        with open(self.metadata_file, "wb") as f:
-            # --- START: Change 3 (Use new generic metadata function) ---
-            pickle.dump(self._get_file_metadata(files), f)
-            # --- END: Change 3 ---
+        self.index_version = self._manifest_version(manifest)
+        if self.index_version == previous_version:
+            # Only failed files were (re)tried: the index is unchanged, so keep the cached files
+            # and answers, and just record the failures
+            self._save_manifest(manifest)
+            print("[INFO] Indexed content unchanged")
+            return vectorstore
+        if not seeded:
+            # A seeded copy's old version still belongs to the index it was copied from
+            self.replaced_index_version = previous_version
+
+        spec = self._desired_index_spec(vectorstore.index.ntotal, vectorstore.index.d)
+        if spec != self._index_spec:
+            vectorstore = self._rebuild_index(vectorstore, spec)
+
+        print(f"[INFO] Vectorstore now holds {len(vectorstore.index_to_docstore_id)} vectors")
+
+        # Cache vectorstore in FAISS's native format; the embedding model is shared per process
+        self._save_vectorstore(vectorstore)
+        self.keyword_index.save(self.keyword_file)
+        print(f"[INFO] Vectorstore cached at {self.index_file}")
+
+        # Save the per-file manifest
+        self._save_manifest(manifest)
 
         return vectorstore
 